@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+#
+# Bibid dictionary, dense integer surrogates for bibid strings
+#
+# Bibids are strings because Harvard's have a -X check digit, so the
+# in-memory data of mx_get_oclc_workids.py and mx_analyze_workids.py
+# holds millions of small str objects (and a set per oclcnum). With a
+# bibid_dict each distinct bibid is given a surrogate on first sight,
+# 0, 1, 2... (kept below 2^31 so it fits an int32), and the
+# structures hold those instead. The bibid of each surrogate is kept
+# packed into an int64 by an institution codec (see CODECS):
+#
+#   cornell  - plain integer bibids, e.g. 1234567
+#   harvard  - digits plus hyphen and check digit or X, e.g. 004082148-X
+#   auto     - either, as bibid_index.encode_bibid()
+#
+# Codecs are lossless (leading zeros are kept), bibids that a codec
+# can't pack are kept as strings in a side list. Strings are only
+# rebuilt when writing output.
+#
+import sys
+import re
+from array import array
+import bibid_index
+from bibid_index import INT64
+
+MAX_SURROGATE = 2**31-1
+
+
+class integer_codec(object):
+    """Bibids that are plain integers without leading zeros"""
+
+    name = 'cornell'
+    INTEGER_RE = re.compile(r'[1-9]\d{0,17}$')
+
+    def encode(self,bibid):
+        """Code for bibid or None if it doesn't fit"""
+        if (self.INTEGER_RE.match(bibid)):
+            return int(bibid)
+        return None
+
+    def decode(self,code):
+        return str(code)
+
+
+class check_digit_codec(object):
+    """Bibids of up to 15 digits, hyphen and check digit or X
+
+    Packed as bibid_index.encode_bibid() does, number<<8 |
+    ndigits<<4 | check.
+    """
+
+    name = 'harvard'
+    CHECK_DIGIT_RE = re.compile(r'(\d{1,15})-([0-9X])$')
+
+    def encode(self,bibid):
+        m = self.CHECK_DIGIT_RE.match(bibid)
+        if (m is None):
+            return None
+        (digits,check) = m.groups()
+        check = (10 if check=='X' else int(check))
+        return (int(digits)<<8) | (len(digits)<<4) | check
+
+    def decode(self,code):
+        return bibid_index.decode_bibid(code)
+
+
+class auto_codec(object):
+    """Either of the above, see bibid_index.encode_bibid()"""
+
+    name = 'auto'
+
+    def encode(self,bibid):
+        if (bibid_index.BIBID_RE.match(bibid)):
+            return bibid_index.encode_bibid(bibid)
+        return None
+
+    def decode(self,code):
+        return bibid_index.decode_bibid(code)
+
+
+CODECS = dict([(c.name,c) for c in (integer_codec,check_digit_codec,auto_codec)])
+
+
+class bibid_dict(object):
+
+    def __init__(self,codec='auto'):
+        """Empty dictionary packing bibids with codec (name from CODECS)"""
+        if (codec not in CODECS):
+            raise ValueError("Unknown bibid codec '%s', must be one of %s" % (codec,", ".join(sorted(CODECS))))
+        self.codec = CODECS[codec]()
+        # code (or odd bibid string) -> surrogate, dropped by freeze()
+        self.ids = {}
+        # surrogate -> code, negative for index into self.odd
+        self.codes = array(INT64)
+        self.odd = []
+
+    def id(self,bibid):
+        """Surrogate for bibid, new one if not seen before"""
+        code = self.codec.encode(bibid)
+        key = (bibid if code is None else code)
+        surrogate = self.ids.get(key)
+        if (surrogate is None):
+            surrogate = len(self.codes)
+            if (surrogate>MAX_SURROGATE):
+                raise ValueError("More than %d bibids, surrogate overflow" % (MAX_SURROGATE+1))
+            if (code is None):
+                self.odd.append(bibid)
+                code = -len(self.odd)
+            self.ids[key] = surrogate
+            self.codes.append(code)
+        return surrogate
+
+    def bibid(self,surrogate):
+        """Bibid string for surrogate"""
+        code = self.codes[surrogate]
+        if (code<0):
+            return self.odd[-code-1]
+        return self.codec.decode(code)
+
+    def freeze(self):
+        """Drop lookup by bibid once no new bibids are expected
+
+        After this bibid() still works but id() must not be called.
+        """
+        self.ids = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def memory_bytes(self):
+        """Approximate bytes used by dictionary"""
+        n = sys.getsizeof(self.codes) + sys.getsizeof(self.odd) + sum([sys.getsizeof(x) for x in self.odd])
+        if (self.ids is not None):
+            n += deep_size(self.ids)
+        return n
+
+
+class surrogate_index(object):
+    """oclcnum -> bibids with bibids held as surrogates of a bibid_dict
+
+    Supports the parts of the dict interface used on
+    bibid_oclcnums.bibids (in, [], len, keys), like
+    bibid_index.compact_bibid_index, but [] gives surrogates. Each
+    oclcnum maps to one surrogate, or a tuple of them in the order
+    added if it has more than one bibid, rather than to a set of str.
+    """
+
+    def __init__(self,bibids):
+        self.bibids = bibids
+        self.index = {}
+
+    def add(self,oclcnum,bibid):
+        """Add mapping of oclcnum to bibid string"""
+        surrogate = self.bibids.id(bibid)
+        have = self.index.get(oclcnum)
+        if (have is None):
+            self.index[oclcnum] = surrogate
+        elif (type(have) is tuple):
+            if (surrogate not in have):
+                self.index[oclcnum] = have+(surrogate,)
+        elif (have!=surrogate):
+            self.index[oclcnum] = (have,surrogate)
+
+    def __contains__(self,oclcnum):
+        return oclcnum in self.index
+
+    def __getitem__(self,oclcnum):
+        """List of surrogates for oclcnum
+
+        In the order that a set of the bibid strings, built in the order
+        added, iterates so that matches are added in the same order as
+        with the dict of sets.
+        """
+        have = self.index[oclcnum]
+        if (type(have) is not tuple):
+            return [have]
+        by_bibid = dict([(self.bibids.bibid(s),s) for s in have])
+        return [by_bibid[b] for b in set([self.bibids.bibid(s) for s in have])]
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def memory_bytes(self):
+        """Bytes used by index and bibid dictionary"""
+        return deep_size(self.index)+self.bibids.memory_bytes()
+
+
+def deep_size(obj):
+    """Bytes used by obj and the objects it holds, each counted once
+
+    Follows dicts, lists, tuples and sets, for reporting the memory of
+    the in-memory data structures. Arrays are counted with their data.
+    """
+    seen = set()
+    n = 0
+    stack = [obj]
+    while (stack):
+        o = stack.pop()
+        if (id(o) in seen):
+            continue
+        seen.add(id(o))
+        n += sys.getsizeof(o)
+        if (isinstance(o,dict)):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif (isinstance(o,(list,tuple,set,frozenset))):
+            stack.extend(o)
+    return n
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#
+# Compact oclcnum -> bibids index
+#
+# A dict of int -> set(str) costs hundreds of bytes per entry, many GB
+# for Harvard's 13.6M bibs. This index instead keeps sorted parallel
+# int64 arrays: the distinct oclcnum keys, offsets into a column of
+# encoded bibids, and the encoded bibids themselves. Lookup is by
+# binary search on the keys. It supports the parts of the dict
+# interface used on bibid_oclcnums.bibids (in, [], len, keys) so the
+# concordance loop is unchanged.
+#
+# Bibids are encoded losslessly into an int64, see encode_bibid().
+# Anything that doesn't fit that pattern is interned in a small table
+# and given a negative code.
+#
+# finalize() sorts with NumPy if available so that no Python object is
+# made per mapping, else with sorted() which takes several times the
+# memory of the index while it runs.
+#
+import sys
+import re
+import bisect
+from array import array
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Python 2 array has no 'q' but 'l' is 64 bit on our 64 bit platforms
+try:
+    INT64 = array('q').typecode
+except ValueError:
+    INT64 = 'l'
+assert array(INT64).itemsize==8
+
+# Bibids as digits optionally followed by Harvard's -check digit
+BIBID_RE = re.compile(r'(\d{1,15})(?:-([0-9X]))?$')
+NO_CHECK = 15
+
+
+def encode_bibid(bibid,odd=None):
+    """Encode string bibid as an int64
+
+    Bibids of up to 15 digits, optionally with Harvard's hyphen and
+    check digit or X (e.g. 004082148-X), are packed as number<<8 |
+    ndigits<<4 | check so that leading zeros are kept. Any other bibid
+    is appended to list odd (if given) and coded as -(index+1).
+    """
+    m = BIBID_RE.match(bibid)
+    if (m):
+        digits = m.group(1)
+        check = m.group(2)
+        if (check is None):
+            check = NO_CHECK
+        elif (check=='X'):
+            check = 10
+        else:
+            check = int(check)
+        return (int(digits)<<8) | (len(digits)<<4) | check
+    if (odd is None):
+        raise ValueError("Cannot encode bibid '%s'" % (bibid))
+    odd.append(bibid)
+    return -len(odd)
+
+def decode_bibid(code,odd=None):
+    """Inverse of encode_bibid()"""
+    if (code<0):
+        return odd[-code-1]
+    check = code & 0xF
+    bibid = "%0*d" % ((code>>4) & 0xF, code>>8)
+    if (check==NO_CHECK):
+        return bibid
+    return bibid + '-' + ('X' if check==10 else str(check))
+
+
+class compact_bibid_index(object):
+
+    def __init__(self):
+        # Columns while building, in order added
+        self.add_oclcnums = array(INT64)
+        self.add_codes = array(INT64)
+        # Sorted index after finalize()
+        self.oclcnums = array(INT64)
+        self.offsets = array(INT64)
+        self.codes = array(INT64)
+        # Bibids that don't fit encode_bibid() pattern, and their codes
+        self.odd_bibids = []
+        self.odd_codes = {}
+
+    def add(self,oclcnum,bibid):
+        """Add mapping of oclcnum to bibid, call finalize() when done"""
+        try:
+            code = encode_bibid(bibid)
+        except ValueError:
+            # intern so that repeats have the same code
+            code = self.odd_codes.get(bibid)
+            if (code is None):
+                code = encode_bibid(bibid,self.odd_bibids)
+                self.odd_codes[bibid] = code
+        self.add_oclcnums.append(oclcnum)
+        self.add_codes.append(code)
+
+    def finalize(self):
+        """Sort mappings added into the index columns
+
+        The sort is stable so bibids for each oclcnum stay in the order
+        added, duplicate oclcnum to bibid mappings are dropped.
+        """
+        if (np is not None and len(self.add_oclcnums)>0):
+            self.finalize_numpy()
+            return
+        order = sorted(xrange(len(self.add_oclcnums)),key=self.add_oclcnums.__getitem__)
+        last = None
+        seen = set()
+        for j in order:
+            oclcnum = self.add_oclcnums[j]
+            code = self.add_codes[j]
+            if (oclcnum!=last):
+                self.oclcnums.append(oclcnum)
+                self.offsets.append(len(self.codes))
+                last = oclcnum
+                seen = set()
+            if (code not in seen):
+                seen.add(code)
+                self.codes.append(code)
+        self.offsets.append(len(self.codes))
+        del order
+        self.add_oclcnums = array(INT64)
+        self.add_codes = array(INT64)
+
+    def finalize_numpy(self):
+        """finalize() with NumPy stable sorts over int64 columns"""
+        oclcnums = np.frombuffer(self.add_oclcnums,dtype=np.int64)
+        codes = np.frombuffer(self.add_codes,dtype=np.int64)
+        order = np.argsort(oclcnums,kind='mergesort')
+        oclcnums = oclcnums[order]
+        codes = codes[order]
+        del order
+        # Drop later repeats of the same mapping: sorted by oclcnum then
+        # code (stable, so first added first) a repeat is the same as
+        # the one before
+        by_code = np.lexsort((codes,oclcnums))
+        keep = np.ones(len(codes),dtype=bool)
+        repeat = ((oclcnums[by_code[1:]]==oclcnums[by_code[:-1]]) &
+                  (codes[by_code[1:]]==codes[by_code[:-1]]))
+        keep[by_code[1:][repeat]] = False
+        del by_code, repeat
+        oclcnums = oclcnums[keep]
+        codes = codes[keep]
+        del keep
+        # Each oclcnum starts where it differs from the one before
+        starts = np.concatenate(([0],np.flatnonzero(oclcnums[1:]!=oclcnums[:-1])+1)).astype(np.int64)
+        self.oclcnums.fromstring(oclcnums[starts].tostring())
+        self.offsets.fromstring(starts.tostring())
+        self.offsets.append(len(codes))
+        self.codes.fromstring(codes.tostring())
+        self.add_oclcnums = array(INT64)
+        self.add_codes = array(INT64)
+
+    def _find(self,oclcnum):
+        """Position of oclcnum in keys or -1"""
+        i = bisect.bisect_left(self.oclcnums,oclcnum)
+        if (i<len(self.oclcnums) and self.oclcnums[i]==oclcnum):
+            return i
+        return -1
+
+    def __contains__(self,oclcnum):
+        return self._find(oclcnum)>=0
+
+    def __getitem__(self,oclcnum):
+        """Set of bibids for oclcnum
+
+        Returned as a set built in the order added so that iteration
+        order is the same as for the dict of sets.
+        """
+        i = self._find(oclcnum)
+        if (i<0):
+            raise KeyError(oclcnum)
+        return set([decode_bibid(self.codes[k],self.odd_bibids) for k in xrange(self.offsets[i],self.offsets[i+1])])
+
+    def __len__(self):
+        return len(self.oclcnums)
+
+    def keys(self):
+        return self.oclcnums
+
+    def memory_bytes(self):
+        """Approximate bytes used by index"""
+        n = (sys.getsizeof(self.odd_bibids) + sys.getsizeof(self.odd_codes) +
+             sum([sys.getsizeof(x) for x in self.odd_bibids]))
+        for a in (self.oclcnums,self.offsets,self.codes):
+            n += a.itemsize*len(a)
+        return n
+
+    def dict_memory_bytes(self,bibid_bytes=48):
+        """Rough estimate of bytes for the same data as a dict of sets
+
+        Counts the dict table (3 words per slot at 2/3 max load), an int
+        key object and set object per oclcnum, and a string object of
+        bibid_bytes (48 for a 10 character str) per bibid.
+        """
+        slots = 8
+        while (slots*2 < len(self.oclcnums)*3):
+            slots *= 2
+        return (slots*24 + len(self.oclcnums)*(sys.getsizeof(1)+sys.getsizeof(set([1]))) +
+                len(self.codes)*bibid_bytes)
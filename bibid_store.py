@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Indexed on-disk store of bibid to oclcnums data
+#
+# mx_grep_oclc.py output is a flat text file so every consumer has to
+# read and tokenize all of it, and finding the oclcnums of one bibid
+# means a full scan. With --write-sqlite the same data is also written
+# to a single SQLite file with one row per bibid,oclcnum pair:
+#
+#   pairs(bibid TEXT, pos INTEGER, oclcnum INTEGER)
+#   meta(key TEXT, value TEXT)  - version, counts and # comment lines
+#
+# pos is the position of the oclcnum on the bibid's line (so that
+# --first-oclcnum-only works the same) and rowid keeps the file order.
+# Indexes on bibid and oclcnum are built when the store is closed,
+# giving lookup both ways and iteration in oclcnum order.
+#
+import os
+import json
+import sqlite3
+import logging
+
+VERSION = 1
+SQLITE_MAGIC = 'SQLite format 3\x00'
+BATCH = 10000
+
+
+def is_store(file):
+    """True if file is an SQLite file (rather than text bibid to oclcnums data)"""
+    try:
+        fh = open(file,'rb')
+    except IOError:
+        return False
+    magic = fh.read(len(SQLITE_MAGIC))
+    fh.close()
+    return (magic==SQLITE_MAGIC)
+
+
+class bibid_store(object):
+
+    def __init__(self,file,create=False):
+        """Open store in file, or create new store (replacing any file)"""
+        self.file = file
+        self.create = create
+        self.pending = []
+        self.partial = ''
+        self.comments = []
+        self.num_lines = 0
+        self.num_pairs = 0
+        if (create):
+            if (os.path.exists(file)):
+                os.remove(file)
+            self.db = sqlite3.connect(file)
+            # store is rebuilt from scratch if a run fails, no need for
+            # the journal or syncs
+            self.db.execute("PRAGMA journal_mode=OFF")
+            self.db.execute("PRAGMA synchronous=OFF")
+            self.db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+            self.db.execute("CREATE TABLE pairs (bibid TEXT, pos INTEGER, oclcnum INTEGER)")
+        else:
+            if (not is_store(file)):
+                raise ValueError("%s is not a bibid store" % (file))
+            self.db = sqlite3.connect(file)
+            self.db.text_factory = str
+            meta = self.meta()
+            if (meta.get('version')!=VERSION):
+                raise ValueError("%s has bibid store version %s, expected %d" % (file,meta.get('version'),VERSION))
+            self.num_lines = meta['lines']
+            self.num_pairs = meta['pairs']
+            self.comments = meta['comments']
+
+    def meta(self):
+        """Dict of metadata, values decoded from JSON"""
+        return dict([(k,json.loads(v)) for (k,v) in self.db.execute("SELECT key,value FROM meta")])
+
+    def add(self,bibid,oclcnums):
+        """Add line for bibid with list of oclcnums"""
+        self.num_lines += 1
+        for (pos,oclcnum) in enumerate(oclcnums):
+            self.pending.append((bibid,pos,oclcnum))
+        if (len(self.pending)>=BATCH):
+            self._flush()
+
+    def write(self,text):
+        """Add mx_grep_oclc.py output text, so store can be used as a file
+
+        Text may end part way through a line, the rest is expected in
+        the next write. Comment lines are kept in meta.
+        """
+        lines = (self.partial+text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            if (line.startswith('#')):
+                self.comments.append(line)
+                continue
+            d = line.split()
+            if (len(d)>=2):
+                self.add(d[0],[int(x) for x in d[1:]])
+
+    def flush(self):
+        pass
+
+    def _flush(self):
+        self.db.executemany("INSERT INTO pairs VALUES (?,?,?)",self.pending)
+        self.num_pairs += len(self.pending)
+        self.pending = []
+
+    def close(self):
+        """Close store, when creating this writes the indexes and meta"""
+        if (self.create):
+            if (self.partial):
+                self.write('\n')
+            self._flush()
+            self.db.execute("CREATE INDEX pairs_bibid ON pairs (bibid)")
+            self.db.execute("CREATE INDEX pairs_oclcnum ON pairs (oclcnum)")
+            meta = {'version': VERSION, 'lines': self.num_lines,
+                    'pairs': self.num_pairs, 'comments': self.comments}
+            self.db.executemany("INSERT INTO meta VALUES (?,?)",[(k,json.dumps(v)) for (k,v) in meta.items()])
+            self.db.commit()
+            logging.warning("written %d bibid lines, %d oclcnums to %s" % (self.num_lines,self.num_pairs,self.file))
+            self.create = False
+        self.db.close()
+
+    def __len__(self):
+        """Number of bibid lines"""
+        return self.num_lines
+
+    def oclcnums(self,bibid):
+        """List of oclcnums for bibid, in line order"""
+        return [r[0] for r in self.db.execute("SELECT oclcnum FROM pairs WHERE bibid=? ORDER BY rowid",(bibid,))]
+
+    def bibids(self,oclcnum):
+        """List of bibids with oclcnum, in file order"""
+        return [r[0] for r in self.db.execute("SELECT bibid FROM pairs WHERE oclcnum=? ORDER BY rowid",(oclcnum,))]
+
+    def iter_pairs(self,first_oclcnum_only=False):
+        """Generator of (oclcnum, bibid) pairs in file order
+
+        The same pairs as mx_get_oclc_workids.py reads from the text
+        file, with first_oclcnum_only only the first on each line.
+        """
+        sql = "SELECT oclcnum,bibid FROM pairs"
+        if (first_oclcnum_only):
+            sql += " WHERE pos=0"
+        return self.db.execute(sql+" ORDER BY rowid")
+
+    def iter_by_oclcnum(self):
+        """Generator of (oclcnum, bibid) pairs in oclcnum order, then file order"""
+        return self.db.execute("SELECT oclcnum,bibid FROM pairs ORDER BY oclcnum,rowid")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+#
+# Bloom filter prefilter for concordance lines
+#
+# Almost all of the 343M concordance lines have oclcnums that aren't
+# in our data, yet each is split into three tokens and has three int()
+# conversions before the dict probe finds that out. A Bloom filter of
+# our oclcnums, keyed on their decimal strings, lets candidates() look
+# at just the first two columns of each raw line and skip it if
+# neither can be ours. Only the remaining candidates (our matches plus
+# the filter's false positives) go through the exact path, so matches
+# are the same.
+#
+# The filter sets k=2 bits per key. The positions are the low bits of
+# Python's string hash() and bits of that times MIX, as the high bits
+# of hash() vary little for short strings like oclcnums. It is only
+# good within one process (and those forked from it). The number of
+# bits is a power of 2 at least enough for the false positive rate
+# asked for.
+#
+# Raw columns only equal str(int(column)) if they are plain digits
+# without leading zeros, so a chunk of lines is only filtered if
+# clean() finds nothing else in it. Lines that aren't three tab
+# separated columns are always candidates so that the exact path logs
+# them as bad lines as before. Concordance data from OCLC is clean.
+#
+import math
+import string
+import logging
+
+FPR = 0.01
+DIGITS_TABS_NEWLINES = '0123456789\t\n'
+NEWLINE_TO_TAB = string.maketrans('\n','\t')
+MIX = 0x9E3779B1
+MIX_SHIFT = 28
+
+
+def clean(text):
+    """True if text is only tab separated columns of digits, no leading zeros
+
+    NONE is allowed as the last column.
+    """
+    tabs = text.translate(NEWLINE_TO_TAB)
+    if (tabs.startswith('0') or tabs.startswith('\t') or '\t0' in tabs or '\t\t' in tabs):
+        return False
+    # only characters left should be from NONE workids
+    return (len(text.translate(None,DIGITS_TABS_NEWLINES))==4*text.count('\tNONE\n'))
+
+
+class bloom_filter(object):
+
+    def __init__(self,n,fpr=FPR):
+        """Empty filter sized for n keys with false positive rate fpr"""
+        n = max(n,1)
+        bits = -2.0*n/math.log(1.0-math.sqrt(fpr))
+        self.size_bits = 8
+        while (self.size_bits<bits):
+            self.size_bits *= 2
+        if (self.size_bits>2**32):
+            raise ValueError("Bloom filter for %d keys at false positive rate %g is too big" % (n,fpr))
+        self.mask = self.size_bits-1
+        self.bits = bytearray(self.size_bits//8)
+        self.n = 0
+        # Line counts, see add_counts()
+        self.checked = 0
+        self.skipped = 0
+        self.false_positives = 0
+        self.unchecked = 0
+
+    def add(self,key):
+        """Add string key"""
+        h = hash(key)
+        p = h & self.mask
+        self.bits[p>>3] |= (1<<(p&7))
+        p = ((h*MIX)>>MIX_SHIFT) & self.mask
+        self.bits[p>>3] |= (1<<(p&7))
+        self.n += 1
+
+    def __contains__(self,key):
+        """False if string key was definitely not added"""
+        h = hash(key)
+        p = h & self.mask
+        if (not self.bits[p>>3] & (1<<(p&7))):
+            return False
+        p = ((h*MIX)>>MIX_SHIFT) & self.mask
+        return bool(self.bits[p>>3] & (1<<(p&7)))
+
+    def candidates(self,lines,n=1):
+        """Filter lines of a chunk that is clean()
+
+        Returns (candidates, skipped, none_skipped) where candidates is
+        a list of (line number, line) counting from n for the lines that
+        might match, skipped is the number of lines skipped and
+        none_skipped the number of those with NONE workid. Doesn't
+        change the filter so can run in worker threads or processes.
+        """
+        bits = self.bits
+        mask = self.mask
+        mix = MIX
+        shift = MIX_SHIFT
+        candidates = []
+        skipped = 0
+        none_skipped = 0
+        for (n,line) in enumerate(lines,n):
+            try:
+                (oclcnum1,oclcnum2,workid) = line.split('\t')
+            except ValueError:
+                candidates.append((n,line))
+                continue
+            h = hash(oclcnum2)
+            p = h & mask
+            if (bits[p>>3] & (1<<(p&7))):
+                p = ((h*mix)>>shift) & mask
+                if (bits[p>>3] & (1<<(p&7))):
+                    candidates.append((n,line))
+                    continue
+            h = hash(oclcnum1)
+            p = h & mask
+            if (bits[p>>3] & (1<<(p&7))):
+                p = ((h*mix)>>shift) & mask
+                if (bits[p>>3] & (1<<(p&7))):
+                    candidates.append((n,line))
+                    continue
+            skipped += 1
+            if (workid=='NONE'):
+                none_skipped += 1
+        return(candidates,skipped,none_skipped)
+
+    def add_counts(self,checked,skipped,false_positives,unchecked):
+        """Add line counts from a chunk
+
+        checked lines were filtered, of which skipped were skipped and
+        false_positives passed but didn't match. unchecked lines were
+        in chunks that weren't clean().
+        """
+        self.checked += checked
+        self.skipped += skipped
+        self.false_positives += false_positives
+        self.unchecked += unchecked
+
+    def size_bytes(self):
+        return len(self.bits)
+
+    def expected_fpr(self):
+        """False positive rate per key expected for the keys added"""
+        return (1.0-math.exp(-2.0*self.n/self.size_bits))**2
+
+    def log(self,name):
+        """Log size, false positive rate and lines skipped
+
+        The false positive rate seen is per line, a line has two
+        chances at a false positive so this is about twice the rate
+        per key.
+        """
+        lines = self.checked+self.unchecked
+        logging.warning("%s: bloom filter of %d keys uses %d bytes, expected false positive rate %.4f" %
+                        (name,self.n,self.size_bytes(),self.expected_fpr()))
+        logging.warning("%s: skipped %d of %d lines (%.1f%%), %d false positives (rate %.4f per line), %d lines not checked" %
+                        (name,self.skipped,lines,100.0*self.skipped/max(lines,1),self.false_positives,
+                         float(self.false_positives)/max(self.skipped+self.false_positives,1),self.unchecked))
+
+
+def build(oclcnums,fpr=FPR):
+    """Bloom filter of the decimal strings of int oclcnums (a list or array)
+
+    Same as add(str(oclcnum)) for each, inlined as it is run for every
+    oclcnum we have.
+    """
+    bf = bloom_filter(len(oclcnums),fpr)
+    bits = bf.bits
+    mask = bf.mask
+    for oclcnum in oclcnums:
+        h = hash(str(oclcnum))
+        p = h & mask
+        bits[p>>3] |= (1<<(p&7))
+        p = ((h*MIX)>>MIX_SHIFT) & mask
+        bits[p>>3] |= (1<<(p&7))
+    bf.n = len(oclcnums)
+    return bf
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+#
+# Binary columnar interchange format for data between the mx_* scripts
+#
+# The stages pass each other whitespace separated text (bibid to
+# oclcnums, workid bibid pairs and workid to bibids) and every reader
+# spends its time on comment checks, split() and int() for each line.
+# This format holds the same lines as typed columns instead. Each line
+# "first v1 v2 ..." is one row per value:
+#
+#   first  - int64, the bibid or workid at the start of the line
+#   value  - int64, an oclcnum or bibid
+#   pos    - int64, position of value on its line, 0 starts a line
+#
+# Bibids are dictionary encoded per chunk, the column holds indexes
+# into a list of the distinct bibids of the chunk. The dictionary is
+# itself an int64 column of bibids packed with bibid_index.encode_bibid()
+# plus a list of any that don't pack. Each int64 column is stored with
+# its bytes shuffled (all first bytes, then all second bytes...) which
+# zlib compresses much better. A file is MAGIC then blocks of a type
+# byte, a 4 byte length and the payload:
+#
+#   H  header JSON: version, kind (see KINDS)
+#   C  comment line (text, without newline) in its place between rows
+#   D  chunk of rows: number of rows and number of dictionary entries,
+#      then the zlib compressed dictionary, odd bibids (newline
+#      separated) and first, value and pos columns, each preceded by
+#      its length
+#   E  end JSON: number of rows and lines, missing if file truncated
+#
+# Numbers are kept as ints, so any zero padding of oclcnums in text
+# (which all readers ignore) is lost. Blank lines are dropped.
+#
+# Files are written by name with a .mxc extension (see open_output())
+# and recognized by MAGIC when read (see open_input()), so the
+# scripts can read and write either format. mx_convert.py converts to
+# and from text.
+#
+import os
+import json
+import zlib
+import time
+import struct
+import logging
+import itertools
+from array import array
+import gzio
+import bibid_index
+from bibid_index import INT64
+
+VERSION = 1
+MAGIC = 'MXCOL\x00\x01\n'
+EXTENSION = '.mxc'
+CHUNK_ROWS = 65536
+BLOCK = struct.Struct('<cI')
+CHUNK = struct.Struct('<II')
+LENGTH = struct.Struct('<I')
+
+# Kind: (first is bibid, separator after first). The value is a bibid
+# if first is not.
+KINDS = {'bibid_oclcnums': (True,'\t'),
+         'workid_bibid': (False,' '),
+         'workid_bibids': (False,' ')}
+
+# First comment line written by each script for each kind
+HEADER_KINDS = {'#bibid oclcnum[s]': 'bibid_oclcnums',
+                '#workid bibid': 'workid_bibid',
+                '#workid bibids': 'workid_bibids'}
+
+
+def shuffle(data):
+    """Bytes of int64 column data grouped by position in each int64"""
+    return ''.join([data[i::8] for i in range(8)])
+
+def unshuffle(data):
+    """Inverse of shuffle()"""
+    n = len(data)//8
+    out = bytearray(len(data))
+    for i in range(8):
+        out[i::8] = data[i*n:(i+1)*n]
+    return str(out)
+
+def is_columnar(file):
+    """True if file starts with MAGIC"""
+    try:
+        fh = open(file,'rb')
+    except IOError:
+        return False
+    magic = fh.read(len(MAGIC))
+    fh.close()
+    return (magic==MAGIC)
+
+def is_columnar_name(file):
+    return file.endswith(EXTENSION)
+
+def open_input(file):
+    """Open file as text lines, columnar or else with gzio.open_input()"""
+    if (is_columnar(file)):
+        return reader(file)
+    return gzio.open_input(file)
+
+def open_output(file,kind=None):
+    """Open file for text lines, columnar if named .mxc else gzipped"""
+    if (is_columnar_name(file)):
+        return writer(file,kind)
+    return gzio.open_output(file)
+
+
+class writer(object):
+    """Write text lines or rows to columnar file
+
+    If kind is not given it is taken from the first comment line (see
+    HEADER_KINDS).
+    """
+
+    def __init__(self,file,kind=None,chunk_rows=CHUNK_ROWS):
+        self.file = file
+        self.fh = open(file,'wb')
+        self.fh.write(MAGIC)
+        self.kind = None
+        self.chunk_rows = chunk_rows
+        self.partial = ''
+        self.rows = 0
+        self.lines = 0
+        self.bad = 0
+        self.early_comments = []
+        self._new_chunk()
+        if (kind is not None):
+            self._set_kind(kind)
+
+    def _set_kind(self,kind):
+        if (kind not in KINDS):
+            raise ValueError("Unknown kind '%s'" % (kind))
+        self.kind = kind
+        (self.first_is_bibid,self.sep) = KINDS[kind]
+        self._block('H',json.dumps({'version': VERSION, 'kind': kind}))
+        for line in self.early_comments:
+            self._block('C',line)
+        self.early_comments = []
+
+    def _block(self,type,payload):
+        self.fh.write(BLOCK.pack(type,len(payload)))
+        self.fh.write(payload)
+
+    def _new_chunk(self):
+        self.codes = {}
+        self.dictionary = []
+        self.firsts = array(INT64)
+        self.values = array(INT64)
+        self.positions = array(INT64)
+
+    def _code(self,bibid):
+        code = self.codes.get(bibid)
+        if (code is None):
+            code = len(self.dictionary)
+            self.codes[bibid] = code
+            self.dictionary.append(bibid)
+        return code
+
+    def _flush(self):
+        if (len(self.firsts)==0):
+            return
+        odd = []
+        dictionary = array(INT64,[bibid_index.encode_bibid(b,odd) for b in self.dictionary])
+        payload = [CHUNK.pack(len(self.firsts),len(self.dictionary))]
+        for data in (shuffle(dictionary.tostring()),'\n'.join(odd),shuffle(self.firsts.tostring()),
+                     shuffle(self.values.tostring()),shuffle(self.positions.tostring())):
+            z = zlib.compress(data)
+            payload.append(LENGTH.pack(len(z)))
+            payload.append(z)
+        self._block('D',''.join(payload))
+        self.rows += len(self.firsts)
+        self._new_chunk()
+
+    def comment(self,line):
+        """Add comment line (starting #) in place"""
+        self.lines += 1
+        if (self.kind is None):
+            self.early_comments.append(line)
+            if (line in HEADER_KINDS):
+                self._set_kind(HEADER_KINDS[line])
+            return
+        self._flush()
+        self._block('C',line)
+
+    def add(self,first,values):
+        """Add line of first followed by values"""
+        if (self.kind is None):
+            raise ValueError("Data before kind known for %s" % (self.file))
+        if (self.first_is_bibid):
+            first = self._code(first)
+        else:
+            values = [self._code(v) for v in values]
+        for (pos,value) in enumerate(values):
+            self.firsts.append(first)
+            self.values.append(value)
+            self.positions.append(pos)
+        self.lines += 1
+        if (len(self.firsts)>=self.chunk_rows):
+            self._flush()
+
+    def write(self,text):
+        """Add text lines in the text format of kind
+
+        Text may end part way through a line, the rest is expected in
+        the next write. Blank lines are dropped, lines that don't fit
+        kind are logged and dropped as readers would ignore them.
+        """
+        lines = (self.partial+text).split('\n')
+        self.partial = lines.pop()
+        for line in lines:
+            if (line.startswith('#')):
+                self.comment(line.rstrip('\r'))
+                continue
+            d = line.split()
+            if (len(d)<2):
+                if (d):
+                    self._bad(line)
+                continue
+            if (self.kind is None):
+                raise ValueError("Cannot tell kind of data for %s from first comment line" % (self.file))
+            try:
+                if (self.first_is_bibid):
+                    self.add(d[0],[int(x) for x in d[1:]])
+                else:
+                    self.add(int(d[0]),d[1:])
+            except ValueError:
+                self._bad(line)
+
+    def _bad(self,line):
+        self.bad += 1
+        logging.warning("%s: bad line '%s' not written" % (self.file,line))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if (self.partial):
+            self.write('\n')
+        if (self.kind is None):
+            raise ValueError("Cannot tell kind of data for %s from first comment line" % (self.file))
+        self._flush()
+        self._block('E',json.dumps({'rows': self.rows, 'lines': self.lines}))
+        self.fh.close()
+
+
+class reader(object):
+    """Read columnar file as rows or as text lines
+
+    Iteration and readline() give the text format so that any text
+    reader works, rows() is the fast way in.
+    """
+
+    def __init__(self,file):
+        self.name = file
+        self.fh = open(file,'rb')
+        if (self.fh.read(len(MAGIC))!=MAGIC):
+            raise ValueError("%s is not a columnar file" % (file))
+        self.size = os.fstat(self.fh.fileno()).st_size
+        self.start = time.time()
+        self.end = None
+        self.kind = None
+        self.lines = None
+        self.text = None
+        (type,payload) = self._next_block()
+        if (type!='H'):
+            raise ValueError("%s has no header" % (file))
+        header = json.loads(payload)
+        if (header.get('version')!=VERSION):
+            raise ValueError("%s has columnar version %s, expected %d" % (file,header.get('version'),VERSION))
+        self.kind = header['kind']
+        (self.first_is_bibid,self.sep) = KINDS[self.kind]
+
+    def _next_block(self):
+        """(type, payload) of next block or (None, None) at end of file"""
+        head = self.fh.read(BLOCK.size)
+        if (len(head)<BLOCK.size):
+            return(None,None)
+        (type,length) = BLOCK.unpack(head)
+        payload = self.fh.read(length)
+        if (len(payload)<length):
+            raise IOError("%s is truncated" % (self.name))
+        return(type,payload)
+
+    def _columns(self,payload):
+        (rows,entries) = CHUNK.unpack_from(payload,0)
+        offset = CHUNK.size
+        parts = []
+        for k in range(5):
+            (length,) = LENGTH.unpack_from(payload,offset)
+            offset += LENGTH.size
+            parts.append(zlib.decompress(payload[offset:offset+length]))
+            offset += length
+        odd = (parts[1].split('\n') if parts[1] else [])
+        columns = []
+        for data in (parts[0],)+tuple(parts[2:]):
+            a = array(INT64)
+            a.fromstring(unshuffle(data))
+            columns.append(a)
+        dictionary = [bibid_index.decode_bibid(c,odd) for c in columns.pop(0)]
+        if (self.first_is_bibid):
+            columns[0] = [dictionary[c] for c in columns[0]]
+        else:
+            columns[1] = [dictionary[c] for c in columns[1]]
+        return columns
+
+    def blocks(self):
+        """Generator of ('#', comment) and ('D', (firsts, values, positions))"""
+        while True:
+            (type,payload) = self._next_block()
+            if (type is None):
+                raise IOError("%s is truncated, no end block" % (self.name))
+            elif (type=='C'):
+                yield ('#',payload)
+            elif (type=='D'):
+                yield ('D',self._columns(payload))
+            elif (type=='E'):
+                self.lines = json.loads(payload)['lines']
+                return
+
+    def rows(self):
+        """Generator of (line number, first, value, pos) for each row
+
+        Line numbers are those of the text format, counting comments.
+        """
+        n = 0
+        for (type,data) in self.blocks():
+            if (type=='#'):
+                n += 1
+                continue
+            (firsts,values,positions) = data
+            for (first,value,pos) in itertools.izip(firsts,values,positions):
+                if (pos==0):
+                    n += 1
+                yield (n,first,value,pos)
+
+    def iter_lines(self):
+        """Generator of text lines, as the text format"""
+        for (type,data) in self.blocks():
+            if (type=='#'):
+                yield data+'\n'
+                continue
+            (firsts,values,positions) = data
+            line = None
+            for (first,value,pos) in itertools.izip(firsts,values,positions):
+                if (pos==0):
+                    if (line is not None):
+                        yield line+'\n'
+                    line = "%s%s%s" % (first,self.sep,value)
+                else:
+                    line += " %s" % (value)
+            if (line is not None):
+                yield line+'\n'
+
+    def __iter__(self):
+        if (self.text is None):
+            self.text = self.iter_lines()
+        return self.text
+
+    def readline(self):
+        try:
+            return next(iter(self))
+        except StopIteration:
+            return ''
+
+    def position(self):
+        return (self.fh.tell() if self.end is None else self.size)
+
+    def rate(self):
+        """MB/s of file read"""
+        return self.position()/1048576.0/max((self.end or time.time())-self.start,1e-6)
+
+    def close(self):
+        if (self.end is None):
+            self.end = time.time()
+            self.fh.close()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+#
+# Pre-built binary store of the OCLC concordance
+#
+# Every run over oclcnum_workid_concordance.txt.gz re-decompresses and
+# re-tokenizes 3.1GB of text. This converts it once (see
+# mx_build_concordance_index.py) into a directory of fixed-width int64
+# columns that are memory mapped and binary searched, so matching our
+# oclcnums costs O(our records x log N) random reads:
+#
+#   meta.json        - source info, counts and byte order
+#   col2.i64         - column 2 oclcnums, sorted (rows sorted by col2,line)
+#   col1.i64         - column 1 oclcnum for each row
+#   workid.i64       - workid for each row, NONE_WORKID for NONE
+#   line.i64         - line number in the concordance for each row
+#   by1_key.i64      - column 1 oclcnums, sorted
+#   by1_row.i64      - row for each entry of by1_key
+#   bywork_key.i64   - workids, sorted (rows with NONE not included)
+#   bywork_row.i64   - row for each entry of bywork_key, in line order
+#
+# Bad lines are dropped (and counted) when building. The bywork
+# columns are used to find all lines for a workid (see
+# mx_incremental_workids.py), version 1 indexes did not have them.
+#
+import os
+import sys
+import json
+import gzio
+import instrument
+import mmap
+import bisect
+import struct
+import logging
+import datetime
+from array import array
+import extsort
+import concordance_sort
+from bibid_index import INT64
+
+VERSION = 2
+NONE_WORKID = -1
+COLUMNS = ['col2','col1','workid','line','by1_key','by1_row','bywork_key','bywork_row']
+
+
+class column_writer(object):
+    """Buffered writer of an int64 column file"""
+
+    def __init__(self,file,buffer_size=100000):
+        self.fh = open(file,'wb')
+        self.buf = array(INT64)
+        self.buffer_size = buffer_size
+
+    def append(self,value):
+        self.buf.append(value)
+        if (len(self.buf)>=self.buffer_size):
+            self.flush()
+
+    def flush(self):
+        self.buf.tofile(self.fh)
+        self.buf = array(INT64)
+
+    def close(self):
+        self.flush()
+        self.fh.close()
+
+
+class int64_column(object):
+    """Read-only int64 column on a memory mapped file
+
+    Supports len() and [] so can be used with bisect.
+    """
+
+    def __init__(self,file):
+        self.fh = open(file,'rb')
+        self.n = os.fstat(self.fh.fileno()).st_size // 8
+        self.mm = (mmap.mmap(self.fh.fileno(),0,access=mmap.ACCESS_READ) if self.n>0 else '')
+        self.unpack = struct.Struct('=q').unpack_from
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self,i):
+        if (i<0 or i>=self.n):
+            raise IndexError(i)
+        return self.unpack(self.mm,i*8)[0]
+
+    def close(self):
+        if (self.n>0):
+            self.mm.close()
+        self.fh.close()
+
+
+def build(concordance_file,index_dir,max_items=extsort.MAX_ITEMS,tmpdir=None):
+    """Build binary index in index_dir from concordance_file"""
+    if (not os.path.isdir(index_dir)):
+        os.makedirs(index_dir)
+    logging.warning("READING CONCORDANCE at %s" % (datetime.datetime.now()))
+    by2 = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    fh = gzio.open_input(concordance_file)
+    instrument.reading(concordance_file, fh)
+    n = 0
+    num_none_workid = 0
+    num_bad = 0
+    for line in fh:
+        n += 1
+        if (n%1000000 == 0):
+            logging.warning("read %d lines from %s%s...." % (n,concordance_file,gzio.rate_str(fh)))
+            instrument.set_counts(concordance_lines=n)
+        line = line.rstrip()
+        try:
+            (oclcnum1,oclcnum2,workid) = line.split()
+            if (workid=='NONE'):
+                # counted whatever the oclcnums, as in full scan
+                num_none_workid += 1
+                try:
+                    by2.add((int(oclcnum2),n,int(oclcnum1),NONE_WORKID))
+                except ValueError:
+                    pass
+                continue
+            by2.add((int(oclcnum2),n,int(oclcnum1),int(workid)))
+        except Exception as e:
+            num_bad += 1
+            logging.warning("[line %d] BAD LINE '%s': %s" % (n,line,str(e)))
+    fh.close()
+    instrument.set_counts(concordance_lines=n)
+    instrument.phase('write_index')
+    logging.warning("WRITING INDEX at %s" % (datetime.datetime.now()))
+    writers = dict([(c,column_writer(os.path.join(index_dir,c+'.i64'))) for c in COLUMNS])
+    by1 = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    bywork = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    rows = 0
+    for (oclcnum2,line,oclcnum1,workid) in by2:
+        writers['col2'].append(oclcnum2)
+        writers['col1'].append(oclcnum1)
+        writers['workid'].append(workid)
+        writers['line'].append(line)
+        by1.add((oclcnum1,rows))
+        if (workid!=NONE_WORKID):
+            bywork.add((workid,line,rows))
+        rows += 1
+    for (oclcnum1,row) in by1:
+        writers['by1_key'].append(oclcnum1)
+        writers['by1_row'].append(row)
+    for (workid,line,row) in bywork:
+        writers['bywork_key'].append(workid)
+        writers['bywork_row'].append(row)
+    for w in writers.values():
+        w.close()
+    meta = {'version': VERSION,
+            'source': concordance_sort.source_info(concordance_file),
+            'byteorder': sys.byteorder,
+            'lines': n,
+            'rows': rows,
+            'none_workid': num_none_workid,
+            'bad_lines': num_bad}
+    json.dump(meta,open(os.path.join(index_dir,'meta.json'),'w'),indent=1)
+    logging.warning("written %d rows to %s" % (rows,index_dir))
+    return meta
+
+
+class concordance_index(object):
+
+    def __init__(self,index_dir):
+        self.index_dir = index_dir
+        self.meta = json.load(open(os.path.join(index_dir,'meta.json')))
+        if (self.meta.get('version')!=VERSION):
+            raise ValueError("Concordance index %s is version %s, need %d, rebuild with mx_build_concordance_index.py" % (index_dir,self.meta.get('version'),VERSION))
+        if (self.meta.get('byteorder')!=sys.byteorder):
+            raise ValueError("Concordance index %s was built on a %s endian machine" % (index_dir,self.meta.get('byteorder')))
+        for c in COLUMNS:
+            setattr(self,c,int64_column(os.path.join(index_dir,c+'.i64')))
+
+    def rows_col2(self,oclcnum):
+        """Rows with column 2 equal to oclcnum"""
+        i = bisect.bisect_left(self.col2,oclcnum)
+        while (i<len(self.col2) and self.col2[i]==oclcnum):
+            yield i
+            i += 1
+
+    def rows_col1(self,oclcnum):
+        """Rows with column 1 equal to oclcnum"""
+        i = bisect.bisect_left(self.by1_key,oclcnum)
+        while (i<len(self.by1_key) and self.by1_key[i]==oclcnum):
+            yield self.by1_row[i]
+            i += 1
+
+    def rows_workid(self,workid):
+        """Rows with workid, in concordance line order"""
+        i = bisect.bisect_left(self.bywork_key,workid)
+        while (i<len(self.bywork_key) and self.bywork_key[i]==workid):
+            yield self.bywork_row[i]
+            i += 1
+
+    def match(self,bo):
+        """Look up each of bo.bibids and call bo.add_work() for matches
+
+        Matches are replayed in concordance line order with the same
+        rule as the full scan, a col2 match takes precedence over a
+        col1 match on the same line, so all outputs are identical.
+        Returns (lines, num1_matches, num2_matches, num_none_workid)
+        """
+        matches = []
+        for oclcnum in sorted(bo.bibids.keys()):
+            for row in self.rows_col2(oclcnum):
+                workid = self.workid[row]
+                if (workid!=NONE_WORKID):
+                    matches.append((self.line[row],0,self.col1[row],oclcnum,workid))
+            for row in self.rows_col1(oclcnum):
+                workid = self.workid[row]
+                oclcnum2 = self.col2[row]
+                if (workid!=NONE_WORKID and oclcnum2 not in bo.bibids):
+                    matches.append((self.line[row],1,oclcnum,oclcnum2,workid))
+        matches.sort()
+        num1_matches = 0
+        num2_matches = 0
+        for (line,col,oclcnum1,oclcnum2,workid) in matches:
+            bibids = (bo.col2_bibids(oclcnum2,oclcnum1) if col==0 else bo.bibids[oclcnum1])
+            for bibid in bibids:
+                bo.add_work(oclcnum2,bibid,workid)
+            if (col==0):
+                num2_matches += 1
+            else:
+                num1_matches += 1
+        return(self.meta['lines'],num1_matches,num2_matches,self.meta['none_workid'])
+
+    def close(self):
+        for c in COLUMNS:
+            getattr(self,c).close()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Vectorized concordance scan with NumPy
+#
+# The plain scan in mx_get_oclc_workids.read_concordance() does a
+# split(), three int() calls and a dict probe per line for 343M lines.
+# Here the decompressed concordance is read in multi-MB blocks of whole
+# lines and each block is parsed in one go into an n x 3 int64 array
+# (NONE workids become NONE_WORKID). Membership of the whole of columns
+# 2 and 1 in our sorted oclcnums is tested at once and only the
+# matching rows go back to Python for bibid_oclcnums.add_work(), in
+# line order, so outputs are identical to the plain scan.
+#
+# A block is checked strictly (allowed characters, 3 tokens on every
+# line, every token parsed) and if anything is odd the block is handled
+# line by line exactly as in the plain scan, with the same BAD LINE
+# warnings. Real concordance data doesn't hit that path.
+#
+import logging
+import numpy as np
+import gzio
+import instrument
+
+BLOCK_SIZE = 8*1024*1024
+NONE_WORKID = -1
+
+# Bytes that may appear in a block after NONE is replaced
+ALLOWED = np.zeros(256,dtype=bool)
+ALLOWED[[ord(c) for c in '0123456789- \t\n\r\x0b\x0c']] = True
+WHITESPACE = np.zeros(256,dtype=bool)
+WHITESPACE[[ord(c) for c in ' \t\n\r\x0b\x0c']] = True
+
+
+def parse_block(text):
+    """Parse block of whole lines ending in newline to n x 3 int64 array
+
+    Returns None if the block is not strictly all lines of 3 integers
+    or NONE as workid, the caller should then go line by line.
+    """
+    if ('-' in text):
+        return None
+    # pad so that NONE run into other characters makes extra tokens
+    text = text.replace('NONE',' -1 ')
+    b = np.frombuffer(text,dtype=np.uint8)
+    if (not ALLOWED[b].all()):
+        return None
+    # tokens on each line from token starts before each newline
+    ws = WHITESPACE[b]
+    starts = ~ws
+    starts[1:] &= ws[:-1]
+    ends = np.searchsorted(np.flatnonzero(starts),np.flatnonzero(b==10))
+    if (ends.size==0 or ends[0]!=3 or (np.diff(ends)!=3).any()):
+        return None
+    data = np.fromstring(text,dtype=np.int64,sep=' ')
+    if (data.size!=3*ends.size):
+        return None
+    data = data.reshape(-1,3)
+    # NONE is only allowed as workid
+    if ((data[:,0:2]==NONE_WORKID).any()):
+        return None
+    return data
+
+def in_sorted(values,keys):
+    """Boolean array, True where values are in sorted array keys
+
+    Same as np.isin(values,keys) but binary searches keys instead of
+    sorting values and keys together on every call.
+    """
+    if (keys.size==0):
+        return np.zeros(values.shape,dtype=bool)
+    i = np.searchsorted(keys,values)
+    i[i==keys.size] = 0
+    return (keys[i]==values)
+
+def scan_lines(bo,lines,n):
+    """Scan lines as in plain scan, line number of first is n+1
+
+    Returns (num1_matches, num2_matches, num_none_workid)
+    """
+    num1_matches = 0
+    num2_matches = 0
+    num_none_workid = 0
+    for line in lines:
+        n += 1
+        line = line.rstrip()
+        try:
+            (oclcnum1,oclcnum2,workid) = line.split()
+            if (workid=='NONE'):
+                num_none_workid += 1
+                continue
+            oclcnum1=int(oclcnum1)
+            oclcnum2=int(oclcnum2)
+            workid=int(workid)
+            if (oclcnum2 in bo.bibids):
+                for bibid in bo.col2_bibids(oclcnum2,oclcnum1):
+                    bo.add_work(oclcnum2,bibid,workid)
+                num2_matches += 1
+            elif (oclcnum1 in bo.bibids):
+                for bibid in bo.bibids[oclcnum1]:
+                    bo.add_work(oclcnum2,bibid,workid)
+                num1_matches += 1
+        except Exception as e:
+            logging.warning("[line %d] BAD LINE '%s': %s" % (n,line,str(e)))
+    return(num1_matches,num2_matches,num_none_workid)
+
+def scan_block(bo,keys,data,n):
+    """Match parsed block against sorted keys, line number of first row is n+1
+
+    Returns (num1_matches, num2_matches, num_none_workid)
+    """
+    (col1,col2,workids) = (data[:,0],data[:,1],data[:,2])
+    valid = (workids!=NONE_WORKID)
+    in2 = in_sorted(col2,keys) & valid
+    in1 = in_sorted(col1,keys) & valid & ~in2
+    for i in np.flatnonzero(in2|in1):
+        (oclcnum1,oclcnum2,workid) = [int(x) for x in data[i]]
+        try:
+            bibids = (bo.col2_bibids(oclcnum2,oclcnum1) if in2[i] else bo.bibids[oclcnum1])
+            for bibid in bibids:
+                bo.add_work(oclcnum2,bibid,workid)
+        except Exception as e:
+            logging.warning("[line %d] BAD LINE '%d %d %d': %s" % (n+i+1,oclcnum1,oclcnum2,workid,str(e)))
+    return(int(np.count_nonzero(in1)),int(np.count_nonzero(in2)),
+           int(data.shape[0]-np.count_nonzero(valid)))
+
+def read_concordance(bo,oclc_concordance_file,block_size=BLOCK_SIZE):
+    """Vectorized equivalent of mx_get_oclc_workids.read_concordance()
+
+    Returns (lines, num1_matches, num2_matches, num_none_workid)
+    """
+    keys = np.array(sorted(bo.bibids.keys()),dtype=np.int64)
+    fh = gzio.open_input(oclc_concordance_file)
+    instrument.reading(oclc_concordance_file, fh)
+    n = 0
+    num1_matches = 0
+    num2_matches = 0
+    num_none_workid = 0
+    num_fallback = 0
+    rest = ''
+    while True:
+        block = fh.read(block_size)
+        if (not block):
+            if (not rest):
+                break
+            # last line without newline
+            (text,rest) = (rest+'\n','')
+        else:
+            i = block.rfind('\n')
+            if (i<0):
+                rest += block
+                continue
+            (text,rest) = (rest+block[:i+1],block[i+1:])
+        data = parse_block(text)
+        if (data is None):
+            lines = text.split('\n')[:-1]
+            counts = scan_lines(bo,lines,n)
+            num_lines = len(lines)
+            num_fallback += 1
+        else:
+            counts = scan_block(bo,keys,data,n)
+            num_lines = data.shape[0]
+        num1_matches += counts[0]
+        num2_matches += counts[1]
+        num_none_workid += counts[2]
+        if ((n+num_lines)//1000000 > n//1000000):
+            logging.warning("read %d lines from %s%s...." % (n+num_lines,oclc_concordance_file,gzio.rate_str(fh)))
+        n += num_lines
+        instrument.set_counts(concordance_lines=n, matches=num1_matches+num2_matches)
+    fh.close()
+    if (num_fallback>0):
+        logging.warning("%d blocks of %s read line by line" % (num_fallback,oclc_concordance_file))
+    return(n,num1_matches,num2_matches,num_none_workid)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+#
+# Sort-merge join of bibid oclcnums against the OCLC concordance
+#
+# Instead of holding all bibid data in a dict and probing it for each
+# of the 343M concordance lines, sort both sides by oclcnum and do a
+# streaming merge with bounded memory:
+#
+#  1. The concordance is sorted once by column 1 and once by column 2
+#     (external sort with spill files). The sorted outputs are cached
+#     in cache_dir, which must be given (not next to the concordance
+#     which may be on read-only or shared storage, and the cache is tens
+#     of GB for the full concordance), along with a small meta file so
+#     later runs skip this step. Cache files are named from a hash of
+#     the concordance's absolute path so that different concordances
+#     with the same name do not share a cache.
+#  2. The bibid to oclcnum data is externally sorted by oclcnum.
+#  3. Merging the bibid data with each sorted concordance gives all
+#     col2 and col1 matches, tagged with concordance line number.
+#  4. Matches are sorted by line number and replayed through
+#     bibid_oclcnums.add_work() with the same rule as the hash probe
+#     (a col2 match takes precedence over a col1 match on the same
+#     line) so all outputs are identical.
+#
+import os
+import json
+import hashlib
+import gzio
+import instrument
+import logging
+import datetime
+import tempfile
+import extsort
+
+CACHE_VERSION = 1
+
+
+def cache_paths(concordance_file,cache_dir):
+    """Paths for (meta, by_col1, by_col2) cache files in cache_dir"""
+    path = os.path.abspath(concordance_file)
+    base = os.path.join(cache_dir,"%s.%s" % (os.path.basename(path),hashlib.sha1(path).hexdigest()[:12]))
+    return (base+'.sorted.json', base+'.by_col1.srt', base+'.by_col2.srt')
+
+def source_info(file):
+    """Size and mtime to check cache is for current concordance"""
+    st = os.stat(file)
+    return {'file': os.path.abspath(file), 'size': st.st_size, 'mtime': int(st.st_mtime)}
+
+def read_cache_meta(concordance_file,cache_dir):
+    """Meta data for a valid sorted cache, else None"""
+    (meta_file,by1_file,by2_file) = cache_paths(concordance_file,cache_dir)
+    if (not (os.path.exists(meta_file) and os.path.exists(by1_file) and os.path.exists(by2_file))):
+        return None
+    meta = json.load(open(meta_file))
+    if (meta.get('version')!=CACHE_VERSION or meta.get('source')!=source_info(concordance_file)):
+        logging.warning("sorted concordance cache %s is stale, rebuilding" % (meta_file))
+        return None
+    return meta
+
+def build_cache(concordance_file,cache_dir,max_items=extsort.MAX_ITEMS,tmpdir=None):
+    """Sort concordance by col1 and col2, write cache files and meta
+
+    Lines with workid NONE are counted and dropped, bad lines are logged
+    and dropped, just as in the hash probe loop. Items are
+    (oclcnum_key, line_number, other_oclcnum, workid).
+    """
+    (meta_file,by1_file,by2_file) = cache_paths(concordance_file,cache_dir)
+    logging.warning("SORTING CONCORDANCE at %s" % (datetime.datetime.now()))
+    by1 = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    by2 = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    fh = gzio.open_input(concordance_file)
+    instrument.reading(concordance_file, fh)
+    n = 0
+    num_none_workid = 0
+    num_bad = 0
+    for line in fh:
+        n += 1
+        if (n%1000000 == 0):
+            logging.warning("sorting: read %d lines from %s%s...." % (n,concordance_file,gzio.rate_str(fh)))
+            instrument.set_counts(concordance_lines=n)
+        line = line.rstrip()
+        try:
+            (oclcnum1,oclcnum2,workid) = line.split()
+            if (workid=='NONE'):
+                num_none_workid += 1
+                continue
+            oclcnum1=int(oclcnum1)
+            oclcnum2=int(oclcnum2)
+            workid=int(workid)
+        except Exception as e:
+            num_bad += 1
+            logging.warning("[line %d] BAD LINE '%s': %s" % (n,line,str(e)))
+            continue
+        by1.add((oclcnum1,n,oclcnum2,workid))
+        by2.add((oclcnum2,n,oclcnum1,workid))
+    fh.close()
+    by1.write(by1_file)
+    by2.write(by2_file)
+    meta = {'version': CACHE_VERSION,
+            'source': source_info(concordance_file),
+            'lines': n,
+            'none_workid': num_none_workid,
+            'bad_lines': num_bad}
+    json.dump(meta,open(meta_file,'w'),indent=1)
+    logging.warning("SORTED CONCORDANCE at %s" % (datetime.datetime.now()))
+    return meta
+
+def bibid_groups(oclcnum_bibids,max_items=extsort.MAX_ITEMS,tmpdir=None):
+    """Generator of (oclcnum, bibids) sorted by oclcnum
+
+    oclcnum_bibids gives (oclcnum, bibid) pairs. The bibids for each
+    oclcnum are put in a set in the order read so that iteration order
+    matches bibid_oclcnums.bibids, and returned as a list.
+    """
+    s = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    seq = 0
+    for (oclcnum,bibid) in oclcnum_bibids:
+        seq += 1
+        s.add((oclcnum,seq,bibid))
+    last = None
+    bibids = []
+    for (oclcnum,seq,bibid) in s:
+        if (oclcnum!=last):
+            if (bibids):
+                yield (last,list(set(bibids)))
+            last = oclcnum
+            bibids = []
+        bibids.append(bibid)
+    if (bibids):
+        yield (last,list(set(bibids)))
+
+def merge(groups,sorted_file,col,matches):
+    """Merge sorted bibid groups with one sorted concordance file
+
+    Adds (line_number, col, oclcnum2, workid, bibids) to matches for
+    every concordance line whose key column is one of our oclcnums.
+    col is 0 for column 2 and 1 for column 1 so that a col2 match sorts
+    first for a line.
+    """
+    fh = open(sorted_file,'rb')
+    rows = extsort.read_run(fh)
+    row = next(rows,None)
+    for (oclcnum,bibids) in groups:
+        while (row is not None and row[0]<oclcnum):
+            row = next(rows,None)
+        while (row is not None and row[0]==oclcnum):
+            (key,n,other,workid) = row
+            oclcnum2 = (key if col==0 else other)
+            matches.add((n,col,oclcnum2,workid,bibids))
+            row = next(rows,None)
+        if (row is None):
+            break
+    fh.close()
+
+def merge_join(bo,oclcnum_bibids,concordance_file,cache_dir=None,
+               max_items=extsort.MAX_ITEMS,tmpdir=None):
+    """Match bibid data against concordance by sort-merge join
+
+    Calls bo.add_work() for every match in concordance order. Returns
+    (lines, num1_matches, num2_matches, num_none_workid, num_oclcnums)
+    The sorted concordance is cached in cache_dir, else tmpdir, one
+    of which must be given.
+    """
+    if (cache_dir is None):
+        cache_dir = tmpdir
+    if (cache_dir is None):
+        raise ValueError("Must give cache_dir or tmpdir for sorted concordance cache")
+    meta = read_cache_meta(concordance_file,cache_dir)
+    if (meta is None):
+        meta = build_cache(concordance_file,cache_dir,max_items,tmpdir)
+    else:
+        logging.warning("using sorted concordance cache for %s (%d lines, %d bad lines not repeated)" % (concordance_file,meta['lines'],meta['bad_lines']))
+    (meta_file,by1_file,by2_file) = cache_paths(concordance_file,cache_dir)
+    # Sort our data once and keep it for both merges
+    groups_fh = tempfile.TemporaryFile(dir=tmpdir)
+    num_oclcnums = extsort.write_run(bibid_groups(oclcnum_bibids,max_items,tmpdir),groups_fh)
+    logging.warning("MERGING CONCORDANCE at %s" % (datetime.datetime.now()))
+    matches = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+    for (col,sorted_file) in [(0,by2_file),(1,by1_file)]:
+        groups_fh.seek(0)
+        merge(extsort.read_run(groups_fh),sorted_file,col,matches)
+    groups_fh.close()
+    # Replay matches in concordance line order
+    num1_matches = 0
+    num2_matches = 0
+    last = None
+    for (n,col,oclcnum2,workid,bibids) in matches:
+        if (n==last):
+            # already have col2 match for this line
+            continue
+        last = n
+        for bibid in bibids:
+            bo.add_work(oclcnum2,bibid,workid)
+        if (col==0):
+            num2_matches += 1
+        else:
+            num1_matches += 1
+    return(meta['lines'],num1_matches,num2_matches,meta['none_workid'],num_oclcnums)
@@ -6,12 +6,10 @@
 rm -f cul/bibid_to_oclcnums.log cul/bibid_to_oclcnums_dupes.log
 ./mx_grep_oclc.py -v --logfile cul/bibid_to_oclcnums.log --dupeslog cul/bibid_to_oclcnums_dupes.log bib.xml.full/bib.*.xml.gz | gzip -c > cul/bibid_to_oclcnums.dat.gz
 #
-# 2a. match up with OCLC concordance to get oclcnum to oclc workids
-rm -f cul/oclcnum_workid_pairs.csv.gz
-./mx_get_oclc_workids.py --write-oclcnum-workid-pairs=cul/oclcnum_workid_pairs.csv.gz cul/bibid_to_oclcnums.dat.gz oclcnum_workid_concordance.txt.gz
-# 2a. match up with OCLC concordance to get work ids
-rm -f cul/workid_bibid_pairs.log cul/workid_bibid_pair_dupes.log
-./mx_get_oclc_workids.py -v --logfile cul/workid_bibid_pairs.log --dupeslog cul/workid_bibid_pair_dupes.log cul/bibid_to_oclcnums.dat.gz oclcnum_workid_concordance.txt.gz cul/workid_bibid_pairs.dat.gz
+# 2. match up with OCLC concordance to get oclcnum to oclc workid pairs and
+# workid--bibid pairs from one pass over the concordance
+rm -f cul/oclcnum_workid_pairs.csv.gz cul/workid_bibid_pairs.log cul/workid_bibid_pair_dupes.log
+./mx_get_oclc_workids.py -v --logfile cul/workid_bibid_pairs.log --dupeslog cul/workid_bibid_pair_dupes.log --write-oclcnum-workid-pairs=cul/oclcnum_workid_pairs.csv.gz --write-pairs=cul/workid_bibid_pairs.dat.gz cul/bibid_to_oclcnums.dat.gz oclcnum_workid_concordance.txt.gz
 #
 # 3. got though workid-bibid pairs to group by workid and get some stats
 rm -f cul/workid_bibids.log 
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# External sort of tuples with spill files
+#
+# Items are tuples (or anything marshal can write) compared in their
+# natural order, so put the sort key first. Up to max_items are
+# sorted in memory; beyond that sorted runs are spilled to temporary
+# files and merged with heapq.merge. Runs and sorted files are written
+# as a stream of marshal'ed batches which is much faster to read back
+# than text.
+#
+import os
+import heapq
+import marshal
+import tempfile
+
+MAX_ITEMS = 1000000
+BATCH_SIZE = 10000
+# Most runs to merge at once, more are first merged into one run
+MAX_RUNS = 100
+
+
+def write_run(items,fh):
+    """Write items to fh in marshal'ed batches, returns number written"""
+    n = 0
+    batch = []
+    for item in items:
+        batch.append(item)
+        if (len(batch)>=BATCH_SIZE):
+            marshal.dump(batch,fh)
+            n += len(batch)
+            batch = []
+    if (batch):
+        marshal.dump(batch,fh)
+        n += len(batch)
+    return n
+
+def read_run(fh):
+    """Generator of items written with write_run()"""
+    while True:
+        try:
+            batch = marshal.load(fh)
+        except EOFError:
+            return
+        for item in batch:
+            yield item
+
+
+class external_sort(object):
+    """Sort items added, spilling sorted runs to disk as needed
+
+    Use add() for each item then iterate over the object to get them
+    back in sorted order. Spill files are removed by close() (or once
+    iteration finishes).
+    """
+
+    def __init__(self,max_items=MAX_ITEMS,tmpdir=None):
+        self.max_items = max_items
+        self.tmpdir = tmpdir
+        self.items = []
+        self.runs = []
+        self.num_items = 0
+
+    def add(self,item):
+        self.items.append(item)
+        self.num_items += 1
+        if (len(self.items)>=self.max_items):
+            self.spill()
+
+    def spill(self):
+        """Write sorted current items as a run"""
+        self.items.sort()
+        fh = tempfile.TemporaryFile(dir=self.tmpdir)
+        write_run(self.items,fh)
+        fh.seek(0)
+        self.runs.append(fh)
+        self.items = []
+        if (len(self.runs)>=MAX_RUNS):
+            self.merge_runs()
+
+    def merge_runs(self):
+        """Merge all current runs into one to limit open files"""
+        fh = tempfile.TemporaryFile(dir=self.tmpdir)
+        write_run(heapq.merge(*[read_run(run) for run in self.runs]),fh)
+        fh.seek(0)
+        for run in self.runs:
+            run.close()
+        self.runs = [fh]
+
+    def __iter__(self):
+        if (not self.runs):
+            self.items.sort()
+            items = self.items
+            self.items = []
+            for item in items:
+                yield item
+            return
+        if (self.items):
+            self.spill()
+        try:
+            for item in heapq.merge(*[read_run(fh) for fh in self.runs]):
+                yield item
+        finally:
+            self.close()
+
+    def write(self,file):
+        """Write all items in sorted order to file with write_run()
+
+        Written to file.tmp then renamed so an interrupted sort doesn't
+        leave a partial file. Returns number of items.
+        """
+        tmp = file + '.tmp'
+        fh = open(tmp,'wb')
+        n = write_run(self,fh)
+        fh.close()
+        os.rename(tmp,file)
+        return n
+
+    def close(self):
+        for fh in self.runs:
+            fh.close()
+        self.runs = []
+        self.items = []
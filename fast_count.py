@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#
+# Count records without parsing them, for mx_count.py --fast-count
+#
+# Counting records by sending each through an XML parser took 3h47
+# for Harvard's 7M records where grep -c '<record>' took 4 minutes
+# (see performance.md). Here:
+#
+# - count_xml() scans the decompressed bytes for record start tags,
+#   with any namespace prefix (e.g. <marc:record>) and matched by
+#   local name as marcxml_reader and pymarc do. Comments, CDATA
+#   sections, processing instructions and the DOCTYPE are skipped so
+#   that a <record> inside them isn't counted.
+# - count_marc21() hops from leader to leader by the record length
+#   without looking at the rest of the record, resynchronizing at the
+#   next record terminator after a bad length as marc21_records does.
+#
+# With validate=N every Nth record is also cut out and fully parsed
+# (marcxml_reader or marc21_records.decode_record), failures are
+# logged and counted.
+#
+import re
+import logging
+import marc21_records
+import oclc_fastscan
+
+CHUNK_SIZE = 4*1024*1024
+# Longest start tag (with prefix) or markup opener expected to be
+# split across chunks
+TAIL = 256
+
+# Record start tag or the start of markup to skip, group 1 is the
+# opener of markup to skip, group 2 is the prefix of a record
+XML_TOKEN = re.compile(r'<(!--|!\[CDATA\[|\?|!DOCTYPE\b)|<(?:([A-Za-z_][\w.-]*):)?record(?=[\s/>])')
+SKIP_TO = {'!--': '-->', '![CDATA[': ']]>', '?': '?>', '!DOCTYPE': '>'}
+
+
+class counter(object):
+    """Counts of records seen and validated"""
+
+    def __init__(self,validate=0):
+        self.validate = validate
+        self.records = 0
+        self.validated = 0
+        self.failed = 0
+
+    def want_validate(self):
+        return (self.validate>0 and self.records%self.validate==0)
+
+    def count_xml(self,fh):
+        """Count MARCXML records in fh, returns number in this file"""
+        start = self.records
+        fs = oclc_fastscan.fast_scanner()
+        buf = ''
+        eof = False
+        while (not eof):
+            chunk = fh.read(CHUNK_SIZE)
+            eof = not chunk
+            buf += chunk
+            pos = 0
+            while True:
+                m = XML_TOKEN.search(buf,pos)
+                if (not m):
+                    pos = max(pos,len(buf)-TAIL)
+                    break
+                skip = m.group(1)
+                if (skip is None):
+                    if (self.want_validate()):
+                        # cut out whole record to validate, may need more data
+                        e = oclc_fastscan.RECORD_END.search(buf,m.end())
+                        if (e is None and not eof):
+                            pos = m.start()
+                            break
+                        self._validate_xml(fs,m.group(2),buf[m.start():(e.end() if e else len(buf))])
+                    self.records += 1
+                    pos = m.end()
+                    continue
+                end = SKIP_TO[skip]
+                if (skip=='!DOCTYPE'):
+                    # internal subset may contain markup, ends ]>
+                    gt = buf.find('>',m.end())
+                    bracket = buf.find('[',m.end())
+                    if (bracket>=0 and (gt<0 or bracket<gt)):
+                        end = ']>'
+                e = buf.find(end,m.end())
+                if (e<0):
+                    # need more data to find end, unless none left
+                    pos = (m.start() if not eof else len(buf))
+                    break
+                pos = e+len(end)
+            buf = buf[pos:]
+        return self.records-start
+
+    def _validate_xml(self,fs,prefix,data):
+        self.validated += 1
+        fs.records_seen = self.records+1
+        if (fs.parse_record(prefix,data,tags=None) is None):
+            self.failed += 1
+
+    def count_marc21(self,fh):
+        """Count MARC21 records in fh, returns number in this file
+
+        Same records as marc21_records.raw_records() gives, including a
+        truncated last record.
+        """
+        start = self.records
+        if (self.validate>0):
+            for raw in marc21_records.raw_records(fh):
+                if (self.want_validate()):
+                    self._validate_marc21(raw)
+                self.records += 1
+            return self.records-start
+        buf = ''
+        pos = 0
+        eof = False
+        while True:
+            if (len(buf)-pos < marc21_records.LEADER_LENGTH and not eof):
+                chunk = fh.read(CHUNK_SIZE)
+                buf = buf[pos:] + chunk
+                pos = 0
+                eof = not chunk
+            if (pos>=len(buf)):
+                break
+            first5 = buf[pos:pos+5]
+            length = (int(first5) if marc21_records.LENGTH_RE.match(first5) else 0)
+            self.records += 1
+            if (length<marc21_records.LEADER_LENGTH):
+                # bad length, skip to after next record terminator
+                end = buf.find(marc21_records.END_OF_RECORD,pos)
+                while (end<0 and not eof):
+                    chunk = fh.read(CHUNK_SIZE)
+                    buf = buf[pos:] + chunk
+                    pos = 0
+                    eof = not chunk
+                    end = buf.find(marc21_records.END_OF_RECORD,pos)
+                pos = (len(buf) if end<0 else end+1)
+            else:
+                pos += length
+                if (pos>len(buf)):
+                    # hop over the rest of the record without keeping it
+                    skip = pos-len(buf)
+                    while (skip>0 and not eof):
+                        chunk = fh.read(min(skip,CHUNK_SIZE))
+                        skip -= len(chunk)
+                        eof = not chunk
+                    buf = ''
+                    pos = 0
+        return self.records-start
+
+    def _validate_marc21(self,raw):
+        self.validated += 1
+        try:
+            if (not raw.endswith(marc21_records.END_OF_RECORD)):
+                raise ValueError("Truncated record, %d bytes" % (len(raw)))
+            marc21_records.decode_record(raw)
+        except Exception as e:
+            self.failed += 1
+            logging.warning("Validate failed for record %d '%s': %s" % (self.records+1,marc21_records.raw_bibid(raw),str(e) or e.__class__.__name__))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+#
+# Checkpoint manifest for resumable mx_grep_oclc.py runs
+#
+# A checkpoint directory holds the output of each input file as a
+# separate shard plus manifest.json which records, for each input file
+# (by absolute path), its size, mtime and optionally sha1, whether it
+# was done or hit an error, its shard and its stats:
+#
+#   {"version": 1,
+#    "options": {...options that change output...},
+#    "files": {"/data/bib.1.xml.gz": {"size": 123, "mtime": 1411000000,
+#                                     "sha1": null, "status": "done",
+#                                     "shard": "shards/3f2a....txt",
+#                                     "stats": {...}, "error": null}}}
+#
+# The manifest is rewritten (via a temporary file and rename) after each
+# file so a killed run loses at most the files in progress. A restarted
+# or repeated run only processes files that are not done or have
+# changed, then the shards are merged in argument order to give the
+# same output as a run without checkpointing. Files with errors are
+# tried again on the next run.
+#
+import os
+import json
+import shutil
+import hashlib
+import logging
+
+VERSION = 1
+DONE = 'done'
+ERROR = 'error'
+
+
+def file_sha1(file):
+    """Hex sha1 of file contents"""
+    h = hashlib.sha1()
+    fh = open(file,'rb')
+    while True:
+        data = fh.read(1024*1024)
+        if (not data):
+            break
+        h.update(data)
+    fh.close()
+    return h.hexdigest()
+
+
+class checkpoint(object):
+
+    def __init__(self,dir,options=None,use_hash=False):
+        """Open or create checkpoint in dir
+
+        options is a dict of settings that change output, if they don't
+        match those of an existing checkpoint then all files are redone.
+        With use_hash a file with changed mtime but the same sha1 is
+        not redone (e.g. for an unchanged file in a fresh copy of a dump).
+        """
+        self.dir = dir
+        self.options = (options or {})
+        self.use_hash = use_hash
+        self.manifest_file = os.path.join(dir,'manifest.json')
+        if (not os.path.isdir(os.path.join(dir,'shards'))):
+            os.makedirs(os.path.join(dir,'shards'))
+        self.files = {}
+        if (os.path.exists(self.manifest_file)):
+            manifest = json.load(open(self.manifest_file))
+            if (manifest.get('version')!=VERSION):
+                logging.warning("#Checkpoint %s is version %s, starting again" % (dir,manifest.get('version')))
+            elif (manifest.get('options')!=self.options):
+                logging.warning("#Checkpoint %s was made with different options, starting again" % (dir))
+            else:
+                self.files = manifest['files']
+
+    def key(self,file):
+        return os.path.abspath(file)
+
+    def shard(self,file):
+        """Path of output shard for file"""
+        name = hashlib.sha1(self.key(file)).hexdigest()[:16] + '.txt'
+        return os.path.join(self.dir,'shards',name)
+
+    def is_done(self,file):
+        """True if file was done in a previous run and is unchanged"""
+        entry = self.files.get(self.key(file))
+        if (entry is None or entry['status']!=DONE or not os.path.exists(self.shard(file))):
+            return False
+        st = os.stat(file)
+        if (entry['size']!=st.st_size):
+            return False
+        if (entry['mtime']==int(st.st_mtime)):
+            return True
+        if (self.use_hash and entry.get('sha1') and entry['sha1']==file_sha1(file)):
+            logging.warning("#Checkpoint: %s has new mtime but same sha1" % (file))
+            entry['mtime'] = int(st.st_mtime)
+            self.save()
+            return True
+        return False
+
+    def record(self,file,stats,error=None):
+        """Record file as done (or with error) and save manifest"""
+        st = os.stat(file)
+        self.files[self.key(file)] = {
+            'size': st.st_size,
+            'mtime': int(st.st_mtime),
+            'sha1': (file_sha1(file) if self.use_hash else None),
+            'status': (DONE if error is None else ERROR),
+            'shard': os.path.relpath(self.shard(file),self.dir),
+            'stats': stats,
+            'error': error}
+        self.save()
+
+    def save(self):
+        tmp = self.manifest_file + '.tmp'
+        json.dump({'version': VERSION, 'options': self.options, 'files': self.files},
+                  open(tmp,'w'), indent=1, sort_keys=True)
+        os.rename(tmp,self.manifest_file)
+
+    def merge(self,files,out):
+        """Copy shards for files to out in order, return list of stats"""
+        stats = []
+        for file in files:
+            entry = self.files[self.key(file)]
+            fh = open(self.shard(file),'rb')
+            shutil.copyfileobj(fh,out)
+            fh.close()
+            stats.append(entry['stats'])
+        return stats
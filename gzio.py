@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+# Shared gzip I/O for the mx_* scripts
+#
+# Python's gzip module decompresses and compresses on the one thread
+# that is also doing all the parsing, and its readline() is pure
+# Python. Here:
+#
+# - open_input() decompresses in another process (pigz -dc or gzip -dc
+#   if on the PATH) or else on a background thread, in large chunks
+#   handed over through a bounded queue. Lines are split from the
+#   chunks in bulk. Decompressed bytes are counted so that progress
+#   logs can show MB/s (see rate()), position() is how far into the
+#   compressed file we are and time spent waiting for data is added
+#   up in stats (see instrument.py).
+# - open_output() compresses through pigz if on the PATH or else in
+#   blocks on a pool of threads (zlib releases the GIL), each block
+#   written as a gzip member in order. Concatenated members are
+#   standard gzip.
+#
+# Set environment variable MX_GZIO_EXTERNAL=0 to not use external
+# programs.
+#
+import os
+import zlib
+import gzip
+import time
+import Queue
+import threading
+import subprocess
+
+CHUNK_SIZE = 1024*1024
+QUEUE_CHUNKS = 16
+BLOCK_SIZE = 4*1024*1024
+THREADS = 4
+GZIP_MAGIC = '\x1f\x8b'
+
+# Totals over all readers: decompressed bytes and seconds that
+# readers spent waiting for them
+stats = {'bytes': 0, 'wait_s': 0.0}
+
+
+def which(program):
+    """Full path of program if on PATH, else None"""
+    for dir in os.environ.get('PATH','').split(os.pathsep):
+        path = os.path.join(dir,program)
+        if (os.path.isfile(path) and os.access(path,os.X_OK)):
+            return path
+    return None
+
+def use_external():
+    return (os.environ.get('MX_GZIO_EXTERNAL','1')!='0')
+
+def is_gzip(file):
+    """True if file starts with the gzip magic number"""
+    fh = open(file,'rb')
+    magic = fh.read(2)
+    fh.close()
+    return (magic==GZIP_MAGIC)
+
+
+class chunk_reader(object):
+    """Read-only file-like object fed with chunks from a background thread
+
+    Supports read(), readline() and iteration over lines, which is all
+    that pymarc, the XML parsers and the line loops need.
+    """
+
+    def __init__(self,name,source,close_source=None,position=None):
+        """Start reading from source
+
+        close_source(check) is called to close the source when done,
+        it should raise IOError on errors if check is True. position()
+        should give the number of compressed bytes consumed.
+        """
+        self.name = name
+        self.source = source
+        self.close_source = close_source
+        self.position_source = position
+        self.final_position = None
+        self.queue = Queue.Queue(maxsize=QUEUE_CHUNKS)
+        self.buf = ''
+        self.eof = False
+        self.error = None
+        self.stopped = False
+        self.bytes_read = 0
+        self.bytes_taken = 0
+        self.start = time.time()
+        self.thread = threading.Thread(target=self._fill)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _fill(self):
+        """Background thread reading source in chunks"""
+        try:
+            while (not self.stopped):
+                chunk = self.source.read(CHUNK_SIZE)
+                if (not chunk):
+                    break
+                self.bytes_read += len(chunk)
+                stats['bytes'] += len(chunk)
+                self.queue.put(chunk)
+        except Exception as e:
+            self.error = e
+        self.queue.put(None)
+
+    def _next_chunk(self):
+        """Next chunk or '' at end, raises any error from source"""
+        if (self.eof):
+            return ''
+        try:
+            chunk = self.queue.get_nowait()
+        except Queue.Empty:
+            start = time.time()
+            chunk = self.queue.get()
+            stats['wait_s'] += time.time()-start
+        if (chunk is None):
+            self.eof = True
+            self._finish()
+            return ''
+        self.bytes_taken += len(chunk)
+        return chunk
+
+    def _finish(self):
+        """Called at end of data, check for errors"""
+        (close_source,self.close_source) = (self.close_source,None)
+        if (close_source is not None):
+            self._save_position()
+            close_source(True)
+        if (self.error is not None):
+            raise IOError("Error reading %s: %s" % (self.name,str(self.error)))
+
+    def read(self,size=-1):
+        while ((size<0 or len(self.buf)<size) and not self.eof):
+            self.buf += self._next_chunk()
+        if (size<0):
+            (data,self.buf) = (self.buf,'')
+        else:
+            (data,self.buf) = (self.buf[:size],self.buf[size:])
+        return data
+
+    def readline(self):
+        while ('\n' not in self.buf and not self.eof):
+            self.buf += self._next_chunk()
+        i = self.buf.find('\n')
+        if (i<0):
+            (line,self.buf) = (self.buf,'')
+        else:
+            (line,self.buf) = (self.buf[:i+1],self.buf[i+1:])
+        return line
+
+    def __iter__(self):
+        while True:
+            data = self.buf + self._next_chunk()
+            if (not data):
+                return
+            lines = data.split('\n')
+            if (self.eof):
+                self.buf = ''
+                last = lines.pop()
+                for line in lines:
+                    yield line + '\n'
+                if (last):
+                    yield last
+                return
+            self.buf = lines.pop()
+            for line in lines:
+                yield line + '\n'
+
+    def position(self):
+        """Compressed bytes consumed so far, None if not known
+
+        The decompressor runs ahead of us by the queued chunks so its
+        position is scaled by the fraction of decompressed data taken.
+        """
+        if (self.final_position is not None):
+            return self.final_position
+        try:
+            pos = (self.position_source() if self.position_source else None)
+        except (OSError,IOError,ValueError):
+            return None
+        if (pos is None or self.bytes_read==0):
+            return pos
+        return int(pos*float(self.bytes_taken)/self.bytes_read)
+
+    def _save_position(self):
+        """Keep position for after source is closed"""
+        self.final_position = self.position()
+
+    def rate(self):
+        """Decompressed MB/s so far"""
+        elapsed = time.time()-self.start
+        return (self.bytes_read/1048576.0/elapsed if elapsed>0 else 0.0)
+
+    def close(self):
+        """Close, if not all data was read then errors are ignored"""
+        self.stopped = True
+        # drain so that the background thread can finish
+        while (not self.eof and self.thread.is_alive()):
+            try:
+                if (self.queue.get(timeout=0.1) is None):
+                    break
+            except Queue.Empty:
+                pass
+        self.eof = True
+        if (self.close_source is not None):
+            self._save_position()
+            self.close_source(False)
+            self.close_source = None
+
+
+def open_input(file):
+    """Open file for reading, decompressing in parallel if gzipped
+
+    Gzip is detected from the magic number rather than the file name.
+    """
+    if (not is_gzip(file)):
+        return open(file,'rb')
+    program = (which('pigz') or which('gzip')) if use_external() else None
+    if (program):
+        # Compressed data on stdin shares the file offset with raw so we
+        # can see how far the decompressor has got
+        raw = open(file,'rb')
+        p = subprocess.Popen([program,'-dc'],stdin=raw,stdout=subprocess.PIPE,
+                             bufsize=CHUNK_SIZE)
+        def close_source(check):
+            if (not check and p.poll() is None):
+                p.terminate()
+            p.stdout.close()
+            raw.close()
+            if (p.wait()!=0 and check):
+                raise IOError("%s -dc %s failed with status %d" % (program,file,p.returncode))
+        return chunk_reader(file,p.stdout,close_source,
+                            lambda: os.lseek(raw.fileno(),0,os.SEEK_CUR))
+    gz = gzip.open(file,'rb')
+    return chunk_reader(file,gz,lambda check: gz.close(),gz.fileobj.tell)
+
+
+class block_gzip_writer(object):
+    """Write gzip with blocks compressed on a pool of threads
+
+    Each block is compressed as a complete gzip member and members are
+    written in order, concatenated members are valid gzip.
+    """
+
+    def __init__(self,file,threads=THREADS,level=6):
+        self.fh = open(file,'wb')
+        self.level = level
+        self.blocks = []
+        self.size = 0
+        self.work = Queue.Queue()
+        self.pending = []
+        self.threads = []
+        for n in range(threads):
+            t = threading.Thread(target=self._compress)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+        self.max_pending = threads*2
+
+    def _compress(self):
+        while True:
+            job = self.work.get()
+            if (job is None):
+                return
+            c = zlib.compressobj(self.level,zlib.DEFLATED,16+zlib.MAX_WBITS)
+            job[1] = c.compress(job[0]) + c.flush()
+            job[0] = None
+            job[2].set()
+
+    def write(self,data):
+        self.blocks.append(data)
+        self.size += len(data)
+        if (self.size>=BLOCK_SIZE):
+            self._submit()
+
+    def writelines(self,lines):
+        for line in lines:
+            self.write(line)
+
+    def _submit(self):
+        job = [''.join(self.blocks),None,threading.Event()]
+        self.blocks = []
+        self.size = 0
+        self.work.put(job)
+        self.pending.append(job)
+        # write finished blocks in order, wait if too far behind
+        while (self.pending and (self.pending[0][2].is_set() or len(self.pending)>self.max_pending)):
+            job = self.pending.pop(0)
+            job[2].wait()
+            self.fh.write(job[1])
+
+    def close(self):
+        if (self.fh is None):
+            return
+        if (self.size>0 or not self.pending):
+            self._submit()
+        for job in self.pending:
+            job[2].wait()
+            self.fh.write(job[1])
+        self.pending = []
+        for t in self.threads:
+            self.work.put(None)
+        for t in self.threads:
+            t.join()
+        self.fh.close()
+        self.fh = None
+
+
+class pipe_writer(object):
+    """Write through an external compressor such as pigz -c"""
+
+    def __init__(self,file,program):
+        self.fh = open(file,'wb')
+        self.p = subprocess.Popen([program,'-c'],stdin=subprocess.PIPE,
+                                  stdout=self.fh,bufsize=CHUNK_SIZE)
+        self.write = self.p.stdin.write
+        self.writelines = self.p.stdin.writelines
+
+    def close(self):
+        if (self.p is None):
+            return
+        self.p.stdin.close()
+        if (self.p.wait()!=0):
+            raise IOError("Compressor failed with status %d" % (self.p.returncode))
+        self.p = None
+        self.fh.close()
+
+
+def open_output(file):
+    """Open gzip file for writing with parallel compression"""
+    program = which('pigz') if use_external() else None
+    if (program):
+        return pipe_writer(file,program)
+    return block_gzip_writer(file)
+
+def rate_str(fh):
+    """' (N.N MB/s)' for a reader from open_input(), else ''"""
+    if (hasattr(fh,'rate')):
+        return " (%.1f MB/s)" % (fh.rate())
+    return ''
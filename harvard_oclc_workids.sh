@@ -19,13 +19,11 @@
 # 004082148-X
 #
 # Harvard data appears to include various invalid UTF8 sequences/chars
-# and so pymarc will not read it. Ran all files through 
-# utf8conditioner which "corrupts" the data by doing dumb substitutions
-# but at least makes the rest valid UTF8
-#
-# sw272@sw272-dev mx>for f in $( ls harvard_marc21/ab*gz ); do zcat $f | ~/src/utf8conditioner/utf8conditioner | gzip -c > $f.new ; done
-# ....check files....
-# w272@sw272-dev mx>for f in $( ls harvard_marc21/ab*gz ); do mv $f.new $f ; done
+# and so pymarc will not read it. This used to mean running all files
+# through utf8conditioner first. mx_grep_oclc.py now decodes MARC21
+# itself, only the 001/035/079 fields and replacing any bad bytes in
+# them, so the files can be read as they are (--pymarc would need the
+# utf8conditioner pass again).
 #
 # Run all processes to extract OCLC references from MARCXML
 # records, match these against OCLC concordance file,
@@ -38,7 +36,7 @@
 #
 # 2. match up with OCLC concordance to get work ids
 rm -f harvard/workid_bibid_pairs.log harvard/workid_bibid_pair_dupes.log
-./mx_get_oclc_workids.py -v --logfile harvard/workid_bibid_pairs.log --dupeslog harvard/workid_bibid_pair_dupes.log harvard/bibid_to_oclcnums.dat.gz oclcnum_workid_concordance.txt.gz harvard/workid_bibid_pairs.dat.gz
+./mx_get_oclc_workids.py -v --logfile harvard/workid_bibid_pairs.log --dupeslog harvard/workid_bibid_pair_dupes.log --write-pairs=harvard/workid_bibid_pairs.dat.gz harvard/bibid_to_oclcnums.dat.gz oclcnum_workid_concordance.txt.gz
 #
 # 3. got though workid-bibid pairs to group by workid and get some stats
 rm -f harvard/workid_bibids.log 
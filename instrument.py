@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+#
+# Progress and metrics instrumentation shared by the mx_* scripts
+#
+# Multi-hour runs otherwise give little idea of how far they have got,
+# where the time goes, or whether they have stalled. Scripts report:
+#
+# - counters (records seen, lines read, matches...), either set as the
+#   run goes or pulled from a source function at each report so that
+#   hot loops don't pay for them
+# - phases (reading bibids, scanning concordance, writing...) with the
+#   time spent in each, and timers around other blocks of work
+# - the input files, so that compressed bytes consumed against total
+#   compressed size gives MB/s and an ETA
+#
+# With --metrics FILE a JSON line snapshot is appended every
+# --metrics-interval seconds and at the end, with --metrics-port PORT
+# the latest snapshot is served on 127.0.0.1 as JSON at / and as
+# Prometheus text at /metrics. Either also logs a one line progress
+# summary at each interval. Snapshots include current and peak RSS and
+# how long since anything last changed (stalled_s).
+#
+# Everything is kept in one module level metrics object, like the
+# logging module, and all functions are cheap no-ops in effect when
+# no output is configured.
+#
+import os
+import re
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+import contextlib
+import BaseHTTPServer
+import gzio
+
+INTERVAL = 10.0
+
+
+def rss_kb():
+    """Current RSS in KB from /proc, else None"""
+    try:
+        pages = int(open('/proc/self/statm').read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/1024
+    except (IOError,OSError,ValueError,IndexError):
+        return None
+
+def max_rss_kb(who=resource.RUSAGE_SELF):
+    """Peak RSS in KB (ru_maxrss is bytes on Mac OS X)"""
+    rss = resource.getrusage(who).ru_maxrss
+    return (rss/1024 if sys.platform=='darwin' else rss)
+
+def input_position(fh):
+    """Compressed bytes consumed from file handle fh, else None"""
+    if (hasattr(fh,'position')):
+        return fh.position()
+    try:
+        return fh.tell()
+    except (IOError,AttributeError,ValueError):
+        return None
+
+
+class metrics(object):
+    """Counters, timers, phase and input progress for one run"""
+
+    def __init__(self):
+        self.script = os.path.basename(sys.argv[0]).replace('.py','')
+        self.start = time.time()
+        self.counters = {}
+        self.sources = []
+        self.timers = {}
+        self.phase_name = None
+        self.phase_start = None
+        self.input_sizes = {}
+        self.input_total = 0
+        self.inputs_done = set()
+        self.current_input = None
+        self.input_start = None
+        self.last = None
+        self.last_change = self.start
+        self.out = None
+        self.server = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.snapshot_json = '{}'
+        self.lock = threading.Lock()
+
+    def count(self,name,n=1):
+        self.counters[name] = self.counters.get(name,0)+n
+
+    def set_counts(self,**counts):
+        self.counters.update(counts)
+
+    def add_source(self,source):
+        """Add function returning dict of counters, called at each report"""
+        self.sources.append(source)
+
+    def add_time(self,name,seconds):
+        self.timers[name] = self.timers.get(name,0.0)+seconds
+
+    @contextlib.contextmanager
+    def timer(self,name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_time(name,time.time()-start)
+
+    def phase(self,name):
+        """Start phase name (None for no phase), ending any current one"""
+        now = time.time()
+        if (self.phase_name is not None):
+            self.add_time('phase_'+self.phase_name,now-self.phase_start)
+        self.phase_name = name
+        self.phase_start = now
+
+    def set_inputs(self,files):
+        """Input files for the run, sizes on disk give progress and ETA"""
+        self.input_sizes = {}
+        for file in files:
+            self._add_input(file)
+
+    def _add_input(self,file):
+        try:
+            self.input_sizes[file] = os.path.getsize(file)
+        except OSError:
+            self.input_sizes[file] = 0
+        self.input_total = sum(self.input_sizes.values())
+
+    def reading(self,file,fh):
+        """Now reading file through fh, earlier file is done"""
+        if (self.current_input is not None):
+            self.inputs_done.add(self.current_input[0])
+        if (file not in self.input_sizes):
+            self._add_input(file)
+        if (self.input_start is None):
+            self.input_start = time.time()
+        self.current_input = (file,fh)
+
+    def input_done(self,file):
+        """Finished with file (e.g. done by a worker process)"""
+        if (self.input_start is None):
+            self.input_start = time.time()
+        self.inputs_done.add(file)
+        if (self.current_input is not None and self.current_input[0]==file):
+            self.current_input = None
+
+    def input_progress(self):
+        """Dict of input bytes done, total, rate and ETA"""
+        done = sum([self.input_sizes.get(f,0) for f in self.inputs_done])
+        if (self.current_input is not None and self.current_input[0] not in self.inputs_done):
+            pos = input_position(self.current_input[1])
+            if (pos is not None):
+                done += min(pos,self.input_sizes.get(self.current_input[0],pos))
+        progress = {'bytes_done': done, 'bytes_total': self.input_total}
+        if (self.input_total>0):
+            progress['fraction'] = float(done)/self.input_total
+        if (self.input_start is not None and done>0):
+            elapsed = time.time()-self.input_start
+            if (elapsed>0):
+                progress['mb_per_s'] = done/1048576.0/elapsed
+                if (self.input_total>=done):
+                    progress['eta_s'] = elapsed*(self.input_total-done)/done
+        return progress
+
+    def snapshot(self,final=False):
+        """Dict of everything now, rates are since the last snapshot"""
+        now = time.time()
+        counters = dict(self.counters)
+        for source in self.sources:
+            try:
+                counters.update(source())
+            except Exception as e:
+                # a source may be mid-update on the main thread
+                logging.info("metrics source failed: %s" % (str(e)))
+        timers = dict(self.timers)
+        timers['decompress_wait'] = gzio.stats['wait_s']
+        counters['decompressed_bytes'] = gzio.stats['bytes']
+        if (self.phase_name is not None):
+            timers['phase_'+self.phase_name] = timers.get('phase_'+self.phase_name,0.0)+now-self.phase_start
+        progress = self.input_progress()
+        rates = {}
+        if (self.last is not None and now>self.last[0]):
+            for (name,value) in counters.items():
+                if (name in self.last[1]):
+                    rates[name] = (value-self.last[1][name])/(now-self.last[0])
+        if (self.last is None or counters!=self.last[1] or progress['bytes_done']!=self.last[2]):
+            self.last_change = now
+        self.last = (now,counters,progress['bytes_done'])
+        return {'time': now, 'script': self.script, 'elapsed_s': now-self.start,
+                'phase': self.phase_name, 'counters': counters, 'rates': rates,
+                'timers': timers, 'input': progress, 'stalled_s': now-self.last_change,
+                'rss_kb': rss_kb(), 'max_rss_kb': max_rss_kb(),
+                'max_rss_children_kb': max_rss_kb(resource.RUSAGE_CHILDREN),
+                'final': final}
+
+    def report(self,final=False):
+        """Take snapshot and emit it to the configured outputs"""
+        with self.lock:
+            s = self.snapshot(final)
+            self.snapshot_json = json.dumps(s,sort_keys=True)
+            if (self.out is not None):
+                self.out.write(self.snapshot_json+"\n")
+                self.out.flush()
+        logging.warning(progress_str(s))
+        return s
+
+    def start_reporting(self,file=None,port=None,interval=INTERVAL):
+        """Start periodic reports to JSON lines file and/or HTTP port"""
+        if (file is not None):
+            self.out = (sys.stderr if file=='-' else open(file,'a'))
+        if (port is not None):
+            self.server = BaseHTTPServer.HTTPServer(('127.0.0.1',port),metrics_handler)
+            self.server.metrics = self
+            t = threading.Thread(target=self.server.serve_forever)
+            t.daemon = True
+            t.start()
+            logging.warning("Serving metrics at http://127.0.0.1:%d/metrics" % (self.server.server_address[1]))
+        self.thread = threading.Thread(target=self._report_loop,args=(interval,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _report_loop(self,interval):
+        while (not self.stopped.wait(interval)):
+            self.report()
+
+    def active(self):
+        return (self.thread is not None)
+
+    def finish(self):
+        """Final report and stop, if reporting"""
+        if (not self.active()):
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        self.phase(None)
+        if (self.current_input is not None):
+            self.inputs_done.add(self.current_input[0])
+        self.report(final=True)
+        if (self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if (self.out is not None and self.out is not sys.stderr):
+            self.out.close()
+        self.out = None
+
+
+def progress_str(s):
+    """One line progress summary of snapshot s"""
+    parts = ["metrics %.0fs" % (s['elapsed_s'])]
+    if (s['phase']):
+        parts.append("phase %s" % (s['phase']))
+    progress = s['input']
+    if ('fraction' in progress):
+        parts.append("%.1f%% of %.1f MB input" % (100.0*progress['fraction'],progress['bytes_total']/1048576.0))
+    if ('mb_per_s' in progress):
+        parts.append("%.1f MB/s" % (progress['mb_per_s']))
+    if ('eta_s' in progress and not s['final']):
+        parts.append("ETA %.0fs" % (progress['eta_s']))
+    for name in sorted(s['counters']):
+        parts.append("%s=%d" % (name,s['counters'][name]))
+    if (s['rss_kb'] is not None):
+        parts.append("RSS %d KB" % (s['rss_kb']))
+    parts.append("max RSS %d KB" % (s['max_rss_kb']))
+    if (s['stalled_s']>=60):
+        parts.append("NO PROGRESS FOR %.0fs" % (s['stalled_s']))
+    if (s['final']):
+        for name in sorted(s['timers']):
+            parts.append("%s %.1fs" % (name,s['timers'][name]))
+    return ', '.join(parts)
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]','_',name)
+
+def prometheus_text(s):
+    """Snapshot s in Prometheus text exposition format"""
+    labels = '{script="%s"}' % (s['script'])
+    lines = []
+    def metric(name,kind,value):
+        lines.append("# TYPE mx_%s %s" % (name,kind))
+        lines.append("mx_%s%s %s" % (name,labels,repr(float(value))))
+    for name in sorted(s['counters']):
+        metric(_metric_name(name)+'_total','counter',s['counters'][name])
+    for name in sorted(s['timers']):
+        metric(_metric_name(name)+'_seconds','counter',s['timers'][name])
+    progress = s['input']
+    metric('input_bytes_done','gauge',progress['bytes_done'])
+    metric('input_bytes_total','gauge',progress['bytes_total'])
+    if ('eta_s' in progress):
+        metric('eta_seconds','gauge',progress['eta_s'])
+    metric('elapsed_seconds','gauge',s['elapsed_s'])
+    metric('stalled_seconds','gauge',s['stalled_s'])
+    if (s['rss_kb'] is not None):
+        metric('rss_bytes','gauge',s['rss_kb']*1024)
+    metric('max_rss_bytes','gauge',s['max_rss_kb']*1024)
+    if (s['phase']):
+        lines.append("# TYPE mx_phase gauge")
+        lines.append('mx_phase{script="%s",phase="%s"} 1.0' % (s['script'],s['phase']))
+    return "\n".join(lines)+"\n"
+
+
+class metrics_handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serve latest snapshot, as JSON at / and Prometheus text at /metrics"""
+
+    def do_GET(self):
+        m = self.server.metrics
+        with m.lock:
+            data = m.snapshot_json
+        if (self.path.startswith('/metrics')):
+            data = prometheus_text(json.loads(data)) if data!='{}' else ''
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            content_type = 'application/json'
+        self.send_response(200)
+        self.send_header('Content-Type',content_type)
+        self.send_header('Content-Length',str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self,format,*args):
+        # keep requests out of stderr
+        pass
+
+
+# Module level metrics object and functions to use it
+_metrics = metrics()
+count = _metrics.count
+set_counts = _metrics.set_counts
+add_source = _metrics.add_source
+add_time = _metrics.add_time
+timer = _metrics.timer
+phase = _metrics.phase
+set_inputs = _metrics.set_inputs
+reading = _metrics.reading
+input_done = _metrics.input_done
+snapshot = _metrics.snapshot
+finish = _metrics.finish
+
+def add_options(p):
+    """Add --metrics, --metrics-port, --metrics-interval to optparse p"""
+    p.add_option('--metrics', action='store', default=None,
+                 help="Append JSON line metrics snapshots to this file ('-' for stderr) every --metrics-interval seconds and at end")
+    p.add_option('--metrics-port', action='store', type='int', default=None,
+                 help="Serve latest metrics on 127.0.0.1 at this port, JSON at / and Prometheus text at /metrics")
+    p.add_option('--metrics-interval', action='store', type='float', default=INTERVAL,
+                 help="Seconds between metrics snapshots (default %default)")
+
+def start(opt):
+    """Start reporting if options from add_options() ask for it"""
+    if (opt.metrics is not None or opt.metrics_port is not None):
+        _metrics.start_reporting(file=opt.metrics,port=opt.metrics_port,
+                                 interval=opt.metrics_interval)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# Raw MARC21 (ISO 2709) record splitting
+#
+# Each MARC21 record starts with a 24 byte leader, the first 5 bytes
+# being the record length in ASCII digits. That is enough to cut a
+# decompressed stream into records without decoding anything, so one
+# process can cheaply split a big file into batches of raw records for
+# worker processes to decode (see mx_grep_oclc.py --split-records).
+#
+# A record with an unreadable length is resynchronized at the next
+# record terminator and passed on as is, so that decoding it fails and
+# is logged for just that record.
+#
+# decode_record() is a directory-driven decoder that slices out only
+# the fields asked for (for mx_grep_oclc.py 001/035/079) and decodes
+# just those, giving the same lean_record objects as marcxml_reader.
+# pymarc decodes every field and fails the whole record on one bad
+# UTF-8 sequence, here bad bytes are replaced field by field so that
+# catalogs with some invalid UTF-8 (Harvard) can be read directly.
+#
+import re
+import marcxml_reader
+
+CHUNK_SIZE = 4*1024*1024
+BATCH_BYTES = 1024*1024
+LEADER_LENGTH = 24
+END_OF_RECORD = '\x1d'
+END_OF_FIELD = '\x1e'
+SUBFIELD_INDICATOR = '\x1f'
+DIRECTORY_ENTRY_LENGTH = 12
+LENGTH_RE = re.compile(r'\d{5}$')
+
+
+def raw_records(fh,chunk_size=None):
+    """Generator of raw records from MARC21 stream fh"""
+    if (chunk_size is None):
+        chunk_size = CHUNK_SIZE
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        if (len(buf)-pos < LEADER_LENGTH and not eof):
+            chunk = fh.read(chunk_size)
+            buf = buf[pos:] + chunk
+            pos = 0
+            eof = not chunk
+        if (pos>=len(buf)):
+            return
+        first5 = buf[pos:pos+5]
+        length = (int(first5) if LENGTH_RE.match(first5) else 0)
+        if (length<LEADER_LENGTH):
+            # bad length, pass on up to next record terminator
+            end = buf.find(END_OF_RECORD,pos)
+            while (end<0 and not eof):
+                chunk = fh.read(chunk_size)
+                buf = buf[pos:] + chunk
+                pos = 0
+                eof = not chunk
+                end = buf.find(END_OF_RECORD,pos)
+            end = (len(buf) if end<0 else end+1)
+        else:
+            end = pos+length
+            while (end>len(buf) and not eof):
+                chunk = fh.read(max(chunk_size,end-len(buf)))
+                buf = buf[pos:] + chunk
+                end -= pos
+                pos = 0
+                eof = not chunk
+        yield buf[pos:end]
+        pos = min(end,len(buf))
+
+def batches(records,batch_bytes=None,size_of=len):
+    """Generator of lists of raw records of about batch_bytes total
+
+    size_of(record) is the size of each record in bytes.
+    """
+    if (batch_bytes is None):
+        batch_bytes = BATCH_BYTES
+    batch = []
+    size = 0
+    for record in records:
+        batch.append(record)
+        size += size_of(record)
+        if (size>=batch_bytes):
+            yield batch
+            batch = []
+            size = 0
+    if (batch):
+        yield batch
+
+def _decode(data,utf8):
+    """Unicode for field data, never fails
+
+    Plain ASCII is the common case. Otherwise UTF-8 with bad bytes
+    replaced, or MARC-8 as pymarc does when leader/09 is not 'a'.
+    """
+    try:
+        return data.decode('ascii')
+    except UnicodeDecodeError:
+        pass
+    if (utf8):
+        return data.decode('utf-8','replace')
+    try:
+        import pymarc
+        return pymarc.marc8_to_unicode(data,True)
+    except Exception:
+        return data.decode('iso8859-1')
+
+def _entries(directory,tags):
+    """Offsets of directory entries for tags (all if None), in order
+
+    Looking for the few tags wanted with find() is much quicker than
+    stepping through every entry.
+    """
+    if (tags is None):
+        return range(0,len(directory),DIRECTORY_ENTRY_LENGTH)
+    offsets = []
+    for tag in tags:
+        i = directory.find(tag)
+        while (i>=0):
+            if (i%DIRECTORY_ENTRY_LENGTH==0):
+                offsets.append(i)
+            i = directory.find(tag,i+1)
+    if (len(tags)>1):
+        offsets.sort()
+    return offsets
+
+def decode_record(raw,tags=None):
+    """marcxml_reader.lean_record with fields from raw record
+
+    Only fields with tags in tags (all if None) are decoded. Raises
+    ValueError if the leader or directory can't be read, bad field
+    data is never an error. As pymarc, numeric tags below 010 are
+    control fields and missing indicators are taken as blanks.
+    """
+    if (len(raw)<LEADER_LENGTH):
+        raise ValueError("Record too short, %d bytes" % (len(raw)))
+    leader = raw[:LEADER_LENGTH]
+    utf8 = (leader[9]=='a')
+    record = marcxml_reader.lean_record(leader.decode('ascii','replace'))
+    # Directory runs up to the first field terminator, don't rely on the
+    # base address in the leader
+    base = raw.find(END_OF_FIELD,LEADER_LENGTH)+1
+    if (base<=0 or (base-1-LEADER_LENGTH)%DIRECTORY_ENTRY_LENGTH!=0):
+        raise ValueError("Bad directory")
+    directory = raw[LEADER_LENGTH:base-1]
+    for i in _entries(directory,tags):
+        tag = directory[i:i+3]
+        start = base+int(directory[i+7:i+12])
+        data = raw[start:start+int(directory[i+3:i+7])-1]
+        if (tag<'010' and tag.isdigit()):
+            record.add_field(marcxml_reader.control_field(tag,_decode(data,utf8)))
+        else:
+            subs = data.split(SUBFIELD_INDICATOR)
+            indicators = list((subs[0]+'  ')[:2].decode('ascii','replace'))
+            subfields = [(s[0].decode('ascii','replace'),_decode(s[1:],utf8)) for s in subs[1:] if s]
+            record.add_field(marcxml_reader.data_field(tag,indicators,subfields))
+    return record
+
+def raw_field(raw,tag):
+    """Bytes of first field tag in raw record, else None
+
+    Reads the directory only, no decoding, and doesn't trust the base
+    address in the leader. Returns None for anything that doesn't parse.
+    """
+    try:
+        base = raw.find(END_OF_FIELD,LEADER_LENGTH)+1
+        for i in range(LEADER_LENGTH,base-1,12):
+            if (raw[i:i+3]==tag):
+                length = int(raw[i+3:i+7])
+                start = base+int(raw[i+7:i+12])
+                return raw[start:start+length].rstrip(END_OF_FIELD)
+    except ValueError:
+        pass
+    return None
+
+def raw_bibid(raw):
+    """Bibid (001) of raw record for logging, else 'unknown_bibid'"""
+    bibid = raw_field(raw,'001')
+    if (not bibid):
+        return 'unknown_bibid'
+    return bibid.decode('utf-8','replace').encode('utf-8')
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Lean streaming MARCXML reader
+#
+# pymarc.map_xml builds a full pymarc.Record with every field for
+# every record. For the mx_* scripts we only ever look at a handful
+# of tags (001/035/079) so this reader uses incremental iterparse,
+# clears elements as it goes, and materializes only the tags asked
+# for as a compact tag -> fields structure. The record objects
+# support the small part of the pymarc.Record API that mx_grepper
+# uses (record['001'].value(), record.get_fields('035'), f['a'])
+# so can be used as a drop-in replacement in the hot loop.
+#
+try:
+    import xml.etree.cElementTree as etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+MARC_XML_NS = 'http://www.loc.gov/MARC21/slim'
+
+
+class control_field(object):
+    """MARC control field (00X), just tag and data"""
+
+    __slots__ = ('tag','data')
+
+    def __init__(self,tag,data):
+        self.tag=tag
+        self.data=data
+
+    def value(self):
+        return self.data
+
+    def is_control_field(self):
+        return True
+
+
+class data_field(object):
+    """MARC data field with indicators and list of (code,value) subfields"""
+
+    __slots__ = ('tag','indicators','subfields')
+
+    def __init__(self,tag,indicators,subfields):
+        self.tag=tag
+        self.indicators=indicators
+        self.subfields=subfields
+
+    def __getitem__(self,code):
+        """First value of subfield code, else None (as pymarc.Field)"""
+        for (c,v) in self.subfields:
+            if (c==code):
+                return v
+        return None
+
+    def get_subfields(self,*codes):
+        return [v for (c,v) in self.subfields if c in codes]
+
+    def value(self):
+        return ' '.join([v for (c,v) in self.subfields])
+
+    def is_control_field(self):
+        return False
+
+
+class lean_record(object):
+    """Record with only the materialized fields, keyed by tag"""
+
+    __slots__ = ('leader','fields')
+
+    def __init__(self,leader=None):
+        self.leader=leader
+        self.fields={}
+
+    def add_field(self,field):
+        if (field.tag in self.fields):
+            self.fields[field.tag].append(field)
+        else:
+            self.fields[field.tag]=[field]
+
+    def __getitem__(self,tag):
+        """First field with tag, else None (as pymarc.Record)"""
+        fields = self.fields.get(tag)
+        return (fields[0] if fields else None)
+
+    def get_fields(self,*tags):
+        if (len(tags)==1):
+            return self.fields.get(tags[0],[])
+        fields = []
+        for tag in tags:
+            fields.extend(self.fields.get(tag,[]))
+        return fields
+
+
+def _local(tag):
+    """Strip any {namespace} from an ElementTree tag name"""
+    return (tag[tag.index('}')+1:] if tag[0]=='{' else tag)
+
+def parse_xml(fh,tags=None):
+    """Generator of lean_record objects for each record in fh
+
+    If tags is given then only fields with those tags are materialized,
+    all other fields are skipped without building field objects. Use
+    tags=() to materialize nothing (e.g. to count records). Elements
+    are cleared as each record is finished so memory use stays flat.
+
+    Like pymarc (in non-strict mode) elements are matched by local
+    name whatever namespace they are in.
+    """
+    if (tags is not None):
+        tags = frozenset(tags)
+    context = iter(etree.iterparse(fh, events=('start','end')))
+    (event,root) = next(context)
+    record = None
+    for (event,elem) in context:
+        if (event!='end'):
+            continue
+        name = _local(elem.tag)
+        if (name=='record'):
+            if (record is None):
+                record = lean_record()
+            yield record
+            record = None
+            root.clear()
+            continue
+        if (record is None):
+            record = lean_record()
+        if (name=='controlfield'):
+            tag = elem.get('tag')
+            if (tags is None or tag in tags):
+                record.add_field(control_field(tag,elem.text or ''))
+        elif (name=='datafield'):
+            tag = elem.get('tag')
+            if (tags is None or tag in tags):
+                record.add_field(data_field(tag,[elem.get('ind1',' '),elem.get('ind2',' ')],
+                                            [(sf.get('code'),sf.text or '') for sf in elem]))
+            elem.clear()
+        elif (name=='leader'):
+            record.leader = elem.text
+
+def map_xml(function,*files,**kwargs):
+    """Call function for every record in each of files (names or handles)
+
+    Same calling convention as pymarc.map_xml with the addition of the
+    optional tags keyword argument, see parse_xml().
+    """
+    tags = kwargs.get('tags')
+    for file in files:
+        for record in parse_xml(file,tags=tags):
+            function(record)
@@ -6,38 +6,112 @@
 #
 # Simeon Warner - 2014-09-25
 #
-import gzip
+import sys
+import gzio
+import columnar
+import bibid_dict
+import bibid_index
 import re
 import optparse
+from array import array
 import logging
 import datetime
+import extsort
+import instrument
+import profiling
 
 WORKID_FMT = "http://worldcat.org/entity/work/id/%d"
 CORNELL_BIBID_FMT = "http://newcatalog.library.cornell.edu/catalog/%s"
 #http://wordsworth.lib.harvard.edu/F?func=direct&local_base=HVD01&doc_number=012193361
 #http://beta.hollis.harvard.edu/primo_library/libweb/action/display.do?doc=HVD_ALEPH012193361
 
+def dupe_message(bibid,workids):
+    """Warning for bibid attached to more than one workid"""
+    return "Dupe: bibid %s attached to multiple workids [%s]" % (bibid,",".join([str(x) for x in workids]))
+
+
+class histogram(object):
+    """Histogram of number of bibids per workid
+
+    The example for each number of bibids is the first workid added
+    with that number.
+    """
+
+    def __init__(self,workid_fmt=WORKID_FMT,bibid_fmt='%s',to_str=str):
+        self.counts={}
+        self.example={}
+        self.workid_fmt=workid_fmt
+        self.bibid_fmt=bibid_fmt
+        self.to_str=to_str
+
+    def add(self,workid,bibids):
+        n=len(bibids)
+        if (n in self.counts):
+            self.counts[n] += 1
+        else:
+            self.counts[n] = 1
+            # Add first case as example, add first 3 (at most) bibid links
+            biblinks = [self.bibid_fmt % (self.to_str(x)) for x in bibids[0:3]]
+            self.example[n] = "%s -> %s" % ( (self.workid_fmt % (workid)),' '.join(biblinks)) 
+
+    def log(self):
+        """Output histogram data via logger"""
+        logging.warning("histogram: #num_bibids workids_with_num_bibids (example)")
+        for n in sorted(self.counts):
+            logging.warning("histogram: %d %d" % (n,self.counts[n]))
+            logging.warning("histogram_eg: %s" % (self.example[n]))
+
+
 class workids(object):
 
-    def __init__(self,file=None):
+    def __init__(self,file=None,bibid_codec=None):
+        """Read workid bibid pairs from file if given
+
+        With bibid_codec the bibids are held as surrogates from a
+        bibid_dict.bibid_dict with that codec, see add_surrogate().
+        """
         self.workids={}
         self.bibids={}
+        self.dupes={}
         self.workid_fmt=WORKID_FMT
         self.bibid_fmt='%s'
+        self.bibid_dict=None
+        self.to_str=str
+        if (bibid_codec):
+            self.bibid_dict=bibid_dict.bibid_dict(bibid_codec)
+            self.to_str=self.bibid_dict.bibid
+            self.bibids=array(bibid_index.INT64)
         # Read data if specified
         if (file):
             self.read(file)
             
-    def read(self,file):
-        """Read in workid to bibid pairs into combined workids hash
+    def iter_pairs(self,file):
+        """Generator of (line_number, workid, bibid) from workid to bibid pairs
 
-        Ignores lines starting # and blank lines. Converts all values
-        to integers.
+        Ignores lines starting # and blank lines. Converts workids to
+        integers. Sets self.lines_read and self.read_rate at the end.
+        A columnar file (see columnar.py) is read without parsing text.
         """
-        fh = gzip.open(file,'r')
+        if (columnar.is_columnar(file)):
+            fh = columnar.reader(file)
+            instrument.reading(file, fh)
+            for (n,workid,bibid,pos) in fh.rows():
+                if (pos==0):
+                    yield (n,workid,bibid)
+                elif (pos==1):
+                    logging.info("[%d] more than two elements for bibid %s, ignoring" % (n,workid))
+            fh.close()
+            instrument.set_counts(pair_lines=fh.lines)
+            self.lines_read = fh.lines
+            self.read_rate = gzio.rate_str(fh)
+            return
+        fh = gzio.open_input(file)
+        instrument.reading(file, fh)
         n = 0
         for line in fh:
             n += 1
+            if (n%1000000 == 0):
+                instrument.set_counts(pair_lines=n)
             if (re.match(r'\s*#',line) or not re.search(r'\S',line)):
                 # ignore comment or blank
                 pass
@@ -56,36 +130,76 @@ class workids(object):
                 except Exception as e:
                     logging.warning("[%d] bad line '%s', ignored" % (n,line))
                     continue
-                if (workid in self.workids):
-                    self.workids[workid].append(bibid)
-                else:
-                    self.workids[workid]=[bibid]
-                # Look for dupes
-                if (bibid in self.bibids):
-                    # We expect many dupe pairs, look for the special
-                    # case of same bibid with different workids
-                    if (workid not in self.bibids[bibid]):
-                        self.bibids[bibid].append(workid)
-                        logging.warning("Dupe: bibid %s attached to multiple workids [%s]" % (bibid,",".join([str(x) for x in self.bibids[bibid]])))
-                else:
-                    self.bibids[bibid]=[workid]
+                yield (n,workid,bibid)
         fh.close()
-        logging.warning("read %d lines from %s, have %d works" % (n,file,len(self.workids)))
+        instrument.set_counts(pair_lines=n)
+        self.lines_read = n
+        self.read_rate = gzio.rate_str(fh)
+
+    def read(self,file):
+        """Read in workid to bibid pairs into combined workids hash
+
+        See iter_pairs() for format.
+        """
+        for (n,workid,bibid) in self.iter_pairs(file):
+            if (self.bibid_dict is not None):
+                bibid = self.bibid_dict.id(bibid)
+            if (workid in self.workids):
+                self.workids[workid].append(bibid)
+            else:
+                self.workids[workid]=[bibid]
+            # Look for dupes
+            if (self.bibid_dict is not None):
+                self.add_surrogate(bibid,workid)
+            elif (bibid in self.bibids):
+                # We expect many dupe pairs, look for the special
+                # case of same bibid with different workids
+                if (workid not in self.bibids[bibid]):
+                    self.bibids[bibid].append(workid)
+                    logging.warning(dupe_message(bibid,self.bibids[bibid]))
+            else:
+                self.bibids[bibid]=[workid]
+        logging.warning("read %d lines from %s%s, have %d works" % (self.lines_read,file,self.read_rate,len(self.workids)))
 
-    def write_works_data(self,file):
+    def add_surrogate(self,surrogate,workid):
+        """Add workid for bibid surrogate, logging any dupe as read() does
+
+        Surrogates are dense so self.bibids is an array of the first
+        workid of each, only bibids with more than one workid have a
+        list of them in self.dupes.
+        """
+        if (surrogate==len(self.bibids)):
+            self.bibids.append(workid)
+            return
+        if (surrogate in self.dupes):
+            workids = self.dupes[surrogate]
+            if (workid in workids):
+                return
+            workids.append(workid)
+        elif (self.bibids[surrogate]!=workid):
+            workids = [self.bibids[surrogate],workid]
+            self.dupes[surrogate] = workids
+        else:
+            return
+        logging.warning(dupe_message(self.to_str(surrogate),workids))
+
+    def write_works_data(self,file,groups=None):
         """Write out OCLC workid to bibid mappings
         
         Write comment line to start. Other lines are workid followed by
-        one or more bibids.
+        one or more bibids. groups are (workid, bibids) in workid order,
+        default is from the in-memory data.
         """
-        fh = gzip.open(file,'w')
+        if (groups is None):
+            groups = ((workid,[self.to_str(x) for x in self.workids[workid]]) for workid in sorted(self.workids.keys(),key=int))
+        fh = columnar.open_output(file)
         fh.write("#workid bibids\n")
         fh.write("#workid fmt string is %s to get URI\n" % (self.workid_fmt))
         fh.write("#prefix fmt string is  %s to get URI\n" % (self.bibid_fmt))
         n = 0
-        for workid in sorted(self.workids.keys(),key=int):
+        for (workid,bibids) in groups:
             n += 1
-            fh.write("%d %s\n" % (workid," ".join([str(x) for x in self.workids[workid]])))
+            fh.write("%d %s\n" % (workid," ".join([str(x) for x in bibids])))
         fh.close()
         logging.warning("written %d workid lines to %s" % (n,file))
 
@@ -94,52 +208,143 @@ class workids(object):
         
         Output via logger
         """
-        counts={}
-        example={}
+        h = histogram(self.workid_fmt,self.bibid_fmt,self.to_str)
         for workid in self.workids:
-            n=len(self.workids[workid])
-            if (n in counts):
-                counts[n] += 1
-            else:
-                counts[n] = 1
-                # Add first case as example, add first 3 (at most) bibid links
-                biblinks = [self.bibid_fmt % (x) for x in self.workids[workid][0:3]]
-                example[n] = "%s -> %s" % ( (self.workid_fmt % (workid)),' '.join(biblinks)) 
-        # output histogram data
-        logging.warning("histogram: #num_bibids workids_with_num_bibids (example)")
-        for n in sorted(counts):
-            logging.warning("histogram: %d %d" % (n,counts[n]))
-            logging.warning("histogram_eg: %s" % (example[n]))
-
-
-# Options and arguments
-LOGFILE = 'mx_analyze_workids.log'
-p = optparse.OptionParser(description='Combine and analyze workid to bibid pairs',
-                          usage='usage: %prog [workid_bibid_pairs_in.gz] [workid_bibids_out.gz]')
-p.add_option('--logfile', action='store', default=LOGFILE,
-             help="Log file name (default %s)" % (LOGFILE))
-p.add_option('--verbose', '-v', action='store_true',
-             help="verbose, show additional informational messages")
-p.add_option('--bibid-fmt',action='store',default=CORNELL_BIBID_FMT,
-             help="format string to create URI from bibid")
-(opt, args) = p.parse_args()
-
-if (len(args)!=2):
-    p.print_help()
-    exit(1)
-(workid_bibid_pairs,workid_bibids)=args
-
-level = logging.INFO if (opt.verbose) else logging.WARNING
-logging.basicConfig(filename=opt.logfile, level=level)
-logging.warning("STARTED at %s" % (datetime.datetime.now()))
-
-# Read bibid--oclcnum data into memory
-w = workids(workid_bibid_pairs)
-w.bibid_fmt=opt.bibid_fmt
-logging.info("Have %d workids, %d bibids" % (len(w.workids),len(w.bibids)))
-
-# Write out combined works data and stats
-w.write_works_data(workid_bibids)
-w.stats()
-
-logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+            h.add(workid,self.workids[workid])
+        h.log()
+
+    def memory_bytes(self):
+        """Bytes used by the in-memory data, walks all of it so is slow"""
+        n = bibid_dict.deep_size((self.workids,self.bibids,self.dupes))
+        if (self.bibid_dict is not None):
+            n += self.bibid_dict.memory_bytes()
+        return n
+
+    def analyze_sorted(self,file,out_file,max_items=extsort.MAX_ITEMS,tmpdir=None):
+        """Bounded memory equivalent of read(), write_works_data() and stats()
+
+        The pairs are externally sorted by (bibid, line) to find bibids
+        with more than one workid, and by (workid, line) to group bibids
+        for each workid. The dupe warnings are logged in line order and
+        the output file and histogram counts are the same as from the
+        in-memory data. The histogram examples differ as the workids
+        are added in sorted order so each example is the lowest workid
+        with that number of bibids, stats() takes the first in dict
+        order.
+        """
+        by_work = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+        by_bibid = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+        instrument.phase('sort')
+        for (n,workid,bibid) in self.iter_pairs(file):
+            by_work.add((workid,n,bibid))
+            by_bibid.add((bibid,n,workid))
+        # Dupes, sorted back into line order
+        instrument.phase('merge')
+        dupes = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+        num_bibids = 0
+        last = None
+        for (bibid,n,workid) in by_bibid:
+            if (bibid!=last):
+                num_bibids += 1
+                last = bibid
+                bibid_workids = [workid]
+            elif (workid not in bibid_workids):
+                bibid_workids.append(workid)
+                dupes.add((n,dupe_message(bibid,bibid_workids)))
+        for (n,message) in dupes:
+            logging.warning(message)
+        # Group by workid, writing and counting for histogram
+        h = histogram(self.workid_fmt,self.bibid_fmt)
+        self.num_works = 0
+        def groups():
+            for (workid,bibids) in group_by_first(by_work):
+                h.add(workid,bibids)
+                self.num_works += 1
+                yield (workid,bibids)
+        self.write_works_data(out_file,groups())
+        logging.warning("read %d lines from %s%s, have %d works" % (self.lines_read,file,self.read_rate,self.num_works))
+        logging.info("Have %d workids, %d bibids" % (self.num_works,num_bibids))
+        h.log()
+
+
+def group_by_first(items):
+    """Generator of (key, [values]) from sorted (key, seq, value) items"""
+    last = None
+    values = []
+    for (key,seq,value) in items:
+        if (key!=last):
+            if (values):
+                yield (last,values)
+            last = key
+            values = []
+        values.append(value)
+    if (values):
+        yield (last,values)
+
+
+def main():
+    # Options and arguments
+    LOGFILE = 'mx_analyze_workids.log'
+    p = optparse.OptionParser(description='Combine and analyze workid to bibid pairs',
+                              usage='usage: %prog [workid_bibid_pairs_in.gz] [workid_bibids_out.gz]')
+    p.add_option('--logfile', action='store', default=LOGFILE,
+                 help="Log file name (default %s)" % (LOGFILE))
+    p.add_option('--verbose', '-v', action='store_true',
+                 help="verbose, show additional informational messages")
+    p.add_option('--bibid-fmt',action='store',default=CORNELL_BIBID_FMT,
+                 help="format string to create URI from bibid")
+    p.add_option('--bibid-dict', action='store', default=None, metavar='CODEC',
+                 help="Hold bibids as integer surrogates from a bibid dictionary packing them with CODEC (%s), not used with --external-sort" % (", ".join(sorted(bibid_dict.CODECS))))
+    p.add_option('--memory-report', action='store_true',
+                 help="Log bytes used by the in-memory data after reading (slow)")
+    p.add_option('--external-sort', action='store_true',
+                 help="Group by external sort with bounded memory instead of in-memory dicts, output is the same but histogram examples are the lowest workids")
+    p.add_option('--sort-buffer', action='store', type='int', default=extsort.MAX_ITEMS,
+                 help="Number of items to sort in memory before spilling to disk with --external-sort (default %default)")
+    p.add_option('--tmpdir', action='store', default=None,
+                 help="Directory for temporary spill files (default system temp)")
+    instrument.add_options(p)
+    profiling.add_options(p)
+    (opt, args) = p.parse_args()
+
+    if (len(args)!=2):
+        p.print_help()
+        exit(1)
+    (workid_bibid_pairs,workid_bibids)=args
+    if (opt.bibid_dict is not None and opt.bibid_dict not in bibid_dict.CODECS):
+        sys.stderr.write('Error - Unknown --bibid-dict codec %s\n\n' % (opt.bibid_dict))
+        exit(1)
+
+    level = logging.INFO if (opt.verbose) else logging.WARNING
+    logging.basicConfig(filename=opt.logfile, level=level)
+    logging.warning("STARTED at %s" % (datetime.datetime.now()))
+    instrument.set_inputs([workid_bibid_pairs])
+    instrument.start(opt)
+    profiling.start(opt)
+
+    if (opt.external_sort):
+        # Stream through sorted runs, never holding all pairs in memory
+        w = workids()
+        w.bibid_fmt=opt.bibid_fmt
+        w.analyze_sorted(workid_bibid_pairs,workid_bibids,
+                         max_items=opt.sort_buffer,tmpdir=opt.tmpdir)
+    else:
+        # Read bibid--oclcnum data into memory
+        instrument.phase('read')
+        w = workids(workid_bibid_pairs,bibid_codec=opt.bibid_dict)
+        w.bibid_fmt=opt.bibid_fmt
+        logging.info("Have %d workids, %d bibids" % (len(w.workids),len(w.bibids)))
+        if (opt.memory_report):
+            logging.warning("memory: workid and bibid data use %d bytes" % (w.memory_bytes()))
+
+        # Write out combined works data and stats
+        instrument.phase('write')
+        w.write_works_data(workid_bibids)
+        w.stats()
+
+    profiling.finish()
+    instrument.finish()
+    logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+
+if __name__ == '__main__':
+    main()
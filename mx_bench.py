@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+#
+# Benchmark harness for the mx_* pipeline
+#
+# performance.md has hand-run `time` transcripts, this makes the same
+# sort of measurement repeatable:
+#
+#  generate - write a deterministic synthetic corpus: MARCXML and
+#             MARC21 files with the same records, and a concordance.
+#             The 035/079 values mix the prefixes seen in real data
+#             (see oclcnum.sample_refs()) with dupes, e-suffixed and
+#             bad entries, and some concordance lines have NONE
+#             workids. Same options and seed give the same bytes.
+#  run      - run each pipeline stage as a separate process over a
+#             corpus and write wall/user/sys time, items/s, MB/s and
+#             peak RSS for each stage to a JSON results file.
+#  compare  - compare results with a stored baseline and flag stages
+#             that got slower or bigger by more than a threshold,
+#             exits 1 if there are any regressions.
+#
+# e.g.
+#   mx_bench.py generate --records 1000000 --lines 50000000 /data/bench
+#   mx_bench.py run /data/bench baseline.json
+#   ...change code...
+#   mx_bench.py run /data/bench new.json
+#   mx_bench.py compare baseline.json new.json
+#
+import os
+import os.path
+import sys
+import glob
+import json
+import time
+import random
+import optparse
+import platform
+import datetime
+import subprocess
+import gzio
+
+MANIFEST = 'manifest.json'
+CONCORDANCE = 'concordance.gz'
+XML_FMT = 'bib.%03d.xml.gz'
+MARC21_FMT = 'bib.%03d.mrc.gz'
+MB = 1024.0*1024.0
+
+# 035$a formats, with weights, for a record's OCLC number
+OCLC_FMTS = [('(OCoLC)%d',40),('(OCoLC)ocm%08d',20),('(OCoLC)ocn%09d',10),
+             ('ocm%08d',8),('ocn%09d',6),('(OCoLC-M)%d',6),(' (OCoLC)%d ',5),
+             ('(OCoLC)%010d',5)]
+# Other 035$a values that aren't OCLC numbers, or are bad ones
+OTHER_FMTS = ['(DLC)%d','(CStRLIN)NYCX%d-B','(NIC)notisA%d']
+SUFFIX_FMT = '(OCoLC)%de'
+BAD_FMT = '(OCoLC)%d %d'
+# Proportions of records with: no OCLC number, two different numbers,
+# the same number twice, an e-suffixed or bad entry, an 079
+P_NONE = 0.2
+P_MULTI = 0.05
+P_DUPE = 0.1
+P_ESUFFIX = 0.02
+P_BAD = 0.02
+P_079 = 0.1
+# Proportion of record OCLC numbers that aren't in the concordance,
+# of concordance lines whose second number differs, with NONE workid
+P_UNMATCHED = 0.2
+P_COL2 = 0.1
+P_NONE_WORKID = 0.02
+# Concordance line i is for OCLC number OCLCNUM_BASE+i*OCLCNUM_STEP
+OCLCNUM_BASE = 1000
+OCLCNUM_STEP = 13
+WORKID_BASE = 10000000
+
+
+class corpus_generator(object):
+    """Deterministic synthetic records and concordance lines"""
+
+    def __init__(self,records=10000,lines=1000000,seed=1,record_bytes=1000):
+        self.records = records
+        self.lines = lines
+        self.seed = seed
+        self.record_bytes = record_bytes
+        self.fmts = []
+        for (fmt,weight) in OCLC_FMTS:
+            self.fmts.extend([fmt]*weight)
+
+    def oclcnum(self,rnd):
+        """Random OCLC number, in the concordance or not"""
+        i = rnd.randrange(int(self.lines/(1.0-P_UNMATCHED)))
+        return OCLCNUM_BASE+i*OCLCNUM_STEP
+
+    def oclc_fields(self,rnd):
+        """List of (tag,value) for 035$a and 079$a of one record"""
+        fields = [('035',rnd.choice(OTHER_FMTS) % rnd.randint(1,9999999))]
+        if (rnd.random()<P_NONE):
+            return fields
+        num = self.oclcnum(rnd)
+        fields.append(('035',rnd.choice(self.fmts) % num))
+        if (rnd.random()<P_DUPE):
+            fields.append(('035',rnd.choice(self.fmts) % num))
+        if (rnd.random()<P_MULTI):
+            fields.append(('035',rnd.choice(self.fmts) % self.oclcnum(rnd)))
+        if (rnd.random()<P_ESUFFIX):
+            fields.append(('035',SUFFIX_FMT % self.oclcnum(rnd)))
+        if (rnd.random()<P_BAD):
+            fields.append(('035',BAD_FMT % (self.oclcnum(rnd),rnd.randint(1,999))))
+        if (rnd.random()<P_079):
+            fields.append(('079','ocm%08d' % num))
+        return fields
+
+    def records_iter(self):
+        """Generator of (bibid,oclc_fields,filler) for each record"""
+        rnd = random.Random(self.seed)
+        words = ['catalog','library','history','studies','science','letters',
+                 'press','university','journal','collected','works','annual']
+        for n in range(self.records):
+            bibid = str(n+1)
+            oclc_fields = self.oclc_fields(rnd)
+            size = rnd.randint(self.record_bytes/2,self.record_bytes*3/2)
+            filler = ' '.join([rnd.choice(words) for x in range(size/8)])
+            yield (bibid,oclc_fields,filler)
+
+    def concordance_iter(self):
+        """Generator of concordance lines"""
+        rnd = random.Random(self.seed+1)
+        workid = WORKID_BASE
+        for i in range(self.lines):
+            num = OCLCNUM_BASE+i*OCLCNUM_STEP
+            if (rnd.random()<0.3):
+                workid += rnd.randint(1,3)
+            if (rnd.random()<P_NONE_WORKID):
+                yield "%d\t%d\tNONE\n" % (num,num)
+                continue
+            num2 = num
+            if (rnd.random()<P_COL2 and i>0):
+                num2 = OCLCNUM_BASE+rnd.randrange(i)*OCLCNUM_STEP
+            yield "%d\t%d\t%d\n" % (num,num2,workid)
+
+
+def marcxml_record(bibid,oclc_fields,filler):
+    """MARCXML for one record"""
+    fields = ['<record><leader>00000nam a2200000 a 4500</leader>',
+              '<controlfield tag="001">%s</controlfield>' % (bibid),
+              '<controlfield tag="008">140919s2014    nyu           000 0 eng d</controlfield>']
+    for (tag,value) in oclc_fields:
+        fields.append('<datafield tag="%s" ind1=" " ind2=" "><subfield code="a">%s</subfield></datafield>' % (tag,value))
+    fields.append('<datafield tag="245" ind1="1" ind2="0"><subfield code="a">%s</subfield></datafield>' % (filler[:200]))
+    fields.append('<datafield tag="520" ind1=" " ind2=" "><subfield code="a">%s</subfield></datafield>' % (filler))
+    fields.append('</record>\n')
+    return ''.join(fields)
+
+def marc21_record(bibid,oclc_fields,filler):
+    """MARC21 transmission format for one record"""
+    fields = [('001',bibid),('008','140919s2014    nyu           000 0 eng d')]
+    for (tag,value) in oclc_fields:
+        fields.append((tag,'  \x1fa'+value))
+    fields.append(('245','10\x1fa'+filler[:200]))
+    fields.append(('520','  \x1fa'+filler))
+    directory = []
+    data = []
+    offset = 0
+    for (tag,value) in fields:
+        value += '\x1e'
+        directory.append('%s%04d%05d' % (tag,len(value),offset))
+        data.append(value)
+        offset += len(value)
+    base = 24+12*len(directory)+1
+    length = base+offset+1
+    leader = '%05dnam a22%05d a 4500' % (length,base)
+    return leader+''.join(directory)+'\x1e'+''.join(data)+'\x1d'
+
+def generate(dir,records=10000,lines=1000000,files=1,seed=1,record_bytes=1000):
+    """Write corpus to dir, returns manifest dict (also written to dir)"""
+    if (not os.path.isdir(dir)):
+        os.makedirs(dir)
+    gen = corpus_generator(records=records,lines=lines,seed=seed,record_bytes=record_bytes)
+    per_file = (records+files-1)/files
+    xml = None
+    marc21 = None
+    n = 0
+    for (bibid,oclc_fields,filler) in gen.records_iter():
+        if (n%per_file==0):
+            if (xml is not None):
+                xml.write('</collection>\n')
+                xml.close()
+                marc21.close()
+            xml = gzio.open_output(os.path.join(dir,XML_FMT % (n/per_file+1)))
+            xml.write('<?xml version="1.0" encoding="UTF-8"?>\n<collection xmlns="http://www.loc.gov/MARC21/slim">\n')
+            marc21 = gzio.open_output(os.path.join(dir,MARC21_FMT % (n/per_file+1)))
+        xml.write(marcxml_record(bibid,oclc_fields,filler))
+        marc21.write(marc21_record(bibid,oclc_fields,filler))
+        n += 1
+    if (xml is not None):
+        xml.write('</collection>\n')
+        xml.close()
+        marc21.close()
+    fh = gzio.open_output(os.path.join(dir,CONCORDANCE))
+    for line in gen.concordance_iter():
+        fh.write(line)
+    fh.close()
+    manifest = {'records': records, 'lines': lines, 'files': files,
+                'seed': seed, 'record_bytes': record_bytes}
+    json.dump(manifest,open(os.path.join(dir,MANIFEST),'w'),indent=1,sort_keys=True)
+    return manifest
+
+
+def stages(dir,out):
+    """List of (name,args,input_files,output_file,items_key) for corpus in dir
+
+    Each stage reads the output of earlier ones, output_file is where
+    stdout goes (None to discard).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    def script(name):
+        return [sys.executable,os.path.join(here,name)]
+    xml = sorted(glob.glob(os.path.join(dir,'bib.*.xml.gz')))
+    marc21 = sorted(glob.glob(os.path.join(dir,'bib.*.mrc.gz')))
+    conc = os.path.join(dir,CONCORDANCE)
+    bo = os.path.join(out,'bibid_to_oclcnums.dat')
+    pairs = os.path.join(out,'workid_bibid_pairs.dat.gz')
+    log = lambda name: ['--logfile',os.path.join(out,name+'.log')]
+    return [
+        ('count_xml',script('mx_count.py')+xml,xml,None,'records'),
+        ('grep_xml',script('mx_grep_oclc.py')+log('grep_xml')+xml,xml,bo,'records'),
+        ('grep_marc21',script('mx_grep_oclc.py')+log('grep_marc21')+['--marc21']+marc21,marc21,None,'records'),
+        ('get_workids',script('mx_get_oclc_workids.py')+log('get_workids')+['--write-pairs',pairs,bo,conc],[bo,conc],None,'lines'),
+        ('analyze',script('mx_analyze_workids.py')+log('analyze')+[pairs,os.path.join(out,'workid_bibids.dat.gz')],[pairs],None,None),
+    ]
+
+def run_stage(args,output_file=None):
+    """Run args as child process, returns dict of wall, user, sys, max_rss_kb
+
+    os.wait4() gives the resource usage of just that child, so the
+    peak RSS is for this stage alone.
+    """
+    out = (open(output_file,'w') if output_file else open(os.devnull,'w'))
+    start = time.time()
+    p = subprocess.Popen(args,stdout=out)
+    (pid,status,rusage) = os.wait4(p.pid,0)
+    wall = time.time()-start
+    out.close()
+    if (status!=0):
+        raise Exception("Stage failed with status %d: %s" % (status,' '.join(args)))
+    # ru_maxrss is KB on Linux, bytes on Mac OS X
+    max_rss_kb = (rusage.ru_maxrss/1024 if sys.platform=='darwin' else rusage.ru_maxrss)
+    return {'wall': wall, 'user': rusage.ru_utime, 'sys': rusage.ru_stime, 'max_rss_kb': max_rss_kb}
+
+def run(dir,out,names=None,repeat=1,extra_args=None,log=None):
+    """Run stages over corpus in dir, returns results dict
+
+    The best (lowest wall time) of repeat runs of each stage is
+    reported, with all runs listed. extra_args is a dict of stage name
+    to list of extra arguments (e.g. to try --fast-scan).
+    """
+    manifest = json.load(open(os.path.join(dir,MANIFEST)))
+    if (not os.path.isdir(out)):
+        os.makedirs(out)
+    results = {'created': str(datetime.datetime.now()),
+               'host': platform.node(), 'python': platform.python_version(),
+               'corpus': manifest, 'extra_args': (extra_args or {}), 'stages': {}}
+    for (name,args,inputs,output_file,items_key) in stages(dir,out):
+        if (names and name not in names):
+            continue
+        args = args[:2]+(extra_args or {}).get(name,[])+args[2:]
+        input_bytes = sum([os.path.getsize(f) for f in inputs])
+        runs = [run_stage(args,output_file) for r in range(repeat)]
+        best = dict(min(runs,key=lambda r: r['wall']))
+        best['input_mb'] = input_bytes/MB
+        best['mb_per_s'] = best['input_mb']/best['wall']
+        if (items_key):
+            best['items'] = manifest[items_key]
+            best['items_per_s'] = best['items']/best['wall']
+        best['runs'] = runs
+        results['stages'][name] = best
+        if (log):
+            log.write(stage_str(name,best)+"\n")
+    return results
+
+def stage_str(name,r):
+    """One line summary of stage result"""
+    rate = ("%10.0f items/s" % r['items_per_s'] if 'items_per_s' in r else ' '*16)
+    return "%-12s %8.2fs %s %8.2f MB/s %8d KB max RSS" % (name,r['wall'],rate,r['mb_per_s'],r['max_rss_kb'])
+
+def compare(baseline,results,threshold=0.1,rss_threshold=0.2):
+    """List of (name,what,old,new) for stages slower or bigger than baseline
+
+    Slower means wall time up by more than threshold (fraction),
+    bigger means peak RSS up by more than rss_threshold.
+    """
+    regressions = []
+    for name in sorted(results['stages']):
+        if (name not in baseline['stages']):
+            continue
+        old = baseline['stages'][name]
+        new = results['stages'][name]
+        if (new['wall']>old['wall']*(1.0+threshold)):
+            regressions.append((name,'wall',old['wall'],new['wall']))
+        if (new['max_rss_kb']>old['max_rss_kb']*(1.0+rss_threshold)):
+            regressions.append((name,'max_rss_kb',old['max_rss_kb'],new['max_rss_kb']))
+    return regressions
+
+
+def main():
+    p = optparse.OptionParser(description='Benchmark harness for the mx_* pipeline',
+                              usage='usage: %prog generate [[opts]] corpus_dir\n'
+                                    '       %prog run [[opts]] corpus_dir results.json\n'
+                                    '       %prog compare [[opts]] baseline.json results.json')
+    p.add_option('--records', action='store', type='int', default=10000,
+                 help="generate: number of records (default %default)")
+    p.add_option('--files', action='store', type='int', default=1,
+                 help="generate: number of files to split records over (default %default)")
+    p.add_option('--lines', action='store', type='int', default=1000000,
+                 help="generate: number of concordance lines (default %default)")
+    p.add_option('--record-bytes', action='store', type='int', default=1000,
+                 help="generate: average filler bytes per record (default %default)")
+    p.add_option('--seed', action='store', type='int', default=1,
+                 help="generate: random seed (default %default)")
+    p.add_option('--stages', action='store', default=None,
+                 help="run: comma separated stages to run (default all, later stages need output of earlier ones)")
+    p.add_option('--repeat', action='store', type='int', default=1,
+                 help="run: number of times to run each stage, best is reported (default %default)")
+    p.add_option('--args', action='append', default=[],
+                 help="run: extra arguments for a stage as stage='args' (repeatable)")
+    p.add_option('--outdir', action='store', default=None,
+                 help="run: directory for stage outputs and logs (default corpus_dir/out)")
+    p.add_option('--threshold', action='store', type='float', default=0.1,
+                 help="compare: flag stages with wall time up by more than this fraction (default %default)")
+    p.add_option('--rss-threshold', action='store', type='float', default=0.2,
+                 help="compare: flag stages with peak RSS up by more than this fraction (default %default)")
+    (opt, args) = p.parse_args()
+
+    command = (args[0] if args else None)
+    if (command=='generate' and len(args)==2):
+        start = time.time()
+        generate(args[1],records=opt.records,lines=opt.lines,files=opt.files,
+                 seed=opt.seed,record_bytes=opt.record_bytes)
+        print "Generated %d records, %d concordance lines in %s (%.1fs)" % (opt.records,opt.lines,args[1],time.time()-start)
+    elif (command=='run' and len(args)==3):
+        extra_args = {}
+        for a in opt.args:
+            (name,value) = a.split('=',1)
+            extra_args[name] = value.split()
+        names = (opt.stages.split(',') if opt.stages else None)
+        results = run(args[1],(opt.outdir or os.path.join(args[1],'out')),names=names,
+                      repeat=opt.repeat,extra_args=extra_args,log=sys.stdout)
+        json.dump(results,open(args[2],'w'),indent=1,sort_keys=True)
+    elif (command=='compare' and len(args)==3):
+        baseline = json.load(open(args[1]))
+        results = json.load(open(args[2]))
+        if (baseline['corpus']!=results['corpus']):
+            print "Warning - results are for different corpora"
+        for name in sorted(results['stages']):
+            if (name in baseline['stages']):
+                old = baseline['stages'][name]
+                new = results['stages'][name]
+                print "%-12s %8.2fs -> %8.2fs (%+5.1f%%) %8d -> %8d KB max RSS" % (name,old['wall'],new['wall'],100.0*(new['wall']/old['wall']-1.0),old['max_rss_kb'],new['max_rss_kb'])
+        regressions = compare(baseline,results,opt.threshold,opt.rss_threshold)
+        for (name,what,old,new) in regressions:
+            print "REGRESSION %s %s: %s -> %s" % (name,what,old,new)
+        if (regressions):
+            exit(1)
+    else:
+        sys.stderr.write('Error - Must give generate, run or compare and their arguments\n\n')
+        p.print_help()
+        exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+#
+# One-time conversion of OCLC's oclcnum to workid concordance into
+# the memory mappable binary store read by mx_get_oclc_workids.py
+# (see concordance_index.py). Pass the index directory in place of
+# the concordance file to mx_get_oclc_workids.py to use it.
+#
+import sys
+import optparse
+import logging
+import datetime
+import extsort
+import concordance_index
+import instrument
+import profiling
+
+# Options and arguments
+LOGFILE = "mx_build_concordance_index.log"
+p = optparse.OptionParser(description='Build binary index of OCLC oclcnum to workid concordance',
+                          usage='usage: %prog [oclc_concordance.gz] [index_dir]')
+p.add_option('--sort-buffer', action='store', type='int', default=extsort.MAX_ITEMS,
+             help="Number of rows to sort in memory before spilling to disk (default %default)")
+p.add_option('--tmpdir', action='store', default=None,
+             help="Directory for temporary spill files (default system temp)")
+p.add_option('--logfile', action='store', default=LOGFILE,
+             help="Log file name (default %s)" % (LOGFILE))
+instrument.add_options(p)
+profiling.add_options(p)
+(opt, args) = p.parse_args()
+
+if (len(args)!=2):
+    sys.stderr.write('Error - Must have 2 arguments\n\n')
+    p.print_help()
+    exit(1)
+(oclc_concordance_file,index_dir)=args
+
+logging.basicConfig(filename=opt.logfile)
+logging.warning("STARTED at %s" % (datetime.datetime.now()))
+instrument.set_inputs([oclc_concordance_file])
+instrument.start(opt)
+profiling.start(opt)
+instrument.phase('read_concordance')
+meta = concordance_index.build(oclc_concordance_file,index_dir,
+                               max_items=opt.sort_buffer,tmpdir=opt.tmpdir)
+logging.warning("%d lines, %d rows, %d with workid=NONE, %d bad lines" % (meta['lines'],meta['rows'],meta['none_workid'],meta['bad_lines']))
+profiling.finish()
+instrument.finish()
+logging.warning("FINISHED at %s" % (datetime.datetime.now()))
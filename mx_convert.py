@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+#
+# Convert bibid to oclcnums, workid bibid pairs and workid to bibids
+# data between the gzipped text format and the binary columnar format
+# (see columnar.py).
+#
+# The direction is from the output file name: .mxc is written as
+# columnar, anything else as gzipped text. Input of either format is
+# recognized from its contents.
+#
+import sys
+import optparse
+import logging
+import datetime
+import columnar
+import instrument
+
+def convert(in_file,out_file,kind=None):
+    """Copy lines of in_file to out_file, returns number of lines"""
+    fh = columnar.open_input(in_file)
+    instrument.reading(in_file, fh)
+    if (columnar.is_columnar_name(out_file)):
+        ofh = columnar.writer(out_file,kind)
+    else:
+        ofh = columnar.open_output(out_file)
+    n = 0
+    for line in fh:
+        n += 1
+        ofh.write(line)
+    fh.close()
+    ofh.close()
+    return n
+
+def main():
+    # Options and arguments
+    LOGFILE = 'mx_convert.log'
+    p = optparse.OptionParser(description='Convert mx_* data between text and binary columnar formats',
+                              usage='usage: %prog [in_file] [out_file(.mxc for columnar)]',
+                              epilog='Kinds are bibid_oclcnums (mx_grep_oclc.py output), workid_bibid (mx_get_oclc_workids.py --write-pairs) and workid_bibids (mx_analyze_workids.py output).')
+    p.add_option('--kind', action='store', default=None,
+                 help="Kind of data when writing columnar, default is from the first comment line")
+    p.add_option('--logfile', action='store', default=LOGFILE,
+                 help="Log file name (default %s)" % (LOGFILE))
+    instrument.add_options(p)
+    (opt, args) = p.parse_args()
+
+    if (len(args)!=2):
+        sys.stderr.write('Error - Must have 2 arguments\n\n')
+        p.print_help()
+        exit(1)
+    if (opt.kind is not None and opt.kind not in columnar.KINDS):
+        sys.stderr.write('Error - --kind must be one of %s\n\n' % (', '.join(sorted(columnar.KINDS))))
+        exit(1)
+    (in_file,out_file) = args
+
+    logging.basicConfig(filename=opt.logfile)
+    logging.warning("STARTED at %s" % (datetime.datetime.now()))
+    instrument.set_inputs([in_file])
+    instrument.start(opt)
+    n = convert(in_file,out_file,opt.kind)
+    logging.warning("converted %d lines from %s to %s" % (n,in_file,out_file))
+    instrument.finish()
+    logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+
+if __name__ == '__main__':
+    main()
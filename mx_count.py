@@ -8,10 +8,16 @@
 # the underlying xml.sax works that way, hence can open a gzip
 # and pass in handle directly)
 import sys
-import gzip
+import gzio
 import pymarc
 import re
 import optparse
+import logging
+import multiprocessing
+import marcxml_reader
+import fast_count
+import instrument
+import profiling
 
 seen = 0
 
@@ -19,6 +25,37 @@ def count(record):
     global seen
     seen += 1
 
+def count_file(arg):
+    """Count records in file arg
+
+    Returns (note, records, validated, failed) where note is the
+    Reading line for --verbose. Run in worker processes with --jobs.
+    """
+    global seen
+    seen = 0
+    marc21 = (opt.marc21 or (not opt.xml and re.search(r'(marc21|marc|mrc)(\.gz)?$',arg)))
+    kind = ('MARC21' if marc21 else 'MARCXML')
+    if (re.search(r'\.gz$',arg)):
+        note = "Reading %s as gzipped %s" % (arg,kind)
+        fh = gzio.open_input(arg)
+    else:
+        note = "Reading %s as %s" % (arg,kind)
+        fh = open(arg,'rb')
+    instrument.reading(arg, fh)
+    ctr = fast_count.counter(validate=opt.validate)
+    with profiling.unit(arg):
+        if (marc21):
+            seen = ctr.count_marc21(fh)
+        elif (opt.fast_count or opt.validate):
+            seen = ctr.count_xml(fh)
+        elif (opt.pymarc):
+            pymarc.map_xml(count, fh)
+        else:
+            # No fields needed just to count records
+            marcxml_reader.map_xml(count, fh, tags=())
+    fh.close()
+    return (note, seen, ctr.validated, ctr.failed)
+
 # Options and arguments
 __version__ = '0.0.1'
 p = optparse.OptionParser(description='MARCXML Record Counter',
@@ -26,24 +63,58 @@ p = optparse.OptionParser(description='MARCXML Record Counter',
                           version='%prog '+__version__ )
 p.add_option('--verbose', '-v', action='store_true',
               help="verbose, show additional informational messages")
+p.add_option('--pymarc', action='store_true',
+              help="Parse with pymarc.map_xml instead of the lean marcxml_reader")
+p.add_option('--fast-count', action='store_true',
+              help="Count MARCXML record start tags in the bytes without parsing (see fast_count.py)")
+p.add_option('--xml', action='store_true',
+              help="Records are MARCXML")
+p.add_option('--marc21', action='store_true',
+              help="Records are MARC21, counted by hopping over record lengths in leaders (default if file name ends marc21, marc or mrc)")
+p.add_option('--validate', action='store', type='int', default=0,
+              help="Fully parse every Nth record, failures are logged and give exit code 1 (implies --fast-count)")
+p.add_option('--jobs', '-j', action='store', type='int', default=1,
+              help="Number of worker processes to count files in (default 1, no workers)")
+instrument.add_options(p)
+profiling.add_options(p, units='files')
 (opt, args) = p.parse_args()
+if (opt.xml and opt.marc21):
+    sys.stderr.write("Cannot use both --xml and --marc21 options!\n")
+    exit(2)
 
 # Loop over all files specified counting records in each
 total = 0
+validated = 0
+failed = 0
 fmt = "%-7d %s"
-for arg in args:
+instrument.set_inputs(args)
+instrument.add_source(lambda: {'records_seen': total+seen})
+instrument.start(opt)
+profiling.start(opt)
+if (opt.jobs>1 and len(args)>1):
+    # Workers count whole files, imap() gives results in file order
+    pool = multiprocessing.Pool(processes=opt.jobs)
+    results = pool.imap(count_file, args)
+else:
+    pool = None
+    results = (count_file(arg) for arg in args)
+for (arg,(note,n,v,f)) in zip(args,results):
+    if (opt.verbose):
+        print note
+    print fmt % (n,arg)
+    instrument.input_done(arg)
+    total += n
+    validated += v
+    failed += f
     seen = 0
-    fh = 0
-    if (re.search(r'\.gz$',arg)):
-        if (opt.verbose):
-            print "Reading %s as gzipped MARCXML" % (arg)
-        fh = gzip.open(arg,'rb')
-    else:
-        if (opt.verbose):
-            print "Reading %s as MARCXML" % (arg)
-        fh = open(arg,'rb')
-    pymarc.map_xml(count, fh)
-    print fmt % (seen,arg)
-    total += seen
+if (pool is not None):
+    pool.close()
+    pool.join()
 if (len(args)>1):
     print fmt % (total,'TOTAL')
+if (opt.validate):
+    logging.warning("validated %d records, %d failed" % (validated,failed))
+profiling.finish()
+instrument.finish()
+if (failed>0):
+    exit(1)
@@ -4,12 +4,34 @@
 # oclcnum data previously extracted and OCLC's concordance
 # file of oclcnums to oclc work ids.
 #
+import os
 import sys
-import gzip
+import gzio
 import re
 import optparse
 import logging
 import datetime
+import multiprocessing
+import itertools
+from array import array
+import bibid_index
+from bibid_index import INT64
+import bibid_dict
+import bloom
+import bibid_store
+import columnar
+import extsort
+import concordance_sort
+import concordance_index
+import instrument
+import profiling
+import pipeline
+
+# Bytes of concordance text in each --pipeline work item
+PIPELINE_CHUNK = 1024*1024
+
+# Set before --pipeline worker processes are forked, see match_chunk()
+worker_state = {}
 
 class bibid_oclcnums(object):
 
@@ -18,27 +40,46 @@ class bibid_oclcnums(object):
                  first_oclcnum_only=False,
                  write_workid_bibids=False,
                  write_oclcnum_workid_pairs=False,
-                 write_pairs=None):
+                 write_pairs=None,
+                 compact_index=False,
+                 bibid_codec=None,
+                 bibid_fmt=None):
         # Options
         self.dupeslog=dupeslog
         self.first_oclcnum_only=first_oclcnum_only
         #
-        self.bibids={}
+        self.compact_index=compact_index
+        self.bibid_codec=bibid_codec
+        self.bibid_fmt=bibid_fmt
+        self.prefilter=None
+        if (self.compact_index):
+            self.bibids=bibid_index.compact_bibid_index()
+        elif (self.bibid_codec):
+            # bibids as surrogates from self.bibid_dict, which are
+            # what bo.bibids[oclcnum] gives and add_work() is passed
+            self.bibid_dict=bibid_dict.bibid_dict(self.bibid_codec)
+            self.bibids=bibid_dict.surrogate_index(self.bibid_dict)
+        else:
+            self.bibids={}
         # Actions
         self.write_workid_bibids=write_workid_bibids
         if (self.write_workid_bibids):
             self.works={}
         self.write_oclcnum_workid_pairs=write_oclcnum_workid_pairs
         if (self.write_oclcnum_workid_pairs):
-            # use set() to dedupe pairs, entries are csv strings
-            self.oclccn2oclcwn=set()
+            # (oclcnums, workids) parallel int64 columns, 16 bytes a
+            # pair, duplicates are dropped when sorted for writing
+            self.oclccn2oclcwn=(array(INT64),array(INT64))
         self.write_pairs=write_pairs
         if (self.write_pairs):
             # Set up output file
-            self.ofh = gzip.open(self.write_pairs,'w')
+            self.ofh = columnar.open_output(self.write_pairs)
             self.ofh.write("#workid bibid\n")
             self.ofh.write("#prefix workid with http://worldcat.org/entity/work/id/ to get URI\n")
-            self.ofh.write("#prefix bibids with http://newcatalog.library.cornell.edu/catalog/ to get URI\n")
+            if (self.bibid_fmt):
+                self.ofh.write("#prefix fmt string is  %s to get URI\n" % (self.bibid_fmt))
+            else:
+                self.ofh.write("#prefix bibids with http://newcatalog.library.cornell.edu/catalog/ to get URI\n")
             self.ofh.write("#we expect many duplicate lines due to look up based on 001 and 019 OCLC data\n")
         # Read data if specified
         if (file):
@@ -47,10 +88,54 @@ class bibid_oclcnums(object):
     def read_bibid_to_oclcnums(self,file):
         """Read in bibid to oclcnums data
 
+        See iter_bibid_to_oclcnums() for format.
+        """
+        for (oclcnum,bibid) in self.iter_bibid_to_oclcnums(file):
+            self.add_oclcnum_to_bibid(oclcnum,bibid)
+        if (self.compact_index):
+            self.bibids.finalize()
+            logging.warning("compact index uses %d bytes, dict of sets would be about %d bytes" % (self.bibids.memory_bytes(),self.bibids.dict_memory_bytes()))
+        if (self.bibid_codec):
+            self.bibid_dict.freeze()
+            logging.warning("bibid dictionary has %d bibids (%d not packed by %s codec)" % (len(self.bibid_dict),len(self.bibid_dict.odd),self.bibid_codec))
+
+    def build_prefilter(self,fpr=bloom.FPR):
+        """Build Bloom filter of our oclcnums to skip concordance lines"""
+        self.prefilter = bloom.build(self.bibids.keys(),fpr)
+        logging.warning("built bloom filter of %d oclcnums, %d bytes" % (self.prefilter.n,self.prefilter.size_bytes()))
+
+    def iter_bibid_to_oclcnums(self,file):
+        """Generator of (oclcnum, bibid) pairs from bibid to oclcnums data
+
         Ignores lines starting # and blank lines
         Take first entry in the case that there are dupes
+
+        File may instead be a bibid store written by mx_grep_oclc.py
+        --write-sqlite, or columnar (see columnar.py), then the pairs
+        are read from that without parsing text.
         """
-        fh = gzip.open(file,'r')
+        if (columnar.is_columnar(file)):
+            fh = columnar.reader(file)
+            instrument.reading(file, fh)
+            for (n,bibid,oclcnum,pos) in fh.rows():
+                if (pos==0 or not self.first_oclcnum_only):
+                    yield (oclcnum,bibid)
+            fh.close()
+            instrument.set_counts(bibid_lines=fh.lines)
+            logging.warning("read %d lines from %s%s" % (fh.lines,file,gzio.rate_str(fh)))
+            return
+        if (bibid_store.is_store(file)):
+            store = bibid_store.bibid_store(file)
+            n = 0
+            for (oclcnum,bibid) in store.iter_pairs(self.first_oclcnum_only):
+                n += 1
+                yield (oclcnum,bibid)
+            store.close()
+            instrument.input_done(file)
+            logging.warning("read %d oclcnums for %d bibid lines from store %s" % (n,len(store),file))
+            return
+        fh = gzio.open_input(file)
+        instrument.reading(file, fh)
         n = 0
         for line in fh:
             line = line.rstrip()
@@ -66,12 +151,13 @@ class bibid_oclcnums(object):
                     bibid = d[0] #not always integer
                     if (len(d)>2 and self.first_oclcnum_only):
                         logging.info("[%d] ignoring extra %d elements for bibid %s, line is '%s'" % (n,(len(d)-2),d[0],line))
-                        self.add_oclcnum_to_bibid(int(d[1]),bibid)
+                        yield (int(d[1]),bibid)
                     else:
                         for oclcnum in d[1:]:
-                            self.add_oclcnum_to_bibid(int(oclcnum),bibid)
+                            yield (int(oclcnum),bibid)
         fh.close()
-        logging.warning("read %d lines from %s" % (n,file))
+        instrument.set_counts(bibid_lines=n)
+        logging.warning("read %d lines from %s%s" % (n,file,gzio.rate_str(fh)))
 
     def add_oclcnum_to_bibid(self,oclcnum,bibid):
         """Add mapping of oclcnum to bibid
@@ -79,10 +165,21 @@ class bibid_oclcnums(object):
         Deal with the case that a single oclcnum might map to more
         than one bibid.
         """
+        if (self.compact_index or self.bibid_codec):
+            self.bibids.add(oclcnum,bibid)
+            return
         if (oclcnum not in self.bibids):
             self.bibids[oclcnum]=set()
         self.bibids[oclcnum].add(bibid)
 
+    def col2_bibids(self,oclcnum2,oclcnum1):
+        """Bibids for concordance line matched on oclcnum2 (column 2)
+
+        Here just self.bibids[oclcnum2], oclcnum1 is for
+        institutions.col2_bibids().
+        """
+        return self.bibids[oclcnum2]
+
     def add_work(self,oclcnum,bibid,workid):
         """Add record of bibid being example of workid
 
@@ -91,7 +188,19 @@ class bibid_oclcnums(object):
 
         Else, simple write out "workid bibid" pair as it is
         found to avoid using huge memnory.
+
+        With a bibid dictionary bibid is a surrogate.
         """
+        if (self.write_oclcnum_workid_pairs):
+            # first so that a number too big for int64 (OverflowError)
+            # leaves all outputs unchanged
+            (oclcnums,workids) = self.oclccn2oclcwn
+            oclcnums.append(oclcnum)
+            try:
+                workids.append(workid)
+            except OverflowError:
+                oclcnums.pop()
+                raise
         if (self.write_workid_bibids):
             if (workid in self.works):
                 # Add to list, already have one entry
@@ -99,11 +208,11 @@ class bibid_oclcnums(object):
             else:
                 # First bibid for this work
                 self.works[workid]=[bibid]
-        if (self.write_oclcnum_workid_pairs):
-            self.oclccn2oclcwn.add("%d,%d" % (oclcnum,workid))
         if (self.write_pairs):
             # Write out matches as we find them to avoid
             # building everything in memory
+            if (self.bibid_codec):
+                bibid = self.bibid_dict.bibid(bibid)
             self.ofh.write("%d %s\n" % (workid,bibid))
 
     def write_workid_to_bibid_data(self,file):
@@ -112,130 +221,626 @@ class bibid_oclcnums(object):
         Write comment line to start. Other lines are workid followed by
         one or more bibids.
         """
-        fh = gzip.open(file,'w')
+        fh = columnar.open_output(file)
         fh.write("#workid bibids\n")
+        if (self.bibid_fmt):
+            fh.write("#prefix fmt string is  %s to get URI\n" % (self.bibid_fmt))
         n = 0
+        to_str = (self.bibid_dict.bibid if self.bibid_codec else str)
         for workid in sorted(self.works):
             n += 1
-            fh.write("%d %s\n" % (workid," ".join([str(x) for x in self.works[workid]])))
+            fh.write("%d %s\n" % (workid," ".join([to_str(x) for x in self.works[workid]])))
         fh.close()
         logging.warning("written %d lines to %s" % (n,file))
 
-    def write_oclccn2oclcwn(self,file):
+    def write_oclccn2oclcwn(self,file,max_items=extsort.MAX_ITEMS,tmpdir=None):
         """Write cvs format OCLC number, OCLC work number pairs
 
-        Uses same format at Darren's output for Stanford
+        Uses same format at Darren's output for Stanford, sorted as
+        strings and without duplicates. The pairs are kept as two int64
+        columns and the lines sorted with extsort so at most max_items
+        of them are in memory at once.
         """
-        fh = gzip.open(file,'w')
+        lines = extsort.external_sort(max_items=max_items,tmpdir=tmpdir)
+        for pair in itertools.izip(*self.oclccn2oclcwn):
+            lines.add("%d,%d" % pair)
+        fh = gzio.open_output(file)
         #fh.write("#oclccn,oclcwns\n")
         n = 0
-        for pair in sorted(self.oclccn2oclcwn):
-            n += 1
-            fh.write(pair + "\n")
+        last = None
+        for line in lines:
+            if (line!=last):
+                n += 1
+                fh.write(line + "\n")
+                last = line
         fh.close()
         logging.warning("written %d lines to %s" % (n,file))
 
+    def memory_bytes(self):
+        """Bytes used by the in-memory bibid and works data
+
+        Walks all of the data so is slow, for --memory-report.
+        """
+        if (self.compact_index or self.bibid_codec):
+            n = self.bibids.memory_bytes()
+        else:
+            n = bibid_dict.deep_size(self.bibids)
+        if (self.write_workid_bibids):
+            n += bibid_dict.deep_size(self.works)
+        return n
+
     def close(self):
         """Close running output file if open"""
         if (self.write_pairs): 
             self.ofh.close()
 
-# Options and arguments
-LOGFILE = "mx_get_oclc_workids.log"
-p = optparse.OptionParser(description='Find OCLC workids for bibids given bibid-oclcnum and oclcnum-workid data',
-                          usage='usage: %prog [bibid_to_oclcnums.gz] [oclc_concordance.gz]')
-p.add_option('--write-workid-bibids', action='store', default=None,
-             help="Build in-memory data to write workid->bibids mappings to given file.gz")
-p.add_option('--write-oclcnum-workid-pairs', action='store', default=None,
-             help="Build in-memory data to write oclcnum,workid pairs to given file.gz")
-p.add_option('--write-pairs', action='store', default=None,
-             help="Write bibid->oclcworkid pairs as oclc data is read (cheap on memory) to given file.gz")
-p.add_option('--first-oclcnum-only', action='store_true',
-             help="Take only the first OCLC number listed for each bibid")
-p.add_option('--logfile', action='store', default=LOGFILE,
-             help="Log file name (default %s)" % (LOGFILE))
-p.add_option('--dupeslog', action='store', default=None,
-             help="Write log for duplicate data")
-p.add_option('--verbose', '-v', action='store_true',
-             help="verbose, show additional informational messages")
-(opt, args) = p.parse_args()
-
-if (len(args)!=2):
-    sys.stderr.write('Error - Must have 2 arguments\n\n')
-    p.print_help()
-    exit(1)
-(bibid_to_oclcnums_file,oclc_concordance_file)=args
-
-level = (logging.INFO if opt.verbose else logging.WARNING)
-logging.basicConfig(filename=opt.logfile,level=level)
-logging.warning("STARTED at %s" % (datetime.datetime.now()))
-
-dupeslog = None
-if (opt.dupeslog):
-    dupeslog = logging.getLogger(name='dupeslog')
-    f = logging.FileHandler(filename=opt.dupeslog,mode='w')
-    dupeslog.addHandler(f)
-    dupeslog.warning("#DUPES LOG STARTED at %s" % (datetime.datetime.now()))
-
-# Read bibid--oclcnum data into memory
-bo = bibid_oclcnums(file=bibid_to_oclcnums_file,
-                    dupeslog=dupeslog, 
-                    first_oclcnum_only=opt.first_oclcnum_only,
-                    write_workid_bibids=(opt.write_workid_bibids is not None),
-                    write_oclcnum_workid_pairs=(opt.write_oclcnum_workid_pairs is not None),
-                    write_pairs=opt.write_pairs)
-logging.warning("Have %d bibid to oclcnum mappings" % (len(bo.bibids.keys())))
-
-# Now open concordance and work through it looking for matches
-#
-# Concordance file from OCLC is 3.1GB with 343M lines. The 
-# lines are formatted as:
-#
-# Column 1: every OCLC number found in a record from both 001 and 019
-# Column 2: the current OCLC number for the record, from 001
-# Column 3: the current Work ID associated with the record
-#
-# Look for matches in 1st or 2nd columns, get word identifier from
-# 3rd column.
-logging.warning("READING CONCORDANCE at %s" % (datetime.datetime.now()))
-fh = gzip.open(oclc_concordance_file,'r')
-n = 0
-num1_matches = 0
-num2_matches = 0
-num_none_workid = 0
-for line in fh:
-    n += 1
-    if (n%1000000 == 0):
-        logging.warning("read %d lines from %s...." % (n,oclc_concordance_file))
-    line = line.rstrip()
-    try:
-        # oclcnum2 is the currently in-use OCLC crontol number and
-        # is the one to record. A match on oclcnum1, which may be
-        # a previously used number, should be recorded with oclcnum2
-        (oclcnum1,oclcnum2,workid) = line.split()
-        if (workid=='NONE'):
-            num_none_workid += 1
-            continue
-        oclcnum1=int(oclcnum1)
-        oclcnum2=int(oclcnum2)
-        workid=int(workid)
-        if (oclcnum2 in bo.bibids):
-            for bibid in bo.bibids[oclcnum2]:
-                bo.add_work(oclcnum2,bibid,workid)
-            num2_matches += 1
-        elif (oclcnum1 in bo.bibids):
-            for bibid in bo.bibids[oclcnum1]:
-                bo.add_work(oclcnum2,bibid,workid)
-            num1_matches += 1
-    except Exception as e:
-        logging.warning("[line %d] BAD LINE '%s': %s" % (n,line,str(e)))
-fh.close()
-logging.warning("read %d lines from %s. %d matches in col2, %d in col1" % (n,oclc_concordance_file,num1_matches,num2_matches))
-logging.warning("ignored %d lines that have workid=NONE" % (num_none_workid))
-
-if (opt.write_workid_bibids is not None):
-    bo.write_workid_to_bibid_data(opt.write_workid_bibids)
-if (opt.write_oclcnum_workid_pairs is not None):
-    bo.write_oclccn2oclcwn(opt.write_oclcnum_workid_pairs)
-logging.warning("FINISHED at %s" % (datetime.datetime.now()))
-bo.close()
+class combined_index(object):
+    """Index of oclcnum -> institutions that have it
+
+    Built from the bibids of several bibid_oclcnums, the value for each
+    oclcnum is a bitmask of their positions. Supports the parts of the
+    dict interface used on bibid_oclcnums.bibids (in, [], len, keys)
+    where [] gives (institution number, bibid) pairs, the bibids of
+    each institution in the order its own index gives them.
+    """
+
+    def __init__(self,bos):
+        self.bos = bos
+        self.index = {}
+        for (i,bo) in enumerate(bos):
+            bit = 1<<i
+            for oclcnum in bo.bibids.keys():
+                self.index[oclcnum] = self.index.get(oclcnum,0) | bit
+
+    def __contains__(self,oclcnum):
+        return oclcnum in self.index
+
+    def __getitem__(self,oclcnum):
+        mask = self.index[oclcnum]
+        pairs = []
+        for (i,bo) in enumerate(self.bos):
+            if (mask & (1<<i)):
+                pairs.extend([(i,bibid) for bibid in bo.bibids[oclcnum]])
+        return pairs
+
+    def col2(self,oclcnum2,oclcnum1):
+        """(institution number, bibid) pairs for line matched on oclcnum2
+
+        A match on column 2 takes precedence for each institution on its
+        own, so those that don't have oclcnum2 but do have oclcnum1 get
+        that match too.
+        """
+        mask2 = self.index[oclcnum2]
+        mask1 = self.index.get(oclcnum1,0) & ~mask2
+        pairs = []
+        for (i,bo) in enumerate(self.bos):
+            if (mask2 & (1<<i)):
+                pairs.extend([(i,bibid) for bibid in bo.bibids[oclcnum2]])
+            elif (mask1 & (1<<i)):
+                pairs.extend([(i,bibid) for bibid in bo.bibids[oclcnum1]])
+        return pairs
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+
+class institutions(object):
+    """Several institutions' bibid_oclcnums matched in one concordance pass
+
+    Looks like one bibid_oclcnums to the concordance scans: bibids is
+    a combined_index, col2_bibids() keeps the col2 before col1 rule for
+    each institution and add_work() passes each match on to the
+    institution it is for, so each gets the same matches in the same
+    order as a run of its own. If write_overlap is set then the
+    institutions matching each workid are kept for
+    write_overlap_table().
+    """
+
+    def __init__(self,names,bos,write_overlap=False):
+        self.names = names
+        self.bos = bos
+        self.bibids = combined_index(bos)
+        self.prefilter = None
+        self.overlap = ({} if write_overlap else None)
+        logging.warning("combined index of %d oclcnums for %s" % (len(self.bibids),", ".join(names)))
+
+    def build_prefilter(self,fpr=bloom.FPR):
+        """Build Bloom filter of the oclcnums of all institutions"""
+        self.prefilter = bloom.build(self.bibids.keys(),fpr)
+        logging.warning("built bloom filter of %d oclcnums, %d bytes" % (self.prefilter.n,self.prefilter.size_bytes()))
+
+    def col2_bibids(self,oclcnum2,oclcnum1):
+        """See combined_index.col2()"""
+        return self.bibids.col2(oclcnum2,oclcnum1)
+
+    def add_work(self,oclcnum,institution_bibid,workid):
+        """Add match for (institution number, bibid) to that institution"""
+        (i,bibid) = institution_bibid
+        self.bos[i].add_work(oclcnum,bibid,workid)
+        if (self.overlap is not None):
+            self.overlap[workid] = self.overlap.get(workid,0) | (1<<i)
+
+    def write_overlap_table(self,file):
+        """Write workids matched by more than one institution
+
+        Comment lines at the start give the number of workids for each
+        combination of institutions, then lines are workid followed by
+        the names of the institutions that have it.
+        """
+        combos = {}
+        for mask in self.overlap.itervalues():
+            combos[mask] = combos.get(mask,0) + 1
+        fh = gzio.open_output(file)
+        fh.write("#workid institutions\n")
+        for (i,name) in enumerate(self.names):
+            if (self.bos[i].bibid_fmt):
+                fh.write("#%s fmt string is  %s to get URI\n" % (name,self.bos[i].bibid_fmt))
+        for mask in sorted(combos,key=lambda m: (-bin(m).count('1'),m)):
+            line = "%d workids in %s" % (combos[mask]," and ".join(self.mask_names(mask)))
+            logging.warning("overlap: " + line)
+            fh.write("#" + line + "\n")
+        n = 0
+        for workid in sorted(self.overlap):
+            mask = self.overlap[workid]
+            if (mask & (mask-1)):
+                n += 1
+                fh.write("%d %s\n" % (workid," ".join(self.mask_names(mask))))
+        fh.close()
+        logging.warning("written %d lines to %s" % (n,file))
+
+    def mask_names(self,mask):
+        return [name for (i,name) in enumerate(self.names) if mask & (1<<i)]
+
+    def memory_bytes(self):
+        """Bytes used by the in-memory data of all institutions (slow)"""
+        n = bibid_dict.deep_size(self.bibids.index) + sum([bo.memory_bytes() for bo in self.bos])
+        if (self.overlap is not None):
+            n += bibid_dict.deep_size(self.overlap)
+        return n
+
+    def close(self):
+        for bo in self.bos:
+            bo.close()
+
+
+def read_concordance(bo,oclc_concordance_file):
+    """Work through concordance looking for matches with bo.bibids
+
+    Concordance file from OCLC is 3.1GB with 343M lines. The 
+    lines are formatted as:
+
+    Column 1: every OCLC number found in a record from both 001 and 019
+    Column 2: the current OCLC number for the record, from 001
+    Column 3: the current Work ID associated with the record
+
+    Look for matches in 1st or 2nd columns, get word identifier from
+    3rd column. Returns (lines, num1_matches, num2_matches, num_none_workid)
+    """
+    fh = gzio.open_input(oclc_concordance_file)
+    instrument.reading(oclc_concordance_file, fh)
+    n = 0
+    num1_matches = 0
+    num2_matches = 0
+    num_none_workid = 0
+    for line in fh:
+        n += 1
+        if (n%1000000 == 0):
+            logging.warning("read %d lines from %s%s...." % (n,oclc_concordance_file,gzio.rate_str(fh)))
+            instrument.set_counts(concordance_lines=n, matches=num1_matches+num2_matches)
+        line = line.rstrip()
+        try:
+            # oclcnum2 is the currently in-use OCLC crontol number and
+            # is the one to record. A match on oclcnum1, which may be
+            # a previously used number, should be recorded with oclcnum2
+            (oclcnum1,oclcnum2,workid) = line.split()
+            if (workid=='NONE'):
+                num_none_workid += 1
+                continue
+            oclcnum1=int(oclcnum1)
+            oclcnum2=int(oclcnum2)
+            workid=int(workid)
+            if (oclcnum2 in bo.bibids):
+                for bibid in bo.col2_bibids(oclcnum2,oclcnum1):
+                    bo.add_work(oclcnum2,bibid,workid)
+                num2_matches += 1
+            elif (oclcnum1 in bo.bibids):
+                for bibid in bo.bibids[oclcnum1]:
+                    bo.add_work(oclcnum2,bibid,workid)
+                num1_matches += 1
+        except Exception as e:
+            logging.warning("[line %d] BAD LINE '%s': %s" % (n,line,str(e)))
+    fh.close()
+    return(n,num1_matches,num2_matches,num_none_workid)
+
+def concordance_chunks(oclc_concordance_file):
+    """Generator of (first line number, text) chunks of whole lines
+
+    Reader stage for read_concordance_pipeline().
+    """
+    fh = gzio.open_input(oclc_concordance_file)
+    instrument.reading(oclc_concordance_file, fh)
+    n = 1
+    while True:
+        text = fh.read(PIPELINE_CHUNK)
+        if (not text):
+            break
+        if (not text.endswith('\n')):
+            text += fh.readline()
+        yield (n,text)
+        n += text.count('\n')
+    fh.close()
+    logging.warning("read %d lines from %s%s" % (n-1,oclc_concordance_file,gzio.rate_str(fh)))
+
+def match_chunk(item):
+    """Match a chunk of concordance lines with worker_state['bibids']
+
+    Same rule as read_concordance() but the matches are returned as a
+    list of (line number, oclcnum2, oclcnum matched, workid, oclcnum1)
+    for the writer to add. Bad lines are returned as a list of (line number,
+    line, error) to log. If worker_state['bloom'] is set then lines
+    it rules out are skipped (see bloom.py). Returns (lines,
+    num1_matches, num2_matches, num_none_workid, matches, bad,
+    filter_counts) where filter_counts is None or the counts for
+    bloom_filter.add_counts().
+    """
+    bibids = worker_state['bibids']
+    bf = worker_state.get('bloom')
+    (n,text) = item
+    lines = text.split('\n')
+    if (lines[-1]==''):
+        lines.pop()
+    num_lines = len(lines)
+    num1_matches = 0
+    num2_matches = 0
+    num_none_workid = 0
+    matches = []
+    bad = []
+    filtered = (bf is not None and bloom.clean(text))
+    if (filtered):
+        (numbered,skipped,num_none_workid) = bf.candidates(lines,n)
+        none_skipped = num_none_workid
+    else:
+        numbered = enumerate(lines,n)
+    for (n,line) in numbered:
+        line = line.rstrip()
+        try:
+            (oclcnum1,oclcnum2,workid) = line.split()
+            if (workid=='NONE'):
+                num_none_workid += 1
+            else:
+                oclcnum1=int(oclcnum1)
+                oclcnum2=int(oclcnum2)
+                workid=int(workid)
+                if (oclcnum2 in bibids):
+                    matches.append((n,oclcnum2,oclcnum2,workid,oclcnum1))
+                    num2_matches += 1
+                elif (oclcnum1 in bibids):
+                    matches.append((n,oclcnum2,oclcnum1,workid,oclcnum1))
+                    num1_matches += 1
+        except Exception as e:
+            bad.append((n,line,str(e)))
+    filter_counts = None
+    if (filtered):
+        # candidates that didn't match, not counting bad lines and
+        # lines with NONE workid which aren't looked up
+        false_positives = len(numbered)-len(matches)-len(bad)-(num_none_workid-none_skipped)
+        filter_counts = (num_lines,skipped,false_positives,0)
+    elif (bf is not None):
+        filter_counts = (0,0,0,num_lines)
+    return(num_lines,num1_matches,num2_matches,num_none_workid,matches,bad,filter_counts)
+
+
+class concordance_writer(object):
+    """Writer stage for read_concordance_pipeline(), adds matches to bo in order"""
+
+    def __init__(self,bo,oclc_concordance_file):
+        self.bo = bo
+        self.file = oclc_concordance_file
+        self.n = 0
+        self.num1_matches = 0
+        self.num2_matches = 0
+        self.num_none_workid = 0
+
+    def write(self,result):
+        (lines,num1_matches,num2_matches,num_none_workid,matches,bad,filter_counts) = result
+        if (filter_counts is not None):
+            self.bo.prefilter.add_counts(*filter_counts)
+        for (n,line,error) in bad:
+            logging.warning("[line %d] BAD LINE '%s': %s" % (n,line,error))
+        for (n,oclcnum2,oclcnum,workid,oclcnum1) in matches:
+            try:
+                bibids = (self.bo.col2_bibids(oclcnum2,oclcnum1) if oclcnum==oclcnum2 else self.bo.bibids[oclcnum])
+                for bibid in bibids:
+                    self.bo.add_work(oclcnum2,bibid,workid)
+            except Exception as e:
+                logging.warning("[line %d] BAD LINE: %s" % (n,str(e)))
+        if ((self.n+lines)//1000000 > self.n//1000000):
+            logging.warning("read %d lines from %s...." % (self.n+lines,self.file))
+            instrument.set_counts(concordance_lines=self.n+lines, matches=self.num1_matches+self.num2_matches)
+        self.n += lines
+        self.num1_matches += num1_matches
+        self.num2_matches += num2_matches
+        self.num_none_workid += num_none_workid
+
+
+def read_concordance_filtered(bo,oclc_concordance_file):
+    """read_concordance() skipping lines that bo.prefilter rules out
+
+    The concordance is read in chunks and matched with match_chunk(),
+    as in read_concordance_pipeline() but on one thread, so outputs
+    are the same as read_concordance().
+    Returns (lines, num1_matches, num2_matches, num_none_workid)
+    """
+    worker_state['bibids'] = bo.bibids
+    worker_state['bloom'] = bo.prefilter
+    cw = concordance_writer(bo,oclc_concordance_file)
+    for item in concordance_chunks(oclc_concordance_file):
+        cw.write(match_chunk(item))
+    return(cw.n,cw.num1_matches,cw.num2_matches,cw.num_none_workid)
+
+def read_concordance_pipeline(bo,oclc_concordance_file,jobs=1,queue_size=pipeline.QUEUE_SIZE):
+    """read_concordance() with reading, matching and writing overlapped
+
+    The concordance is read in chunks on a reader thread, matched
+    against bo.bibids on a worker thread (or by jobs worker processes
+    forked with a copy of bo.bibids) and the matches added to bo here
+    in line order, so outputs are the same as read_concordance(). Lines
+    are prefiltered if bo.prefilter is set.
+    Returns (lines, num1_matches, num2_matches, num_none_workid)
+    """
+    worker_state['bibids'] = bo.bibids
+    worker_state['bloom'] = bo.prefilter
+    pool = None
+    if (jobs>1):
+        logging.warning("Using %d worker processes in pipeline" % (jobs))
+        pool = multiprocessing.Pool(processes=jobs)
+    cw = concordance_writer(bo,oclc_concordance_file)
+    pl = pipeline.pipeline('match', match_chunk, workers=jobs, pool=pool,
+                           queue_size=queue_size, stages=('read','match','write'))
+    pl.run(concordance_chunks(oclc_concordance_file), cw.write)
+    if (pool is not None):
+        pool.close()
+        pool.join()
+    return(cw.n,cw.num1_matches,cw.num2_matches,cw.num_none_workid)
+
+def institution_file(file,name):
+    """File name for institution name, file with %s replaced by name
+
+    None for name is the single institution case where file is used
+    as given.
+    """
+    if (file is None or name is None):
+        return file
+    return file.replace('%s',name)
+
+
+def main():
+    # Options and arguments
+    LOGFILE = "mx_get_oclc_workids.log"
+    p = optparse.OptionParser(description='Find OCLC workids for bibids given bibid-oclcnum and oclcnum-workid data',
+                              usage='usage: %prog [bibid_to_oclcnums.gz|bibid_store.sqlite] [oclc_concordance.gz|concordance_index_dir]\n       %prog --institution NAME=FILE [--institution NAME=FILE ...] [oclc_concordance.gz|concordance_index_dir]',
+                              epilog='Any combination of the --write-* outputs is written from one pass over the concordance. A concordance index directory built with mx_build_concordance_index.py may be given instead of the concordance file, then only our oclcnums are looked up. The bibid to oclcnums data may be an SQLite store written by mx_grep_oclc.py --write-sqlite. With --institution the bibid to oclcnums data of several institutions are matched in the same pass, each --write-* file name must then include %s which is replaced by the institution name.')
+    p.add_option('--write-workid-bibids', action='store', default=None,
+                 help="Build in-memory data to write workid->bibids mappings to given file.gz")
+    p.add_option('--write-oclcnum-workid-pairs', action='store', default=None,
+                 help="Build in-memory data to write oclcnum,workid pairs to given file.gz")
+    p.add_option('--write-pairs', action='store', default=None,
+                 help="Write bibid->oclcworkid pairs as oclc data is read (cheap on memory) to given file.gz")
+    p.add_option('--compact-index', action='store_true',
+                 help="Hold bibid--oclcnum data in compact sorted arrays rather than a dict of sets")
+    p.add_option('--numpy', action='store_true',
+                 help="Scan concordance in blocks vectorized with NumPy (requires numpy)")
+    p.add_option('--merge-join', action='store_true',
+                 help="Match by sort-merge join with bounded memory instead of dict probe, sorted concordance is cached for reuse")
+    p.add_option('--sort-cache', action='store', default=None,
+                 help="Directory for sorted concordance cache with --merge-join (default is --tmpdir, one must be given)")
+    p.add_option('--sort-buffer', action='store', type='int', default=extsort.MAX_ITEMS,
+                 help="Number of items to sort in memory before spilling to disk with --merge-join and when writing --write-oclcnum-workid-pairs (default %default)")
+    p.add_option('--tmpdir', action='store', default=None,
+                 help="Directory for temporary spill files (default system temp)")
+    p.add_option('--pipeline', action='store_true',
+                 help="Read, match and write concordance data on separate threads with bounded queues between them")
+    p.add_option('--pipeline-queue', action='store', type='int', default=pipeline.QUEUE_SIZE,
+                 help="Number of chunks of concordance each --pipeline queue holds (default %default)")
+    p.add_option('--jobs', '-j', action='store', type='int', default=1,
+                 help="Number of worker processes to match with --pipeline (default 1, a thread)")
+    p.add_option('--bibid-dict', action='store', default=None, metavar='CODEC',
+                 help="Hold bibids as integer surrogates from a bibid dictionary packing them with CODEC (%s)" % (", ".join(sorted(bibid_dict.CODECS))))
+    p.add_option('--memory-report', action='store_true',
+                 help="Log bytes used by the in-memory data after reading bibid data and after matching (slow)")
+    p.add_option('--bloom', action='store_true',
+                 help="Skip concordance lines ruled out by a Bloom filter of our oclcnums before parsing them")
+    p.add_option('--bloom-fpr', action='store', type='float', default=bloom.FPR,
+                 help="False positive rate to size the --bloom filter for (default %default)")
+    p.add_option('--institution', action='append', default=[], metavar='NAME=FILE',
+                 help="Bibid to oclcnums data FILE for institution NAME, repeat for each institution")
+    p.add_option('--bibid-fmt', action='append', default=[], metavar='NAME=FMT',
+                 help="Format string to make URI from bibid for institution NAME (just FMT without --institution), noted in the output files")
+    p.add_option('--write-overlap', action='store', default=None,
+                 help="Write table of workids matched by more than one --institution to given file.gz")
+    p.add_option('--first-oclcnum-only', action='store_true',
+                 help="Take only the first OCLC number listed for each bibid")
+    p.add_option('--logfile', action='store', default=LOGFILE,
+                 help="Log file name (default %s)" % (LOGFILE))
+    p.add_option('--dupeslog', action='store', default=None,
+                 help="Write log for duplicate data")
+    p.add_option('--verbose', '-v', action='store_true',
+                 help="verbose, show additional informational messages")
+    instrument.add_options(p)
+    profiling.add_options(p)
+    (opt, args) = p.parse_args()
+
+    outputs = [opt.write_workid_bibids,opt.write_oclcnum_workid_pairs,opt.write_pairs]
+    if (opt.institution):
+        if (len(args)!=1):
+            sys.stderr.write('Error - Must have 1 argument with --institution\n\n')
+            p.print_help()
+            exit(1)
+        (oclc_concordance_file,)=args
+        names = []
+        files = {}
+        for spec in opt.institution:
+            (name,sep,file) = spec.partition('=')
+            if (not sep or name=='' or file=='' or name in files):
+                sys.stderr.write('Error - Bad or repeated --institution %s, must be NAME=FILE\n\n' % (spec))
+                exit(1)
+            names.append(name)
+            files[name] = file
+        for output in outputs:
+            if (output is not None and '%s' not in output):
+                sys.stderr.write('Error - With --institution the --write-* file names must include %%s for the name, not %s\n\n' % (output))
+                exit(1)
+        if (opt.merge_join):
+            sys.stderr.write('Error - Cannot use --institution with --merge-join\n\n')
+            exit(1)
+    else:
+        if (len(args)!=2):
+            sys.stderr.write('Error - Must have 2 arguments\n\n')
+            p.print_help()
+            exit(1)
+        (bibid_to_oclcnums_file,oclc_concordance_file)=args
+        names = [None]
+        files = {None: bibid_to_oclcnums_file}
+        if (opt.write_overlap is not None):
+            sys.stderr.write('Error - --write-overlap needs --institution\n\n')
+            exit(1)
+    bibid_fmts = {}
+    for spec in opt.bibid_fmt:
+        (name,sep,fmt) = spec.partition('=')
+        if (not opt.institution):
+            (name,fmt) = (None,spec)
+        elif (not sep or name not in files):
+            sys.stderr.write('Error - --bibid-fmt %s is not for an --institution\n\n' % (spec))
+            exit(1)
+        bibid_fmts[name] = fmt
+    if (outputs==[None,None,None] and opt.write_overlap is None):
+        sys.stderr.write('Error - Must specify at least one of --write-workid-bibids, --write-oclcnum-workid-pairs, --write-pairs, --write-overlap\n\n')
+        p.print_help()
+        exit(1)
+    use_index = os.path.isdir(oclc_concordance_file)
+    if (opt.merge_join and (opt.compact_index or use_index)):
+        sys.stderr.write('Error - Cannot use --merge-join with --compact-index or a concordance index\n\n')
+        exit(1)
+    if (opt.merge_join and opt.sort_cache is None and opt.tmpdir is None):
+        sys.stderr.write('Error - Must specify --sort-cache or --tmpdir with --merge-join\n\n')
+        exit(1)
+    if (opt.bibid_dict is not None):
+        if (opt.bibid_dict not in bibid_dict.CODECS):
+            sys.stderr.write('Error - Unknown --bibid-dict codec %s\n\n' % (opt.bibid_dict))
+            exit(1)
+        if (opt.merge_join or opt.compact_index):
+            sys.stderr.write('Error - Cannot use --bibid-dict with --merge-join or --compact-index\n\n')
+            exit(1)
+    if (opt.bloom and (opt.numpy or opt.merge_join or use_index)):
+        sys.stderr.write('Error - Cannot use --bloom with --numpy, --merge-join or a concordance index\n\n')
+        exit(1)
+    if (opt.pipeline and (opt.numpy or opt.merge_join or use_index)):
+        sys.stderr.write('Error - Cannot use --pipeline with --numpy, --merge-join or a concordance index\n\n')
+        exit(1)
+    if (opt.numpy):
+        if (opt.merge_join or use_index):
+            sys.stderr.write('Error - Cannot use --numpy with --merge-join or a concordance index\n\n')
+            exit(1)
+        try:
+            import concordance_numpy
+        except ImportError as e:
+            sys.stderr.write('Error - --numpy requires numpy: %s\n\n' % (str(e)))
+            exit(1)
+
+    level = (logging.INFO if opt.verbose else logging.WARNING)
+    logging.basicConfig(filename=opt.logfile,level=level)
+    logging.warning("STARTED at %s" % (datetime.datetime.now()))
+
+    dupeslog = None
+    if (opt.dupeslog):
+        dupeslog = logging.getLogger(name='dupeslog')
+        f = logging.FileHandler(filename=opt.dupeslog,mode='w')
+        dupeslog.addHandler(f)
+        dupeslog.warning("#DUPES LOG STARTED at %s" % (datetime.datetime.now()))
+
+    inputs = [files[name] for name in names]
+    if (not use_index):
+        inputs.append(oclc_concordance_file)
+    instrument.set_inputs(inputs)
+    instrument.start(opt)
+    profiling.start(opt)
+
+    # Read bibid--oclcnum data into memory, unless merge join which
+    # streams it
+    instrument.phase('read_bibids')
+    bos = []
+    for name in names:
+        if (name is not None):
+            logging.warning("institution %s: reading %s" % (name,files[name]))
+        bos.append(bibid_oclcnums(file=(None if opt.merge_join else files[name]),
+                                  dupeslog=dupeslog,
+                                  first_oclcnum_only=opt.first_oclcnum_only,
+                                  write_workid_bibids=(opt.write_workid_bibids is not None),
+                                  write_oclcnum_workid_pairs=(opt.write_oclcnum_workid_pairs is not None),
+                                  write_pairs=institution_file(opt.write_pairs,name),
+                                  compact_index=opt.compact_index,
+                                  bibid_codec=opt.bibid_dict,
+                                  bibid_fmt=bibid_fmts.get(name)))
+    if (opt.institution):
+        bo = institutions(names,bos,write_overlap=(opt.write_overlap is not None))
+    else:
+        bo = bos[0]
+    if (opt.memory_report and not opt.merge_join):
+        logging.warning("memory: bibid data uses %d bytes" % (bo.memory_bytes()))
+
+    # Now open concordance and work through it looking for matches
+    instrument.phase('match')
+    if (opt.merge_join):
+        (n,num1_matches,num2_matches,num_none_workid,num_oclcnums) = \
+            concordance_sort.merge_join(bo,bo.iter_bibid_to_oclcnums(bibid_to_oclcnums_file),
+                                        oclc_concordance_file,cache_dir=opt.sort_cache,
+                                        max_items=opt.sort_buffer,tmpdir=opt.tmpdir)
+        logging.warning("Have %d bibid to oclcnum mappings" % (num_oclcnums))
+    elif (use_index):
+        logging.warning("Have %d bibid to oclcnum mappings" % (len(bo.bibids)))
+        logging.warning("LOOKING UP IN CONCORDANCE INDEX at %s" % (datetime.datetime.now()))
+        ci = concordance_index.concordance_index(oclc_concordance_file)
+        (n,num1_matches,num2_matches,num_none_workid) = ci.match(bo)
+        ci.close()
+    else:
+        logging.warning("Have %d bibid to oclcnum mappings" % (len(bo.bibids)))
+        if (opt.bloom):
+            bo.build_prefilter(opt.bloom_fpr)
+        logging.warning("READING CONCORDANCE at %s" % (datetime.datetime.now()))
+        if (opt.numpy):
+            (n,num1_matches,num2_matches,num_none_workid) = concordance_numpy.read_concordance(bo,oclc_concordance_file)
+        elif (opt.pipeline):
+            (n,num1_matches,num2_matches,num_none_workid) = read_concordance_pipeline(bo,oclc_concordance_file,
+                                                                                       jobs=opt.jobs,queue_size=opt.pipeline_queue)
+        elif (opt.bloom):
+            (n,num1_matches,num2_matches,num_none_workid) = read_concordance_filtered(bo,oclc_concordance_file)
+        else:
+            (n,num1_matches,num2_matches,num_none_workid) = read_concordance(bo,oclc_concordance_file)
+        if (opt.bloom):
+            bo.prefilter.log('prefilter')
+    logging.warning("read %d lines from %s. %d matches in col2, %d in col1" % (n,oclc_concordance_file,num1_matches,num2_matches))
+    logging.warning("ignored %d lines that have workid=NONE" % (num_none_workid))
+    instrument.set_counts(concordance_lines=n, matches=num1_matches+num2_matches)
+
+    if (opt.memory_report):
+        logging.warning("memory: bibid and works data use %d bytes" % (bo.memory_bytes()))
+
+    instrument.phase('write')
+    for (name,bo_name) in zip(names,bos):
+        if (opt.write_workid_bibids is not None):
+            bo_name.write_workid_to_bibid_data(institution_file(opt.write_workid_bibids,name))
+        if (opt.write_oclcnum_workid_pairs is not None):
+            bo_name.write_oclccn2oclcwn(institution_file(opt.write_oclcnum_workid_pairs,name),
+                                        max_items=opt.sort_buffer,tmpdir=opt.tmpdir)
+    if (opt.write_overlap is not None):
+        bo.write_overlap_table(opt.write_overlap)
+    profiling.finish()
+    instrument.finish()
+    logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+    bo.close()
+
+if __name__ == '__main__':
+    main()
@@ -7,28 +7,51 @@
 # (every place pymarc takes a file name a handle works fine as
 # the underlying xml.sax works that way, hence can open a gzip
 # and pass in handle directly)
+import os
 import sys
-import gzip
+import gzio
 import pymarc
 import re
 import optparse
 import logging
 import datetime
+import multiprocessing
+import cStringIO
+import collections
+import marcxml_reader
+import oclc_fastscan
+import oclcnum
+import marc21_records
+import grep_checkpoint
+import bibid_store
+import columnar
+import instrument
+import profiling
+import pipeline
+
+# Only tags looked at by mx_grepper, all others are skipped by marcxml_reader
+TAGS = ('001','035','079')
+
+STATS = ['records_seen','records_matched','records_multi','records_bad',
+         'fields_matched','fields_bad','fields_esuffix','fields_duped']
 
 class mx_grepper:
-    def __init__(self, dupeslog=None):
+    def __init__(self, dupeslog=None, out=None):
         # Options
         self.dupeslog=dupeslog
+        self.out=(out if out else sys.stdout)
         # Stats collected over run
         self.records_seen = 0
         self.records_matched = 0
         self.records_multi = 0
+        self.records_bad = 0
         self.fields_matched = 0
         self.fields_bad = 0
         self.fields_esuffix = 0
         self.fields_duped = 0
         # Use for parsing each record
         self.bibid = 'unknown_bibid'
+        self.normalizer = oclcnum.oclcnum_normalizer()
 
     def grep(self,record): 
         #print pymarc.record_to_xml(record)
@@ -42,11 +65,46 @@ class mx_grepper:
             self.bibid=record['001'].value()
             oclcnums = self.get_oclcnums(record)
             if (len(oclcnums)>0):
-                print "%s\t%s" % (self.bibid,' '.join([str(x) for x in oclcnums]))
+                self.out.write("%s\t%s\n" % (self.bibid,' '.join([str(x) for x in oclcnums])))
                 self.records_matched += 1
         except ValueError as e:
             logging.warning("Bad record '%s': %s" % (self.bibid,str(e)))
 
+    def grep_raw(self,raw,engine='lean'):
+        """Decode raw MARC21 record and grep it
+
+        Decoded with marc21_records.decode_record() unless engine is
+        'pymarc'. A record that can't be decoded is logged with its
+        bibid and counted, rather than stopping the whole file.
+        """
+        try:
+            if (not raw.endswith(marc21_records.END_OF_RECORD)):
+                raise ValueError("Truncated record, %d bytes" % (len(raw)))
+            if (engine=='pymarc'):
+                record = pymarc.Record(raw)
+            else:
+                record = marc21_records.decode_record(raw,TAGS)
+        except Exception as e:
+            self.records_seen += 1
+            self.records_bad += 1
+            logging.warning("Bad record '%s': %s" % (marc21_records.raw_bibid(raw),str(e) or e.__class__.__name__))
+            return
+        self.grep(record)
+
+    def stats(self):
+        """Dict of the stats collected over run, see merge_stats()"""
+        return dict([(x,getattr(self,x)) for x in STATS])
+
+    def write_result(self,result):
+        """Write output and merge stats from (out,stats) of a worker"""
+        self.out.write(result[0])
+        self.merge_stats(result[1])
+
+    def merge_stats(self,stats):
+        """Add stats from another grepper (e.g. a worker process) to ours"""
+        for x in STATS:
+            setattr(self,x,getattr(self,x)+stats.get(x,0))
+
     def get_oclcnums(self,record):
         """Look for one or more OCLC identifiers for record
 
@@ -86,122 +144,472 @@ class mx_grepper:
         Sometimes we find that there are entries with separated data, report these
         as error cases. e.g.
         #at Cornell: bibid=4958095 'ocm35304571 96047844'
+
+        The prefix and number matching is done by oclcnum.oclcnum_normalizer.
         """
         oclcnums = set()
+        classify = self.normalizer.classify
         for field in ['035','079']:
             for f in record.get_fields(field):
                 ref = f['a']
                 if (ref is not None): 
-                    # strip leading or trailing whitespace
-                    ref = ref.lstrip().rstrip()
-                    m = re.match(r'(\(ocolc\)|\(ocolc-m\)|ocm|ocn|on)(.+)$',ref,flags=re.IGNORECASE)
-                    # has (OCoLC) prefix...
-                    if (m):
-                        self.fields_matched += 1
-                        entry = m.group(2)
-                        m2 = re.match(r'^(ocm|ocn|on)?(\d+)$',entry,flags=re.IGNORECASE)
-                        if (m2):
-                            oclcnum = int(m2.group(2))
-                            if (oclcnum in oclcnums):
-                                # dupe
-                                self.fields_duped += 1
-                                if (self.dupeslog):
-                                    self.dupeslog.warning("[%s] Dupe in %s$a of OCLC value: '%d'",self.bibid,field,oclcnum) 
-                            else:
-                                oclcnums.add(oclcnum)
-                        elif (re.match(r'(ocm|ocn|on)?(\d+)e$',entry,flags=re.IGNORECASE)):
-                            self.fields_esuffix += 1
-                            logging.warning("[%s] Ignored e-suffixed %s$a OCLC entry: '%s'",self.bibid,field,entry)
+                    (status,value) = classify(ref)
+                    if (status is None):
+                        # no (OCoLC) or similar prefix
+                        continue
+                    self.fields_matched += 1
+                    if (status==oclcnum.VALID):
+                        if (value in oclcnums):
+                            # dupe
+                            self.fields_duped += 1
+                            if (self.dupeslog):
+                                self.dupeslog.warning("[%s] Dupe in %s$a of OCLC value: '%d'",self.bibid,field,value) 
                         else:
-                            self.fields_bad += 1
-                            logging.warning("[%s] Ignored bad %s$a OCLC entry: '%s'",self.bibid,field,entry)
+                            oclcnums.add(value)
+                    elif (status==oclcnum.ESUFFIX):
+                        self.fields_esuffix += 1
+                        logging.warning("[%s] Ignored e-suffixed %s$a OCLC entry: '%s'",self.bibid,field,value)
+                    else:
+                        self.fields_bad += 1
+                        logging.warning("[%s] Ignored bad %s$a OCLC entry: '%s'",self.bibid,field,value)
         if (len(oclcnums)>1):
             self.records_multi += 1
             logging.warning("[%s] Multi: Have %d OCLC nums: %s",self.bibid,len(oclcnums)," ".join([str(x) for x in oclcnums]))
         return sorted(oclcnums)
 
-# Options and arguments
-LOGFILE = 'mx_grep_oclc.log'
-p = optparse.OptionParser(description='MARCXML Record Grepper -- currently just deals with the special case of looking for OCLC refs',
-                          usage='usage: %prog [[opts]] [file1] .. [fileN]')
-p.add_option('--logfile', action='store', default=LOGFILE,
-             help="Log file name (default %s)" % (LOGFILE))
-p.add_option('--dupeslog', action='store', default=None,
-             help="Log file to write duplicate warnings")
-p.add_option('--xml', action='store_true',
-             help="Records are MARCXML")
-p.add_option('--marc21', action='store_true',
-             help="Records are MARC21")
-p.add_option('--verbose', '-v', action='store_true',
-             help="verbose, show additional informational messages")
-(opt, args) = p.parse_args()
-if (opt.xml and opt.marc21):
-    logging.error("Cannot use both --xml and --marc21 options!")
-    exit(2)
-
-logging.basicConfig(filename=opt.logfile)
-logging.warning("STARTED at %s" % (datetime.datetime.now()))
-
-dupeslog = None
-if (opt.dupeslog):
-    dupeslog = logging.getLogger(name='dupeslog')
-    f = logging.FileHandler(filename=opt.dupeslog,mode='w')
-    dupeslog.addHandler(f)
-    dupeslog.warning("#DUPES LOG STARTED at %s" % (datetime.datetime.now()))
-
-# Loop over all files specified looking at each records
-files = 0
-mg = mx_grepper(dupeslog=dupeslog)
-print "#bibid oclcnum[s]"
-for arg in args:
+class tee(object):
+    """File-like that writes to each of outs, e.g. stdout and a bibid store"""
+
+    def __init__(self,*outs):
+        self.outs = outs
+
+    def write(self,text):
+        for out in self.outs:
+            out.write(text)
+
+    def flush(self):
+        for out in self.outs:
+            out.flush()
+
+def xml_engine(opt):
+    """Name of MARCXML engine selected by options"""
+    if (opt.fast_scan):
+        return 'fast'
+    elif (opt.pymarc):
+        return 'pymarc'
+    return 'lean'
+
+def ordered_map(pool,function,items,window):
+    """Like pool.imap() but with at most window items in flight
+
+    pool.imap() reads all of items as fast as it can, this keeps
+    memory bounded when items are batches from a big file.
+    """
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(function,(item,)))
+        if (len(pending)>=window):
+            yield pending.popleft().get()
+    while (pending):
+        yield pending.popleft().get()
+
+def open_file(arg,opt):
+    """Open MARCXML or MARC21 file arg
+
+    Is this MARCXML or MARC21? If option not specified then guess from
+    file name. Returns (fh, is_xml, note) where note is the #Reading
+    line, which is logged here.
+    """
+    is_xml = ( True if opt.xml else ( False if opt.marc21 else None ) )
+    if (is_xml is None):
+        if (re.search(r'xml(\.gz)?$',arg)):
+            is_xml = True
+        elif (re.search(r'(marc21|marc|mrc)(\.gz)?$',arg)):
+            is_xml = False
+        else:
+            logging.warning("Cannot tell file type, defaulting to MARCXML");
+            is_xml = True
+    kind = ('MARCXML' if is_xml else 'MARC21')
+    if (re.search(r'\.gz$',arg)):
+        note = "#Reading %s as gzipped %s" % (arg,kind)
+        fh = gzio.open_input(arg)
+    else:
+        note = "#Reading %s as %s" % (arg,kind)
+        fh = open(arg,'rb')
+    logging.warning(note)
+    instrument.reading(arg, fh)
+    return(fh,is_xml,note)
+
+def grep_file(mg,arg,opt,engine=None,pool=None):
+    """Run mg.grep over every record in file arg
+
+    The MARCXML engine used is one of 'lean' (marcxml_reader), 'pymarc'
+    or 'fast' (oclc_fastscan), default is set by options. MARC21 is
+    read with pymarc.map_records for 'pymarc' (without --split-records),
+    otherwise it is split into records by marc21_records and decoded
+    here or, if pool is given, in batches by the worker processes.
+
+    Any error is logged and we move on, so that we get to look at
+    every file even if only parts of some are examined. Returns the
+    error message, or None if the whole file was read.
+    """
+    if (engine is None):
+        engine = xml_engine(opt)
     fh = None
-    files += 1
+    error = None
     try:
-        # Is this MARCXML or MARC21? If option not specified then 
-        # guess from file name
-        is_xml = ( True if opt.xml else ( False if opt.marc21 else None ) )
-        if (is_xml is None):
-            if (re.search(r'xml(\.gz)?$',arg)):
-                is_xml = True
-            elif (re.search(r'(marc21|marc|mrc)(\.gz)?$',arg)):
-                is_xml = False
-            else:
-                logging.warning("Cannot tell file type, defaulting to MARCXML");
-                is_xml = true
+        (fh,is_xml,note) = open_file(arg,opt)
+        if (opt.verbose):
+            mg.out.write(note+"\n")
         if (is_xml):
-            if (re.search(r'\.gz$',arg)):
-                logging.warning("#Reading %s as gzipped MARCXML" % (arg))
-                if (opt.verbose):
-                    print "#Reading %s as gzipped MARCXML" % (arg)
-                fh = gzip.open(arg,'rb')
+            if (engine=='fast'):
+                fs = oclc_fastscan.fast_scanner()
+                fs.map_xml(mg.grep, fh)
+                logging.warning("#Fast scan of %s: %d records, %d parsed by fallback, %d failed" % (arg,fs.records_seen,fs.records_fallback,fs.records_failed))
+            elif (engine=='pymarc'):
+                pymarc.map_xml(mg.grep, fh)
             else:
-                logging.warning("#Reading %s as MARCXML" % (arg))
-                if (opt.verbose):
-                    print "#Reading %s as MARCXML" % (arg)
-                fh = open(arg,'rb')
-            reader = pymarc.MARCReader(fh)
-            pymarc.map_xml(mg.grep, fh)
+                marcxml_reader.map_xml(mg.grep, fh, tags=TAGS)
         else:
-            if (re.search(r'\.gz$',arg)):
-                logging.warning("#Reading %s as gzipped MARC21" % (arg))
-                if (opt.verbose):
-                    print "#Reading %s as gzipped MARC21" % (arg)
-                fh = gzip.open(arg,'rb')
+            if (engine=='pymarc' and not opt.split_records):
+                pymarc.map_records(mg.grep, fh)
             else:
-                logging.warning("#Reading %s as MARC21" % (arg))
-                if (opt.verbose):
-                    print "#Reading %s as MARC21" % (arg)
-                fh = open(arg,'rb')
-            reader = pymarc.MARCReader(fh,to_unicode=True)
-            pymarc.map_records(mg.grep, fh)
+                if (engine!='pymarc'):
+                    engine = 'lean'
+                records = marc21_records.raw_records(fh)
+                if (pool is not None):
+                    for (out,stats) in ordered_map(pool, grep_batch_worker, marc21_records.batches(records), 2*opt.jobs):
+                        mg.out.write(out)
+                        mg.merge_stats(stats)
+                else:
+                    for raw in records:
+                        mg.grep_raw(raw,engine)
+        if (hasattr(fh,'rate')):
+            logging.warning("#Read %s%s" % (arg,gzio.rate_str(fh)))
     except Exception as e:
         # Catch any error, log it and move on to the next file.
-        # At least this way we get to look at every file even if
-        # only parts of some are examined
         logging.warning("ERROR READING FILE %s, SKIPPING TO NEXT: %s" % (arg,str(e)))
-if (len(args)>1):
-    print "# %d files" % files
-print "# %d records seen, %d matched, %d multi-valued" % (mg.records_seen,mg.records_matched,mg.records_multi)
-print "# %d field matches, %d duplicate entries, %d bad entries, %d e-suffixed (ignored)" % (mg.fields_matched,mg.fields_duped,mg.fields_bad,mg.fields_esuffix)
+        error = str(e)
+    finally:
+        if (fh is not None):
+            fh.close()
+    return(error)
+
+# Set in parent before the worker pool is forked, see grep_file_worker()
+worker_state = {}
+
+def grep_file_worker(arg):
+    """Grep one file in a worker process
+
+    Each worker has its own mx_grepper writing to a buffer, the output
+    and stats are passed back to the parent to be written and merged
+    in file order.
+    """
+    out = cStringIO.StringIO()
+    mg = mx_grepper(dupeslog=worker_state['dupeslog'], out=out)
+    grep_file(mg, arg, worker_state['opt'])
+    return(out.getvalue(), mg.stats())
+
+def grep_batch_worker(batch):
+    """Grep a batch of raw MARC21 records in a worker process"""
+    out = cStringIO.StringIO()
+    mg = mx_grepper(dupeslog=worker_state['dupeslog'], out=out)
+    engine = xml_engine(worker_state['opt'])
+    for raw in batch:
+        mg.grep_raw(raw,engine)
+    return(out.getvalue(), mg.stats())
+
+def pipeline_items(args,opt):
+    """Generator of work items for --pipeline, run on the reader thread
+
+    Each file is opened and split into batches of raw records, given as
+    ('xml',batch) of (prefix,bytes) records or ('marc21',batch). With
+    --verbose the #Reading line is passed through as ('text',line). Any
+    error reading a file is logged and we move on, as in grep_file().
+    """
+    for arg in args:
+        fh = None
+        try:
+            (fh,is_xml,note) = open_file(arg,opt)
+            if (opt.verbose):
+                yield ('text',note+"\n")
+            if (is_xml):
+                records = oclc_fastscan.fast_scanner().raw_records(fh)
+                for batch in marc21_records.batches(records,size_of=lambda x: len(x[1])):
+                    yield ('xml',batch)
+            else:
+                for batch in marc21_records.batches(marc21_records.raw_records(fh)):
+                    yield ('marc21',batch)
+            if (hasattr(fh,'rate')):
+                logging.warning("#Read %s%s" % (arg,gzio.rate_str(fh)))
+        except Exception as e:
+            logging.warning("ERROR READING FILE %s, SKIPPING TO NEXT: %s" % (arg,str(e)))
+        finally:
+            if (fh is not None):
+                fh.close()
+
+def grep_pipeline_worker(item):
+    """Grep a --pipeline work item (see pipeline_items()) in a worker
+
+    MARCXML records are scanned with oclc_fastscan for --fast-scan,
+    otherwise each is parsed by marcxml_reader.
+    """
+    (kind,data) = item
+    if (kind=='text'):
+        return(data, {})
+    elif (kind=='marc21'):
+        return grep_batch_worker(data)
+    out = cStringIO.StringIO()
+    mg = mx_grepper(dupeslog=worker_state['dupeslog'], out=out)
+    fs = oclc_fastscan.fast_scanner()
+    fast = (xml_engine(worker_state['opt'])=='fast')
+    for (prefix,raw) in data:
+        record = (fs.scan_record(raw) if fast else None)
+        if (record is None):
+            record = fs.parse_record(prefix,raw)
+        if (record is not None):
+            mg.grep(record)
+    return(out.getvalue(), mg.stats())
+
+def grep_file_to_shard(arg,shard,opt,dupeslog=None):
+    """Grep one file writing output to shard file
+
+    Written to shard.tmp then renamed. Returns (arg, stats, error).
+    """
+    out = open(shard+'.tmp','w')
+    mg = mx_grepper(dupeslog=dupeslog, out=out)
+    error = grep_file(mg, arg, opt)
+    out.close()
+    os.rename(shard+'.tmp',shard)
+    return(arg, mg.stats(), error)
+
+def grep_shard_worker(args):
+    """grep_file_to_shard() in a worker process, args is (arg, shard)"""
+    return grep_file_to_shard(args[0], args[1], worker_state['opt'], worker_state['dupeslog'])
+
+def grep_with_checkpoint(mg,args,opt,dupeslog=None):
+    """Grep files not already done in checkpoint, then merge all shards
+
+    Files are recorded in the checkpoint manifest as each finishes, with
+    --jobs they are done in whatever order workers finish. Output and
+    stats are merged in argument order. Returns number of files.
+    """
+    options = {'engine': xml_engine(opt), 'xml': opt.xml, 'marc21': opt.marc21,
+               'verbose': opt.verbose, 'split_records': opt.split_records}
+    cp = grep_checkpoint.checkpoint(opt.checkpoint, options=options, use_hash=opt.checkpoint_hash)
+    todo = []
+    for arg in args:
+        if (cp.is_done(arg)):
+            logging.warning("#Skipping %s, done in checkpoint" % (arg))
+        elif (arg not in todo):
+            todo.append(arg)
+    logging.warning("#Checkpoint %s: %d files to do, %d already done" % (opt.checkpoint,len(todo),len(set(args))-len(todo)))
+    instrument.set_inputs(todo)
+    work = [(arg,cp.shard(arg)) for arg in todo]
+    if (opt.jobs>1 and len(todo)>1):
+        logging.warning("Using %d worker processes" % (opt.jobs))
+        worker_state['opt'] = opt
+        worker_state['dupeslog'] = dupeslog
+        pool = multiprocessing.Pool(processes=opt.jobs)
+        results = pool.imap_unordered(grep_shard_worker, work)
+    else:
+        pool = None
+        results = (grep_file_to_shard(arg, shard, opt, dupeslog) for (arg,shard) in work)
+    for (arg,stats,error) in results:
+        instrument.input_done(arg)
+        cp.record(arg, stats, error)
+        if (error is not None):
+            logging.warning("#Checkpoint: %s had error, will be tried again next run" % (arg))
+    if (pool is not None):
+        pool.close()
+        pool.join()
+    for stats in cp.merge(args, mg.out):
+        mg.merge_stats(stats)
+    return(len(args))
+
+def cross_check_file(arg,opt):
+    """Compare fast scan output and stats with the pymarc path for file arg
+
+    Returns the number of output lines that differ, differences are
+    logged. Any difference in the stats counts as one more.
+    """
+    outs = []
+    stats = []
+    for engine in ['pymarc','fast']:
+        out = cStringIO.StringIO()
+        mg = mx_grepper(out=out)
+        grep_file(mg, arg, opt, engine=engine)
+        outs.append(out.getvalue().splitlines())
+        stats.append(mg.stats())
+    diffs = 0
+    for n in range(max(len(outs[0]),len(outs[1]))):
+        line1 = (outs[0][n] if n<len(outs[0]) else None)
+        line2 = (outs[1][n] if n<len(outs[1]) else None)
+        if (line1!=line2):
+            diffs += 1
+            logging.warning("CROSS-CHECK %s line %d: pymarc '%s' != fast '%s'" % (arg,n+1,line1,line2))
+    if (stats[0]!=stats[1]):
+        diffs += 1
+        logging.warning("CROSS-CHECK %s stats: pymarc %s != fast %s" % (arg,str(stats[0]),str(stats[1])))
+    return(diffs)
+
+def main():
+    # Options and arguments
+    LOGFILE = 'mx_grep_oclc.log'
+    p = optparse.OptionParser(description='MARCXML Record Grepper -- currently just deals with the special case of looking for OCLC refs',
+                              usage='usage: %prog [[opts]] [file1] .. [fileN]')
+    p.add_option('--logfile', action='store', default=LOGFILE,
+                 help="Log file name (default %s)" % (LOGFILE))
+    p.add_option('--dupeslog', action='store', default=None,
+                 help="Log file to write duplicate warnings")
+    p.add_option('--xml', action='store_true',
+                 help="Records are MARCXML")
+    p.add_option('--marc21', action='store_true',
+                 help="Records are MARC21")
+    p.add_option('--pymarc', action='store_true',
+                 help="Parse with pymarc.map_xml or pymarc.map_records instead of the lean marcxml_reader or marc21_records decoder")
+    p.add_option('--fast-scan', action='store_true',
+                 help="Scan MARCXML bytes for 001/035/079 without full parse, falls back to parser for awkward records")
+    p.add_option('--cross-check', action='store_true',
+                 help="Compare --fast-scan output with pymarc output for each file, report differences and exit")
+    p.add_option('--jobs', '-j', action='store', type='int', default=1,
+                 help="Number of worker processes to farm files out to (default 1, no workers)")
+    p.add_option('--split-records', action='store_true',
+                 help="Split MARC21 files into records by leader length also with --pymarc, with --jobs batches of records from each file go to the workers, bad records are logged and skipped")
+    p.add_option('--pipeline', action='store_true',
+                 help="Read, parse and write on separate threads with bounded queues between them, with --jobs the parsing is done by worker processes. MARCXML is split into records and each parsed with marcxml_reader (unless --fast-scan)")
+    p.add_option('--pipeline-queue', action='store', type='int', default=pipeline.QUEUE_SIZE,
+                 help="Number of batches of records each --pipeline queue holds (default %default)")
+    p.add_option('--checkpoint', action='store', default=None,
+                 help="Directory for per-file output shards and manifest so an interrupted or repeated run only does files not done or changed")
+    p.add_option('--checkpoint-hash', action='store_true',
+                 help="Also record sha1 of each file with --checkpoint so files with new mtime but same content are not redone")
+    p.add_option('--write-sqlite', action='store', default=None,
+                 help="Also write bibid to oclcnums data to this SQLite file, indexed by bibid and oclcnum (see bibid_store.py)")
+    p.add_option('--write-columnar', action='store', default=None,
+                 help="Also write bibid to oclcnums data to this file in binary columnar format (see columnar.py)")
+    p.add_option('--verbose', '-v', action='store_true',
+                 help="verbose, show additional informational messages")
+    instrument.add_options(p)
+    profiling.add_options(p, units='files (records with --profile-records)')
+    p.add_option('--profile-records', action='store_true',
+                 help="Sample records rather than files for cProfile with --profile")
+    (opt, args) = p.parse_args()
+    if (opt.xml and opt.marc21):
+        logging.error("Cannot use both --xml and --marc21 options!")
+        exit(2)
+    if (opt.jobs<1):
+        logging.error("Must have --jobs of 1 or more!")
+        exit(2)
+    if (opt.pipeline and opt.checkpoint):
+        logging.error("Cannot use both --pipeline and --checkpoint options!")
+        exit(2)
+
+    logging.basicConfig(filename=opt.logfile)
+    logging.warning("STARTED at %s" % (datetime.datetime.now()))
+
+    dupeslog = None
+    if (opt.dupeslog):
+        dupeslog = logging.getLogger(name='dupeslog')
+        f = logging.FileHandler(filename=opt.dupeslog,mode='w')
+        dupeslog.addHandler(f)
+        dupeslog.warning("#DUPES LOG STARTED at %s" % (datetime.datetime.now()))
+
+    if (opt.cross_check):
+        bad = 0
+        for arg in args:
+            diffs = cross_check_file(arg, opt)
+            print "# cross-check %s: %s" % (arg,("OK" if diffs==0 else "%d DIFFERENCES" % diffs))
+            if (diffs>0):
+                bad += 1
+        print "# cross-check %d files, %d with differences" % (len(args),bad)
+        logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+        exit(1 if bad>0 else 0)
+
+    # Loop over all files specified looking at each records
+    files = 0
+    out = sys.stdout
+    copies = []
+    if (opt.write_sqlite):
+        copies.append(bibid_store.bibid_store(opt.write_sqlite, create=True))
+    if (opt.write_columnar):
+        copies.append(columnar.writer(opt.write_columnar, kind='bibid_oclcnums'))
+    if (copies):
+        out = tee(sys.stdout, *copies)
+    mg = mx_grepper(dupeslog=dupeslog, out=out)
+    instrument.set_inputs(args)
+    instrument.add_source(mg.stats)
+    instrument.start(opt)
+    instrument.phase('grep')
+    profiling.start(opt)
+    if (opt.profile and opt.jobs>1):
+        logging.warning("profile: only the main process is profiled, not workers")
+    if (opt.profile_records):
+        mg.grep = profiling.sampled(mg.grep)
+    out.write("#bibid oclcnum[s]\n")
+    if (opt.checkpoint):
+        out.flush()
+        files = grep_with_checkpoint(mg, args, opt, dupeslog)
+    elif (opt.pipeline):
+        # Reader thread splits files into batches of records, parsed on
+        # a worker thread or by worker processes, written here in order
+        worker_state['opt'] = opt
+        worker_state['dupeslog'] = dupeslog
+        pool = None
+        if (opt.jobs>1):
+            logging.warning("Using %d worker processes in pipeline" % (opt.jobs))
+            pool = multiprocessing.Pool(processes=opt.jobs)
+        pl = pipeline.pipeline('grep', grep_pipeline_worker, workers=opt.jobs, pool=pool,
+                               queue_size=opt.pipeline_queue, stages=('read','parse','write'))
+        pl.run(pipeline_items(args, opt), mg.write_result)
+        files = len(args)
+        if (pool is not None):
+            pool.close()
+            pool.join()
+    elif (opt.jobs>1 and opt.split_records):
+        # Records of each file farmed out to workers in batches,
+        # results are put back in order
+        logging.warning("Using %d worker processes for batches of records" % (opt.jobs))
+        worker_state['opt'] = opt
+        worker_state['dupeslog'] = dupeslog
+        pool = multiprocessing.Pool(processes=opt.jobs)
+        for arg in args:
+            files += 1
+            with profiling.unit(arg, not opt.profile_records):
+                grep_file(mg, arg, opt, pool=pool)
+        pool.close()
+        pool.join()
+    elif (opt.jobs>1 and len(args)>1):
+        # Farm whole files out to workers, imap() gives results back
+        # in file order so output is the same as for a single process
+        logging.warning("Using %d worker processes" % (opt.jobs))
+        worker_state['opt'] = opt
+        worker_state['dupeslog'] = dupeslog
+        pool = multiprocessing.Pool(processes=opt.jobs)
+        for (arg,(text,stats)) in zip(args,pool.imap(grep_file_worker, args)):
+            instrument.input_done(arg)
+            files += 1
+            out.write(text)
+            mg.merge_stats(stats)
+        pool.close()
+        pool.join()
+    else:
+        for arg in args:
+            files += 1
+            with profiling.unit(arg, not opt.profile_records):
+                grep_file(mg, arg, opt)
+    if (len(args)>1):
+        out.write("# %d files\n" % files)
+    out.write("# %d records seen, %d matched, %d multi-valued\n" % (mg.records_seen,mg.records_matched,mg.records_multi))
+    out.write("# %d field matches, %d duplicate entries, %d bad entries, %d e-suffixed (ignored)\n" % (mg.fields_matched,mg.fields_duped,mg.fields_bad,mg.fields_esuffix))
+    if (mg.records_bad>0):
+        logging.warning("%d bad records skipped" % (mg.records_bad))
+    for copy in copies:
+        copy.close()
+
+    profiling.finish()
+    instrument.finish()
+    logging.warning("FINISHED at %s" % (datetime.datetime.now()))
 
-logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+#
+# Incremental update of bibid to oclcnums and workid to bibids data
+# for a catalog delta, instead of rerunning mx_grep_oclc.py,
+# mx_get_oclc_workids.py and mx_analyze_workids.py over everything.
+#
+# Takes the previous run's bibid to oclcnums (mx_grep_oclc.py output)
+# and workid to bibids (mx_analyze_workids.py output) files, the delta
+# as MARC files of added or changed records plus a list of deleted
+# bibids, and a concordance index built by
+# mx_build_concordance_index.py. Then:
+#
+#  1. The bibid to oclcnums table is patched: lines for changed and
+#     deleted bibids are replaced or dropped, new bibids appended.
+#  2. The oclcnums of changed, added and deleted bibids (old and new)
+#     are looked up in the index to find the workids whose
+#     concordance lines mention them.
+#  3. Only the bibids for those workids are recomputed, from all of
+#     their concordance lines, with the same rule as the full scan.
+#     Every other workid line is copied from the previous output.
+#  4. The histogram is logged as by mx_analyze_workids.py.
+#
+# The new workid to bibids file is the same as running
+# mx_get_oclc_workids.py --write-pairs and mx_analyze_workids.py on
+# the new bibid to oclcnums file, provided the previous files came
+# from the same concordance.
+#
+import re
+import sys
+import optparse
+import logging
+import datetime
+import cStringIO
+import columnar
+import concordance_index
+import mx_grep_oclc
+import mx_get_oclc_workids
+import mx_analyze_workids
+import instrument
+import profiling
+
+
+class delta_grepper(mx_grep_oclc.mx_grepper):
+    """mx_grepper that also records every bibid seen, with or without oclcnums"""
+
+    def __init__(self, dupeslog=None, out=None):
+        mx_grep_oclc.mx_grepper.__init__(self, dupeslog=dupeslog, out=out)
+        self.seen = []
+
+    def grep(self,record):
+        mx_grep_oclc.mx_grepper.grep(self,record)
+        self.seen.append(self.bibid)
+
+
+def read_delta(files,opt):
+    """Grep delta MARC files
+
+    Returns (seen, lines) where seen is the list of bibids of all
+    records in order and lines is a dict of bibid to output line for
+    those with oclcnums.
+    """
+    out = cStringIO.StringIO()
+    mg = delta_grepper(out=out)
+    for file in files:
+        mx_grep_oclc.grep_file(mg, file, opt)
+    lines = {}
+    for line in out.getvalue().splitlines(True):
+        if (not line.startswith('#')):
+            lines[line.split()[0]] = line
+    logging.warning("read %d delta records, %d with OCLC numbers" % (len(mg.seen),len(lines)))
+    return(mg.seen,lines)
+
+def read_deletes(file):
+    """Set of bibids, one per line, ignoring blank lines and # comments"""
+    deletes = set()
+    fh = open(file,'r')
+    for line in fh:
+        line = line.strip()
+        if (line and not line.startswith('#')):
+            deletes.add(line)
+    fh.close()
+    return deletes
+
+def line_oclcnums(line):
+    """OCLC numbers from bibid to oclcnums line, bad values ignored"""
+    oclcnums = set()
+    for x in line.split()[1:]:
+        try:
+            oclcnums.add(int(x))
+        except ValueError:
+            pass
+    return oclcnums
+
+def patch_bibid_oclcnums(old_file,new_file,seen,lines,deletes):
+    """Write new bibid to oclcnums file with delta applied
+
+    Changed bibids are written in place of their first old line, new
+    ones at the end, deleted ones and changed ones now without OCLC
+    numbers are dropped. Returns the set of oclcnums whose bibids may
+    have changed.
+    """
+    changed_oclcnums = set()
+    written = set()
+    num_changed = 0
+    num_deleted = 0
+    fh = columnar.open_input(old_file)
+    instrument.reading(old_file, fh)
+    ofh = columnar.open_output(new_file)
+    for line in fh:
+        if (line.startswith('#') or not line.strip()):
+            ofh.write(line)
+            continue
+        bibid = line.split()[0]
+        if (bibid in deletes or bibid in lines or bibid in written):
+            changed_oclcnums.update(line_oclcnums(line))
+            if (bibid in deletes):
+                num_deleted += 1
+            elif (bibid not in written):
+                # replace with new data, later dupe lines are dropped
+                ofh.write(lines[bibid])
+                written.add(bibid)
+                num_changed += 1
+        elif (bibid in seen):
+            # changed record now without OCLC numbers
+            changed_oclcnums.update(line_oclcnums(line))
+            num_deleted += 1
+        else:
+            ofh.write(line)
+    fh.close()
+    num_added = 0
+    for bibid in seen:
+        if (bibid in lines and bibid not in written and bibid not in deletes):
+            ofh.write(lines[bibid])
+            written.add(bibid)
+            num_added += 1
+    for bibid in written:
+        changed_oclcnums.update(line_oclcnums(lines[bibid]))
+    ofh.write("# incremental update at %s: %d changed, %d added, %d removed\n" % (datetime.datetime.now(),num_changed,num_added,num_deleted))
+    ofh.close()
+    logging.warning("written %s: %d changed, %d added, %d removed" % (new_file,num_changed,num_added,num_deleted))
+    return changed_oclcnums
+
+def affected_workids(ci,oclcnums):
+    """Set of workids on any concordance line with one of oclcnums"""
+    workids = set()
+    for oclcnum in oclcnums:
+        for row in ci.rows_col2(oclcnum):
+            workids.add(ci.workid[row])
+        for row in ci.rows_col1(oclcnum):
+            workids.add(ci.workid[row])
+    workids.discard(concordance_index.NONE_WORKID)
+    return workids
+
+def workid_bibids(ci,bibids,workid):
+    """Bibids for workid in concordance line order, as the full scan finds them"""
+    result = []
+    for row in ci.rows_workid(workid):
+        oclcnum2 = ci.col2[row]
+        if (oclcnum2 in bibids):
+            result.extend(bibids[oclcnum2])
+        else:
+            oclcnum1 = ci.col1[row]
+            if (oclcnum1 in bibids):
+                result.extend(bibids[oclcnum1])
+    return result
+
+def patch_workid_bibids(old_file,new_file,updates):
+    """Write new workid to bibids file, replacing groups for workids in updates
+
+    updates is a dict of workid to new list of bibids, an empty list
+    drops the workid. Returns histogram of the new data.
+    """
+    h = mx_analyze_workids.histogram()
+    pending = sorted(updates.keys())
+    i = 0
+    n = 0
+    fh = columnar.open_input(old_file)
+    instrument.reading(old_file, fh)
+    ofh = columnar.open_output(new_file)
+    def write(workid,bibids):
+        if (bibids):
+            ofh.write("%d %s\n" % (workid," ".join(bibids)))
+            h.add(workid,bibids)
+            return 1
+        return 0
+    for line in fh:
+        if (line.startswith('#')):
+            m = re.match(r'#workid fmt string is (\S+) to get URI',line)
+            if (m):
+                h.workid_fmt = m.group(1)
+            m = re.match(r'#prefix fmt string is\s+(\S+) to get URI',line)
+            if (m):
+                h.bibid_fmt = m.group(1)
+            ofh.write(line)
+            continue
+        d = line.split()
+        if (len(d)<2):
+            continue
+        workid = int(d[0])
+        while (i<len(pending) and pending[i]<workid):
+            n += write(pending[i],updates[pending[i]])
+            i += 1
+        if (i<len(pending) and pending[i]==workid):
+            n += write(workid,updates[workid])
+            i += 1
+        else:
+            ofh.write(line)
+            h.add(workid,d[1:])
+            n += 1
+    while (i<len(pending)):
+        n += write(pending[i],updates[pending[i]])
+        i += 1
+    fh.close()
+    ofh.close()
+    logging.warning("written %d workid lines to %s" % (n,new_file))
+    return h
+
+def main():
+    # Options and arguments
+    LOGFILE = 'mx_incremental_workids.log'
+    p = optparse.OptionParser(description='Update bibid to oclcnums and workid to bibids data for a catalog delta',
+                              usage='usage: %prog --delta delta.xml.gz [--deletes deletes.txt] [old_bibid_to_oclcnums.gz] [old_workid_bibids.gz] [concordance_index_dir] [new_bibid_to_oclcnums.gz] [new_workid_bibids.gz]')
+    p.add_option('--delta', action='append', default=[],
+                 help="MARC file of added or changed records (repeatable)")
+    p.add_option('--deletes', action='store', default=None,
+                 help="File of deleted bibids, one per line")
+    p.add_option('--xml', action='store_true',
+                 help="Delta records are MARCXML")
+    p.add_option('--marc21', action='store_true',
+                 help="Delta records are MARC21")
+    p.add_option('--first-oclcnum-only', action='store_true',
+                 help="Take only the first OCLC number listed for each bibid, as for mx_get_oclc_workids.py")
+    p.add_option('--logfile', action='store', default=LOGFILE,
+                 help="Log file name (default %s)" % (LOGFILE))
+    p.add_option('--verbose', '-v', action='store_true',
+                 help="verbose, show additional informational messages")
+    instrument.add_options(p)
+    profiling.add_options(p)
+    p.set_defaults(pymarc=None, fast_scan=None, split_records=None)
+    (opt, args) = p.parse_args()
+
+    if (len(args)!=5):
+        sys.stderr.write('Error - Must have 5 arguments\n\n')
+        p.print_help()
+        exit(1)
+    (old_bibid_file,old_workid_file,index_dir,new_bibid_file,new_workid_file) = args
+    if (not opt.delta and not opt.deletes):
+        sys.stderr.write('Error - Must specify --delta and/or --deletes\n\n')
+        exit(1)
+
+    level = (logging.INFO if opt.verbose else logging.WARNING)
+    logging.basicConfig(filename=opt.logfile,level=level)
+    logging.warning("STARTED at %s" % (datetime.datetime.now()))
+
+    instrument.set_inputs(opt.delta+[old_bibid_file,new_bibid_file,old_workid_file])
+    instrument.start(opt)
+    profiling.start(opt)
+    ci = concordance_index.concordance_index(index_dir)
+
+    instrument.phase('read_delta')
+    (seen,lines) = read_delta(opt.delta,opt)
+    deletes = (read_deletes(opt.deletes) if opt.deletes else set())
+    for bibid in deletes.intersection(lines):
+        logging.warning("[%s] in both delta and deletes, deleted" % (bibid))
+    instrument.phase('patch_bibids')
+    changed_oclcnums = patch_bibid_oclcnums(old_bibid_file,new_bibid_file,set(seen),lines,deletes)
+    logging.warning("%d oclcnums changed" % (len(changed_oclcnums)))
+
+    # New bibid to oclcnums data read as mx_get_oclc_workids.py does
+    # so that the bibids for each oclcnum are in the same order
+    instrument.phase('lookup')
+    bo = mx_get_oclc_workids.bibid_oclcnums(file=new_bibid_file,first_oclcnum_only=opt.first_oclcnum_only)
+    workids = affected_workids(ci,changed_oclcnums)
+    logging.warning("%d workids affected" % (len(workids)))
+    updates = {}
+    for workid in workids:
+        updates[workid] = workid_bibids(ci,bo.bibids,workid)
+    ci.close()
+
+    instrument.phase('patch_workids')
+    h = patch_workid_bibids(old_workid_file,new_workid_file,updates)
+    h.log()
+    profiling.finish()
+    instrument.finish()
+    logging.warning("FINISHED at %s" % (datetime.datetime.now()))
+
+if __name__ == '__main__':
+    main()
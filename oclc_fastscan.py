@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# Byte-level fast path for pulling 001 and 035$a/079$a out of MARCXML
+#
+# For the job mx_grep_oclc.py does a full XML parse is overkill. This
+# scans the raw (decompressed) byte stream record by record with
+# precompiled patterns and builds marcxml_reader.lean_record objects
+# with just those fields, so mx_grepper.grep() and get_oclcnums()
+# apply exactly the same prefix and normalization logic as for a
+# parsed record.
+#
+# Any record that the patterns can't be trusted on (entity escapes,
+# comments, CDATA, namespace declarations inside the record, no 001,
+# etc.) is instead passed through marcxml_reader as a small standalone
+# document. Use mx_grep_oclc.py --cross-check to compare output with
+# the pymarc path.
+#
+import re
+import logging
+import cStringIO
+import marcxml_reader
+
+CHUNK_SIZE = 4*1024*1024
+
+# Element names may have any namespace prefix, e.g. <marc:record>
+RECORD_START = re.compile(r'<(?:([A-Za-z_][\w.-]*):)?record(?=[\s>])')
+RECORD_END = re.compile(r'</(?:[A-Za-z_][\w.-]*:)?record\s*>')
+CONTROLFIELD_001 = re.compile(r'<(?:[A-Za-z_][\w.-]*:)?controlfield\b[^>]*?\btag=(["\'])001\1[^>]*?(?<!/)>([^<]*)</')
+DATAFIELD_OCLC = re.compile(r'<(?:[A-Za-z_][\w.-]*:)?datafield\b[^>]*?\btag=(["\'])(035|079)\1[^>]*?(?<!/)>(.*?)</(?:[A-Za-z_][\w.-]*:)?datafield\s*>', re.S)
+SUBFIELD_A = re.compile(r'<(?:[A-Za-z_][\w.-]*:)?subfield\b[^>]*?\bcode=(["\'])a\1[^>]*?(?<!/)>([^<]*)</')
+# Markup anywhere in a record that means we fall back to a real parse,
+# entity escapes and CR (newline normalization) matter only in the values
+# we extract
+UNCLEAN = re.compile(r'<!--|<!\[CDATA\[|<\?|\bxmlns\b')
+UNCLEAN_VALUE = re.compile(r'[&\r]')
+NON_ASCII = re.compile(r'[\x80-\xff]')
+
+
+def _text(data):
+    """Decode element text as a parser would, unicode only if needed"""
+    if (NON_ASCII.search(data)):
+        return data.decode('utf-8')
+    return data
+
+
+class fast_scanner(object):
+
+    def __init__(self):
+        # Stats collected over run
+        self.records_seen = 0
+        self.records_fallback = 0
+        self.records_failed = 0
+
+    def records(self,fh):
+        """Generator of lean_record objects for each record in fh"""
+        for (prefix,data) in self.raw_records(fh):
+            self.records_seen += 1
+            record = self.scan_record(data)
+            if (record is None):
+                self.records_fallback += 1
+                record = self.parse_record(prefix,data)
+                if (record is None):
+                    continue
+            yield record
+
+    def raw_records(self,fh):
+        """Generator of (prefix,bytes) for each <record>..</record> in fh
+
+        Reads in large chunks and splits on record start and end tags.
+        """
+        buf = ''
+        while True:
+            chunk = fh.read(CHUNK_SIZE)
+            buf += chunk
+            pos = 0
+            while True:
+                m = RECORD_START.search(buf,pos)
+                if (not m):
+                    # keep tail in case a start tag spans chunks
+                    pos = max(pos,len(buf)-64)
+                    break
+                e = RECORD_END.search(buf,m.end())
+                if (not e):
+                    pos = m.start()
+                    break
+                yield (m.group(1),buf[m.start():e.end()])
+                pos = e.end()
+            buf = buf[pos:]
+            if (not chunk):
+                break
+
+    def scan_record(self,data):
+        """Pattern match 001 and 035$a/079$a from record bytes
+
+        Returns None if the record should be parsed properly instead,
+        including when a value isn't valid UTF-8.
+        """
+        if (UNCLEAN.search(data)):
+            return None
+        m = CONTROLFIELD_001.search(data)
+        if (not m or UNCLEAN_VALUE.search(m.group(2))):
+            return None
+        record = marcxml_reader.lean_record()
+        try:
+            record.add_field(marcxml_reader.control_field('001',_text(m.group(2))))
+            for d in DATAFIELD_OCLC.finditer(data):
+                s = SUBFIELD_A.search(d.group(3))
+                if (s and UNCLEAN_VALUE.search(s.group(2))):
+                    return None
+                subfields = ([('a',_text(s.group(2)))] if s else [])
+                record.add_field(marcxml_reader.data_field(d.group(2),[' ',' '],subfields))
+        except UnicodeDecodeError:
+            # bad UTF-8, let the parser fail just this record
+            return None
+        return record
+
+    def parse_record(self,prefix,data,tags=('001','035','079')):
+        """Parse one record's bytes with marcxml_reader
+
+        The record is wrapped in a collection element declaring the MARCXML
+        namespace for both the default and any prefix used. Only fields
+        with tags are materialized, None for all. Returns None (and logs)
+        if the record can't be parsed.
+        """
+        decl = ' xmlns="%s"' % (marcxml_reader.MARC_XML_NS)
+        if (prefix):
+            decl += ' xmlns:%s="%s"' % (prefix,marcxml_reader.MARC_XML_NS)
+        doc = '<collection%s>%s</collection>' % (decl,data)
+        try:
+            for record in marcxml_reader.parse_xml(cStringIO.StringIO(doc),tags=tags):
+                return record
+        except Exception as e:
+            self.records_failed += 1
+            logging.warning("Fast scan failed to parse record %d: %s" % (self.records_seen,str(e)))
+        return None
+
+    def map_xml(self,function,*files):
+        """Call function for every record in each of files (handles)"""
+        for fh in files:
+            for record in self.records(fh):
+                function(record)
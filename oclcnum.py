@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# OCLC number normalization shared by the mx_* scripts
+#
+# Classifies the raw value of an 035$a/079$a subfield as a valid OCLC
+# number, an e-suffixed number (ignored), a bad OCLC entry, or not an
+# OCLC reference at all. See mx_grepper.get_oclcnums() for the
+# background on the prefixes seen in Cornell, Harvard and Stanford
+# data.
+#
+# The same '(OCoLC)ocm...' strings recur across institutions and
+# records, so results are memoized in a bounded cache. The cache is
+# two plain dicts (current and previous generation) rather than an
+# OrderedDict, which keeps a hit down to one dict lookup: entries used
+# in the last generation are promoted, the rest are dropped when the
+# current generation fills up. When most refs are distinct the cache
+# costs more than it saves (at 60% distinct it was about half the speed
+# of the compiled patterns alone), a cache_size of 0 turns it off.
+#
+# Run as a script for a micro-benchmark comparing with the original
+# inline re.match() code.
+#
+import re
+import optparse
+import random
+import time
+
+# Status values from classify()
+VALID = 'valid'
+ESUFFIX = 'esuffix'
+BAD = 'bad'
+
+PREFIX_RE = re.compile(r'(\(ocolc\)|\(ocolc-m\)|ocm|ocn|on)(.+)$', re.IGNORECASE)
+ENTRY_RE = re.compile(r'(?:ocm|ocn|on)?(\d+)(e?)$', re.IGNORECASE)
+
+NOT_OCLC = (None, None)
+
+CACHE_SIZE = 1000000
+
+
+class oclcnum_normalizer(object):
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        """Normalizer with cache of up to cache_size refs, 0 for no cache"""
+        if (cache_size<=0):
+            self.classify = normalize
+        self.generation_size = max(1, cache_size//2)
+        self.cache = {}
+        self.old_cache = {}
+        # Stats
+        self.hits = 0
+        self.misses = 0
+
+    def classify(self, ref):
+        """Classify raw subfield value ref, returns (status, value)
+
+        Status is one of VALID (value is the integer OCLC number),
+        ESUFFIX or BAD (value is the entry after the prefix, for
+        logging), or None if ref is not an OCLC reference. Leading or
+        trailing whitespace is ignored.
+        """
+        try:
+            result = self.cache[ref]
+            self.hits += 1
+            return result
+        except KeyError:
+            pass
+        result = self.old_cache.get(ref)
+        if (result is None):
+            self.misses += 1
+            result = normalize(ref)
+        else:
+            self.hits += 1
+        if (len(self.cache) >= self.generation_size):
+            self.old_cache = self.cache
+            self.cache = {}
+        self.cache[ref] = result
+        return result
+
+
+def normalize(ref):
+    """Uncached classification of ref, see oclcnum_normalizer.classify()"""
+    m = PREFIX_RE.match(ref.strip())
+    if (not m):
+        return NOT_OCLC
+    entry = m.group(2)
+    m2 = ENTRY_RE.match(entry)
+    if (not m2):
+        return (BAD, entry)
+    elif (m2.group(2)):
+        return (ESUFFIX, entry)
+    return (VALID, int(m2.group(1)))
+
+def legacy_normalize(ref):
+    """Original inline code from mx_grepper.get_oclcnums(), for comparison"""
+    ref = ref.lstrip().rstrip()
+    m = re.match(r'(\(ocolc\)|\(ocolc-m\)|ocm|ocn|on)(.+)$',ref,flags=re.IGNORECASE)
+    if (m):
+        entry = m.group(2)
+        m2 = re.match(r'^(ocm|ocn|on)?(\d+)$',entry,flags=re.IGNORECASE)
+        if (m2):
+            return (VALID, int(m2.group(2)))
+        elif (re.match(r'(ocm|ocn|on)?(\d+)e$',entry,flags=re.IGNORECASE)):
+            return (ESUFFIX, entry)
+        else:
+            return (BAD, entry)
+    return NOT_OCLC
+
+def sample_refs(n, distinct, seed=1):
+    """List of n refs drawn from distinct synthetic 035$a style values"""
+    rnd = random.Random(seed)
+    fmts = ['(OCoLC)%d','(OCoLC)ocm%08d','(OCoLC)ocn%d','ocm%08d','ocn%d',
+            '(OCoLC-M)%d',' (OCoLC)%d ','(OCoLC)%de','(OCoLC)%d 1234','(DLC)%d']
+    values = [rnd.choice(fmts) % rnd.randint(1,999999999) for x in range(distinct)]
+    return [rnd.choice(values) for x in range(n)]
+
+def main():
+    p = optparse.OptionParser(description='Micro-benchmark for OCLC number normalization',
+                              usage='usage: %prog [[opts]] [refs_file]')
+    p.add_option('--count', '-n', action='store', type='int', default=1000000,
+                 help="Number of refs to normalize (default %default)")
+    p.add_option('--distinct', '-d', action='store', type='int', default=100000,
+                 help="Number of distinct synthetic refs (default %default)")
+    p.add_option('--cache-size', action='store', type='int', default=CACHE_SIZE,
+                 help="Size of cache for compiled+cache (default %default)")
+    (opt, args) = p.parse_args()
+    if (len(args)>0):
+        # One raw subfield value per line
+        refs = [line.rstrip('\n') for line in open(args[0])]
+    else:
+        refs = sample_refs(opt.count, opt.distinct)
+    print "%d refs, %d distinct" % (len(refs),len(set(refs)))
+    on = oclcnum_normalizer(opt.cache_size)
+    rates = {}
+    for (name,func) in [('legacy re.match',legacy_normalize),
+                        ('compiled',normalize),
+                        ('compiled+cache',on.classify)]:
+        start = time.time()
+        for ref in refs:
+            func(ref)
+        elapsed = time.time()-start
+        rates[name] = len(refs)/elapsed
+        print "%-16s %10.0f normalizations/s" % (name,rates[name])
+    print "cache: %d hits, %d misses" % (on.hits,on.misses)
+    if (rates['compiled+cache']<rates['compiled']):
+        print "note: cache is slower than compiled alone with %.0f%% distinct refs, --cache-size 0 turns it off" % (100.0*len(set(refs))/len(refs))
+
+if __name__ == '__main__':
+    main()
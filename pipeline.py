@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+#
+# Threaded read -> work -> write pipeline with bounded queues
+#
+# Used by the --pipeline modes of mx_grep_oclc.py and
+# mx_get_oclc_workids.py so that reading (and gzio decompression),
+# parsing/matching and writing (and gzio compression) overlap instead
+# of taking turns on one thread:
+#
+#   reader thread  - iterates over items, e.g. batches of records
+#   worker threads - call work(item), or run it in the processes of a
+#                    multiprocessing pool so that parsing is parallel
+#   writer         - the caller's thread, gets results in item order
+#                    and calls write(result), so it owns the output
+#                    files and the log
+#
+# At most a fixed number of items are in flight between reader and
+# writer, so a slow stage blocks the ones before it and memory stays
+# flat. Queue depths and the time each stage spent blocked or idle
+# are logged every log_interval seconds and at the end, with a guess
+# at which stage is the bottleneck.
+#
+import time
+import Queue
+import logging
+import threading
+import instrument
+
+QUEUE_SIZE = 8
+LOG_INTERVAL = 60.0
+
+
+class pipeline(object):
+
+    def __init__(self,name,work,workers=1,pool=None,queue_size=QUEUE_SIZE,
+                 log_interval=LOG_INTERVAL,stages=('read','work','write')):
+        """Pipeline name running work(item) on workers threads
+
+        If pool is given then each worker thread runs work in the pool,
+        work and items must then be picklable.
+        """
+        self.name = name
+        self.work = work
+        self.workers = workers
+        self.pool = pool
+        self.queue_size = queue_size
+        self.log_interval = log_interval
+        self.stages = stages
+        self.in_queue = Queue.Queue(maxsize=queue_size)
+        self.out_queue = Queue.Queue(maxsize=queue_size)
+        # items between reader and writer, includes those being worked
+        # on and those waiting to be written in order
+        self.slots = threading.Semaphore(2*queue_size+workers)
+        self.error = None
+        self.items = 0
+        self.reader_blocked = 0.0
+        self.workers_idle = 0.0
+        self.writer_idle = 0.0
+        self.depth_samples = 0
+        self.in_depth_total = 0
+        self.out_depth_total = 0
+
+    def _read(self,items):
+        """Reader thread, puts (seq,item) on in_queue then a None per worker"""
+        try:
+            for (seq,item) in enumerate(items):
+                start = time.time()
+                self.slots.acquire()
+                self.in_queue.put((seq,item))
+                self.reader_blocked += time.time()-start
+        except Exception as e:
+            logging.warning("pipeline %s: error in %s stage: %s" % (self.name,self.stages[0],str(e)))
+            self.error = e
+        for n in range(self.workers):
+            self.in_queue.put(None)
+
+    def _work(self):
+        """Worker thread, puts (seq,result) on out_queue then None"""
+        while True:
+            start = time.time()
+            x = self.in_queue.get()
+            self.workers_idle += time.time()-start
+            if (x is None):
+                break
+            (seq,item) = x
+            try:
+                if (self.pool is not None):
+                    result = self.pool.apply(self.work,(item,))
+                else:
+                    result = self.work(item)
+            except Exception as e:
+                logging.warning("pipeline %s: error in %s stage: %s" % (self.name,self.stages[1],str(e)))
+                self.error = e
+                result = None
+            self.out_queue.put((seq,result))
+        self.out_queue.put(None)
+
+    def run(self,items,write):
+        """Feed items through work and call write(result) for each in order
+
+        Returns the number of items. Any error in the reader or a worker
+        is raised here.
+        """
+        threads = [threading.Thread(target=self._read,args=(items,))]
+        for n in range(self.workers):
+            threads.append(threading.Thread(target=self._work))
+        for t in threads:
+            t.daemon = True
+            t.start()
+        pending = {}
+        next_seq = 0
+        running = self.workers
+        last_log = time.time()
+        while (running>0):
+            start = time.time()
+            try:
+                x = self.out_queue.get(timeout=self.log_interval)
+            except Queue.Empty:
+                x = False
+            now = time.time()
+            self.writer_idle += now-start
+            if (self.error is not None):
+                raise self.error
+            self.depth_samples += 1
+            self.in_depth_total += self.in_queue.qsize()
+            self.out_depth_total += self.out_queue.qsize()
+            if (x is None):
+                running -= 1
+            elif (x is not False):
+                pending[x[0]] = x[1]
+                while (next_seq in pending):
+                    write(pending.pop(next_seq))
+                    next_seq += 1
+                    self.slots.release()
+            if (now-last_log>=self.log_interval):
+                self.log()
+                last_log = now
+        if (self.error is not None):
+            raise self.error
+        self.items = next_seq
+        self.log(final=True)
+        for (stage,seconds) in ((self.stages[0]+'_blocked',self.reader_blocked),
+                                (self.stages[1]+'_idle',self.workers_idle),
+                                (self.stages[2]+'_idle',self.writer_idle)):
+            instrument.add_time('pipeline_'+stage,seconds)
+        return next_seq
+
+    def bottleneck(self):
+        """Name of the stage that looks to be holding up the others
+
+        A full queue means the stage after it is slow, an empty input
+        queue means the reader can't keep up.
+        """
+        n = max(self.depth_samples,1)
+        in_fill = float(self.in_depth_total)/n/self.queue_size
+        out_fill = float(self.out_depth_total)/n/self.queue_size
+        if (out_fill>=0.5):
+            return self.stages[2]
+        if (in_fill>=0.5):
+            return self.stages[1]
+        return self.stages[0]
+
+    def log(self,final=False):
+        """Log queue depths and stage waits"""
+        n = max(self.depth_samples,1)
+        (read,work,write) = self.stages
+        logging.warning("pipeline %s: %s->%s queue %d/%d (avg %.1f), %s->%s queue %d/%d (avg %.1f), "
+                        "%s blocked %.1fs, %s idle %.1fs, %s idle %.1fs%s" %
+                        (self.name,read,work,self.in_queue.qsize(),self.queue_size,float(self.in_depth_total)/n,
+                         work,write,self.out_queue.qsize(),self.queue_size,float(self.out_depth_total)/n,
+                         read,self.reader_blocked,work,self.workers_idle,write,self.writer_idle,
+                         (", %d items, bottleneck looks to be %s" % (self.items,self.bottleneck()) if final else '')))
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#
+# Built-in profiling for the mx_* scripts
+#
+# --profile DIR turns on two profilers for a run:
+#
+# - cProfile, over the whole run or, for scripts that work through
+#   many files or records, over a sample of --profile-sample of those
+#   units (e.g. 0.01 for every 100th file). The result is written as
+#   DIR/<script>.pstats for pstats/snakeviz and the top
+#   --profile-top functions by own time are logged.
+# - a statistical stack sampler driven by SIGPROF every
+#   --profile-interval seconds of CPU time, written as collapsed
+#   stacks to DIR/<script>.collapsed for flamegraph.pl or speedscope.
+#   Each stack starts with the instrument.py phase it was taken in
+#   and the log has a breakdown by named hot path (see NAMED).
+#
+# The sampler only sees the main thread, so gzio background
+# decompression and compression threads don't show up. With --jobs
+# worker processes only the parent process is profiled.
+#
+import os
+import signal
+import logging
+import cProfile
+import pstats
+import contextlib
+import cStringIO
+import instrument
+
+INTERVAL = 0.005
+TOP = 20
+
+# Function names of the hot paths to report samples for. The
+# innermost matching frame of a stack names the hot path it counts
+# towards, stacks with no match count as 'other'.
+NAMED = {
+    'map_xml': 'map_xml',
+    'map_records': 'map_records',
+    'raw_records': 'marc21_split',
+    'decode_record': 'marc21_decode',
+    'get_oclcnums': 'get_oclcnums',
+    'classify': 'normalize',
+    'read_concordance': 'concordance_parse',
+    'parse_block': 'concordance_parse',
+    'scan_block': 'concordance_match',
+    'candidates': 'prefilter',
+    'add_work': 'add_work',
+    'add_oclcnum_to_bibid': 'read_bibids',
+    'iter_bibid_to_oclcnums': 'read_bibids',
+    'iter_pairs': 'read_pairs',
+    'build': 'index_build',
+    'build_cache': 'concordance_sort',
+    'write_works_data': 'write',
+    'write_workid_to_bibid_data': 'write',
+    '_submit': 'gzip_write',
+    'spill': 'sort',
+    'merge_runs': 'sort',
+}
+
+
+class profiler(object):
+    """cProfile over sampled units plus a SIGPROF stack sampler"""
+
+    def __init__(self):
+        self.dir = None
+        self.profile = None
+        self.sample = 1.0
+        self.top = TOP
+        self.units_seen = 0
+        self.units_profiled = 0
+        self.whole_run = False
+        self.stacks = {}
+        self.samples = 0
+
+    def active(self):
+        return (self.dir is not None)
+
+    def start(self,dir,sample=1.0,interval=INTERVAL,top=TOP,units=False):
+        """Start profiling to dir
+
+        If units is True then only units (see unit() and sampled())
+        are run under cProfile, else the whole run is.
+        """
+        if (not os.path.isdir(dir)):
+            os.makedirs(dir)
+        self.dir = dir
+        self.sample = sample
+        self.top = top
+        self.profile = cProfile.Profile()
+        self.whole_run = not units
+        signal.signal(signal.SIGPROF,self._sample_stack)
+        # restart rather than interrupt system calls
+        signal.siginterrupt(signal.SIGPROF,False)
+        signal.setitimer(signal.ITIMER_PROF,interval,interval)
+        if (self.whole_run):
+            self.profile.enable()
+
+    def _sample_stack(self,signum,frame):
+        stack = []
+        while (frame is not None):
+            code = frame.f_code
+            stack.append("%s:%s" % (os.path.basename(code.co_filename).replace('.py',''),code.co_name))
+            frame = frame.f_back
+        stack.append(instrument._metrics.phase_name or 'main')
+        stack.reverse()
+        key = ';'.join(stack)
+        self.stacks[key] = self.stacks.get(key,0)+1
+        self.samples += 1
+
+    def want(self):
+        """True if the next unit is in the sample, evenly spaced"""
+        n = self.units_seen
+        self.units_seen += 1
+        if (int((n+1)*self.sample)>int(n*self.sample)):
+            self.units_profiled += 1
+            return True
+        return False
+
+    @contextlib.contextmanager
+    def unit(self,name=None,enabled=True):
+        """Run block under cProfile if it is in the sample (and enabled)"""
+        if (not enabled or not self.active() or self.whole_run or not self.want()):
+            yield
+            return
+        self.profile.enable()
+        try:
+            yield
+        finally:
+            self.profile.disable()
+
+    def sampled(self,function):
+        """Wrap function so that sampled calls (e.g. records) are profiled"""
+        if (not self.active() or self.whole_run):
+            return function
+        def wrapper(*args):
+            if (not self.want()):
+                return function(*args)
+            self.profile.enable()
+            try:
+                return function(*args)
+            finally:
+                self.profile.disable()
+        return wrapper
+
+    def named_counts(self):
+        """Dict of named hot path to number of samples"""
+        counts = {}
+        for (key,n) in self.stacks.items():
+            name = 'other'
+            for frame in reversed(key.split(';')[1:]):
+                func = frame[frame.rfind(':')+1:]
+                if (func in NAMED):
+                    name = NAMED[func]
+                    break
+            counts[name] = counts.get(name,0)+n
+        return counts
+
+    def finish(self):
+        """Stop, write outputs and log reports, if profiling"""
+        if (not self.active()):
+            return
+        signal.setitimer(signal.ITIMER_PROF,0,0)
+        signal.signal(signal.SIGPROF,signal.SIG_DFL)
+        self.profile.disable()
+        name = instrument._metrics.script
+        pstats_file = os.path.join(self.dir,name+'.pstats')
+        collapsed_file = os.path.join(self.dir,name+'.collapsed')
+        fh = open(collapsed_file,'w')
+        for key in sorted(self.stacks):
+            fh.write("%s %d\n" % (key,self.stacks[key]))
+        fh.close()
+        if (self.whole_run):
+            logging.warning("profile: cProfile of whole run")
+        else:
+            logging.warning("profile: cProfile of %d of %d units" % (self.units_profiled,self.units_seen))
+        if (self.whole_run or self.units_profiled>0):
+            self.profile.dump_stats(pstats_file)
+            out = cStringIO.StringIO()
+            pstats.Stats(self.profile,stream=out).sort_stats('tottime').print_stats(self.top)
+            for line in out.getvalue().splitlines():
+                if (line.strip()):
+                    logging.warning("profile: %s" % (line))
+            logging.warning("profile: written %s" % (pstats_file))
+        counts = self.named_counts()
+        for (name,n) in sorted(counts.items(),key=lambda x: -x[1]):
+            logging.warning("profile: %5.1f%% of %d samples in %s" % (100.0*n/self.samples,self.samples,name))
+        logging.warning("profile: written %s (%d stacks)" % (collapsed_file,len(self.stacks)))
+        self.dir = None
+
+
+# Module level profiler and functions to use it
+_profiler = profiler()
+unit = _profiler.unit
+sampled = _profiler.sampled
+finish = _profiler.finish
+
+def add_options(p,units=None):
+    """Add --profile options to optparse p, units names what is sampled"""
+    p.add_option('--profile', action='store', default=None,
+                 help="Profile run writing cProfile stats and collapsed stacks (flamegraph input) to this directory, hot spots are logged")
+    if (units):
+        p.add_option('--profile-sample', action='store', type='float', default=1.0,
+                     help="Fraction of %s to run under cProfile with --profile (default %%default)" % (units))
+    p.add_option('--profile-interval', action='store', type='float', default=INTERVAL,
+                 help="Seconds of CPU time between stack samples with --profile (default %default)")
+    p.add_option('--profile-top', action='store', type='int', default=TOP,
+                 help="Number of hottest functions to log with --profile (default %default)")
+
+def start(opt):
+    """Start profiling if --profile given
+
+    If --profile-sample is an option then only units are profiled.
+    """
+    if (opt.profile is not None):
+        units = hasattr(opt,'profile_sample')
+        _profiler.start(opt.profile,sample=(opt.profile_sample if units else 1.0),
+                        interval=opt.profile_interval,top=opt.profile_top,units=units)
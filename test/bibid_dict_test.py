@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Check bibid_dict.py codecs and surrogates, and that bibid_oclcnums
+# and workids give the same data with --bibid-dict. Run from the top
+# level directory.
+#
+import os
+import sys
+import unittest
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import bibid_dict
+import mx_get_oclc_workids
+import mx_analyze_workids
+
+BO_FILE = os.path.join(os.path.dirname(__file__), 'bo_10000.gz')
+WORKS_FILE = os.path.join(os.path.dirname(__file__), 'works.gz')
+
+
+class BibidDictTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+
+    def test_codecs(self):
+        c = bibid_dict.integer_codec()
+        self.assertEqual(c.encode('1234567'), 1234567)
+        self.assertEqual(c.decode(1234567), '1234567')
+        self.assertEqual(c.encode('01234'), None)
+        self.assertEqual(c.encode('004082148-X'), None)
+        c = bibid_dict.check_digit_codec()
+        for bibid in ('004082148-X','000000001-0','123-9'):
+            self.assertEqual(c.decode(c.encode(bibid)), bibid)
+        self.assertEqual(c.encode('004082148'), None)
+        c = bibid_dict.auto_codec()
+        for bibid in ('1','004082148','004082148-X'):
+            self.assertEqual(c.decode(c.encode(bibid)), bibid)
+        self.assertEqual(c.encode('b1234'), None)
+
+    def test_bibid_dict(self):
+        self.assertRaises(ValueError, bibid_dict.bibid_dict, 'nope')
+        bd = bibid_dict.bibid_dict('cornell')
+        self.assertEqual(bd.id('10'), 0)
+        self.assertEqual(bd.id('0010'), 1)
+        self.assertEqual(bd.id('b7'), 2)
+        self.assertEqual(bd.id('10'), 0)
+        self.assertEqual(bd.id('b7'), 2)
+        self.assertEqual(len(bd), 3)
+        self.assertEqual(bd.odd, ['0010','b7'])
+        self.assertEqual([bd.bibid(s) for s in range(3)], ['10','0010','b7'])
+        bd.freeze()
+        self.assertEqual(bd.bibid(1), '0010')
+        self.assertTrue(bd.memory_bytes()>0)
+
+    def test_surrogate_index(self):
+        bd = bibid_dict.bibid_dict('harvard')
+        si = bibid_dict.surrogate_index(bd)
+        bibids = ['00%d-%d' % (n,n%10) for n in range(1000,1010)]
+        dict_of_sets = {}
+        for bibid in bibids:
+            for oclcnum in (5,7):
+                si.add(oclcnum,bibid)
+                dict_of_sets.setdefault(oclcnum,set()).add(bibid)
+        si.add(9,bibids[0])
+        si.add(9,bibids[0])
+        self.assertTrue(5 in si)
+        self.assertFalse(6 in si)
+        self.assertEqual(len(si), 3)
+        self.assertEqual(sorted(si.keys()), [5,7,9])
+        self.assertEqual(si[9], [0])
+        # same order as iterating over the set of strings
+        self.assertEqual([bd.bibid(s) for s in si[5]], list(dict_of_sets[5]))
+        self.assertRaises(KeyError, si.__getitem__, 6)
+
+    def test_deep_size(self):
+        self.assertTrue(bibid_dict.deep_size({1: ['abc']}) > sys.getsizeof({}))
+        s = 'shared string'
+        self.assertEqual(bibid_dict.deep_size([s,s]), sys.getsizeof([s,s])+sys.getsizeof(s))
+
+    def test_bibid_oclcnums_same_as_plain(self):
+        plain = mx_get_oclc_workids.bibid_oclcnums(file=BO_FILE,write_workid_bibids=True)
+        bo = mx_get_oclc_workids.bibid_oclcnums(file=BO_FILE,write_workid_bibids=True,bibid_codec='auto')
+        self.assertEqual(len(bo.bibids), len(plain.bibids))
+        for oclcnum in plain.bibids.keys():
+            self.assertEqual([bo.bibid_dict.bibid(s) for s in bo.bibids[oclcnum]], list(plain.bibids[oclcnum]))
+        self.assertTrue(bo.memory_bytes() < plain.memory_bytes())
+
+    def test_workids_same_as_plain(self):
+        plain = mx_analyze_workids.workids(WORKS_FILE)
+        w = mx_analyze_workids.workids(WORKS_FILE,bibid_codec='auto')
+        self.assertEqual(sorted(w.workids), sorted(plain.workids))
+        for workid in plain.workids:
+            self.assertEqual([w.to_str(s) for s in w.workids[workid]], plain.workids[workid])
+        self.assertEqual(len(w.bibids), len(plain.bibids))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Check that bibid_index.compact_bibid_index gives the same lookups as
+# a dict of sets, with and without NumPy. Run from the top level
+# directory.
+#
+import os
+import sys
+import unittest
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import bibid_index
+
+
+class BibidIndexTest(unittest.TestCase):
+
+    def mappings(self):
+        """(oclcnum, bibid) with repeats, several bibids per oclcnum and odd bibids"""
+        random.seed(5)
+        pairs = []
+        for n in range(3000):
+            oclcnum = random.randint(1,800)
+            bibid = random.choice(['%d' % (random.randint(1,2000)),
+                                   '00%d-%s' % (random.randint(1,999),random.choice('0123456789X')),
+                                   'b%d' % (random.randint(1,50))])
+            pairs.append((oclcnum,bibid))
+            if (n%10==0):
+                pairs.append((oclcnum,bibid))
+        pairs.extend([(900,'1'),(900,'1'),(900,'2'),(900,'1')])
+        return pairs
+
+    def check(self,pairs):
+        dict_of_sets = {}
+        index = bibid_index.compact_bibid_index()
+        for (oclcnum,bibid) in pairs:
+            dict_of_sets.setdefault(oclcnum,set()).add(bibid)
+            index.add(oclcnum,bibid)
+        index.finalize()
+        self.assertEqual(len(index), len(dict_of_sets))
+        self.assertEqual(list(index.keys()), sorted(dict_of_sets))
+        for oclcnum in range(0,1000):
+            self.assertEqual(oclcnum in index, oclcnum in dict_of_sets)
+            if (oclcnum in dict_of_sets):
+                self.assertEqual(list(index[oclcnum]), list(dict_of_sets[oclcnum]))
+            else:
+                self.assertRaises(KeyError, index.__getitem__, oclcnum)
+        self.assertEqual(len(index.codes), sum([len(x) for x in dict_of_sets.values()]))
+        return index
+
+    def test_encode(self):
+        odd = []
+        for bibid in ('1','0012','004082148-X','123-4'):
+            self.assertEqual(bibid_index.decode_bibid(bibid_index.encode_bibid(bibid)), bibid)
+        code = bibid_index.encode_bibid('b12',odd)
+        self.assertEqual(code, -1)
+        self.assertEqual(bibid_index.decode_bibid(code,odd), 'b12')
+        self.assertRaises(ValueError, bibid_index.encode_bibid, 'b12')
+
+    def test_same_as_dict_of_sets(self):
+        index = self.check(self.mappings())
+        self.assertEqual(list(index[900]), list(set(['1','2'])))
+        self.check([])
+
+    def test_without_numpy(self):
+        saved = bibid_index.np
+        bibid_index.np = None
+        try:
+            self.check(self.mappings())
+            self.check([])
+        finally:
+            bibid_index.np = saved
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Check that a bibid store built from mx_grep_oclc.py output gives the
+# same pairs as the text file and supports lookups. Run from the top
+# level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gzio
+import bibid_store
+import mx_get_oclc_workids
+
+
+class BibidStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+        self.file = os.path.join(self.tmpdir,'bo.sqlite')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def build(self,text):
+        store = bibid_store.bibid_store(self.file,create=True)
+        # writes that split lines, as when shards are copied
+        for j in range(0,len(text),1000):
+            store.write(text[j:j+1000])
+        store.close()
+
+    def test_pairs(self):
+        fh = gzio.open_input('test/bo_10000.gz')
+        self.build(fh.read())
+        fh.close()
+        self.assertTrue(bibid_store.is_store(self.file))
+        self.assertFalse(bibid_store.is_store('test/bo_10000.gz'))
+        for first in (False,True):
+            bo = mx_get_oclc_workids.bibid_oclcnums(first_oclcnum_only=first)
+            self.assertEqual(list(bo.iter_bibid_to_oclcnums(self.file)),
+                             list(bo.iter_bibid_to_oclcnums('test/bo_10000.gz')))
+        store = bibid_store.bibid_store(self.file)
+        self.assertEqual(store.comments[0],'#bibid oclcnum[s]')
+        pairs = list(store.iter_by_oclcnum())
+        self.assertEqual(pairs,sorted(pairs,key=lambda x: x[0]))
+        self.assertEqual(store.oclcnums('47'),[21373148])
+        self.assertEqual(store.bibids(21373148),['47'])
+        self.assertEqual(store.oclcnums('no_such_bibid'),[])
+        store.close()
+
+    def test_multi(self):
+        self.build("#bibid oclcnum[s]\n004082148-X\t12 7\n5\t7\n6\t8")
+        store = bibid_store.bibid_store(self.file)
+        self.assertEqual(len(store),3)
+        self.assertEqual(store.oclcnums('004082148-X'),[12,7])
+        self.assertEqual(store.bibids(7),['004082148-X','5'])
+        self.assertEqual(list(store.iter_pairs(first_oclcnum_only=True)),
+                         [(12,'004082148-X'),(7,'5'),(8,'6')])
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
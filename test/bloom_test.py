@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Check the Bloom filter and that prefiltering the concordance gives
+# the same matches and counts as the plain scan. Run from the top
+# level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import random
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import bloom
+import mx_get_oclc_workids
+
+LINES = ['100\t200\t7\n',
+         '5\t300\t8\n',
+         '200\t400\tNONE\n',
+         '7\t8\tNONE\n',
+         'bad line\n',
+         '0300\t999\t9\n',
+         '300\t999\t9\n',
+         '400\t500\t10']
+
+
+class BloomTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        mx_get_oclc_workids.worker_state.clear()
+
+    def test_clean(self):
+        self.assertTrue(bloom.clean('1\t2\t3\n45\t67\tNONE\n'))
+        for text in ['0\t1\t2\n', '1\t01\t2\n', '1\t\t2\n', '1\t2\t\n', '1\t2\t3\n\n',
+                     '\t1\t2\n', '1 2 3\n', '1\tNONE\t3\n', '1\t2\tNONEX\n', '1\t2\t3\r\n']:
+            self.assertFalse(bloom.clean(text), repr(text))
+
+    def test_filter(self):
+        random.seed(1)
+        keys = random.sample(xrange(1,10**6),10000)
+        bf = bloom.build(keys,0.01)
+        self.assertEqual(bf.n, 10000)
+        for key in keys:
+            self.assertTrue(str(key) in bf)
+        have = set(keys)
+        others = [str(x) for x in xrange(1,10**6) if x not in have]
+        fpr = float(len([x for x in others if x in bf]))/len(others)
+        self.assertTrue(fpr < 2*bf.expected_fpr())
+        self.assertTrue(bf.expected_fpr() <= 0.01)
+        bf2 = bloom.bloom_filter(1)
+        bf2.add('123')
+        self.assertTrue('123' in bf2)
+
+    def test_candidates(self):
+        bf = bloom.build([100,300])
+        lines = ['100\t2\t3', '4\t300\tNONE', '5\t6\tNONE', '7\t8\t9', 'odd']
+        (candidates,skipped,none_skipped) = bf.candidates(lines,10)
+        self.assertEqual(candidates[0], (10,'100\t2\t3'))
+        self.assertEqual(candidates[1], (11,'4\t300\tNONE'))
+        self.assertEqual(candidates[-1], (14,'odd'))
+        self.assertEqual(len(candidates)+skipped, 5)
+
+    def compare(self,concordance_file,bibid_file,chunk):
+        bo1 = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_workid_bibids=True,write_oclcnum_workid_pairs=True)
+        counts1 = mx_get_oclc_workids.read_concordance(bo1,concordance_file)
+        bo2 = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_workid_bibids=True,write_oclcnum_workid_pairs=True)
+        bo2.build_prefilter()
+        saved = mx_get_oclc_workids.PIPELINE_CHUNK
+        mx_get_oclc_workids.PIPELINE_CHUNK = chunk
+        try:
+            counts2 = mx_get_oclc_workids.read_concordance_filtered(bo2,concordance_file)
+        finally:
+            mx_get_oclc_workids.PIPELINE_CHUNK = saved
+        self.assertEqual(counts1, counts2)
+        self.assertEqual(bo1.works, bo2.works)
+        self.assertEqual(bo1.oclccn2oclcwn, bo2.oclccn2oclcwn)
+        bf = bo2.prefilter
+        self.assertEqual(bf.checked+bf.unchecked, counts2[0])
+        return (counts2,bf)
+
+    def test_same_as_plain_scan(self):
+        for chunk in (1000,mx_get_oclc_workids.PIPELINE_CHUNK):
+            (counts,bf) = self.compare('test/oclc_conc_100k.gz','test/bo_10000.gz',chunk)
+            self.assertEqual(counts, (100000,0,26,22))
+            self.assertTrue(bf.skipped > 99000)
+            self.assertEqual(bf.unchecked, 0)
+
+    def test_bad_lines(self):
+        tmpdir = tempfile.mkdtemp()
+        conc = os.path.join(tmpdir,'conc.gz')
+        bibids = os.path.join(tmpdir,'bibids.gz')
+        gzip.open(conc,'wb').write(''.join(LINES))
+        gzip.open(bibids,'wb').write('b1 100\nb2 300\nb3 400\n')
+        try:
+            for chunk in (1,20,1000):
+                (counts,bf) = self.compare(conc,bibids,chunk)
+                self.assertEqual(counts, (8,4,1,2))
+        finally:
+            os.remove(conc)
+            os.remove(bibids)
+            os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Check that text written to the columnar format reads back the same,
+# as text and as rows. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gzio
+import columnar
+
+BIBID_OCLCNUMS = """#bibid oclcnum[s]
+#Reading x.xml as MARCXML
+47\t21373148
+004082148-X\t12 7 3
+odd_bibid\t8
+# 3 records seen, 3 matched, 1 multi-valued
+"""
+
+WORKID_BIBIDS = """#workid bibids
+#workid fmt string is http://worldcat.org/entity/work/id/%d to get URI
+1 47 48 49
+22 47
+333 004082148-X
+"""
+
+
+class ColumnarTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+        self.file = os.path.join(self.tmpdir,'x.mxc')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self,text,chunk_rows=2):
+        w = columnar.writer(self.file,chunk_rows=chunk_rows)
+        # writes that split lines
+        for j in range(0,len(text),5):
+            w.write(text[j:j+5])
+        w.close()
+
+    def test_text(self):
+        for text in (BIBID_OCLCNUMS,WORKID_BIBIDS):
+            self.write(text)
+            self.assertTrue(columnar.is_columnar(self.file))
+            fh = columnar.open_input(self.file)
+            self.assertEqual(''.join(fh),text)
+            fh.close()
+        fh = gzio.open_input('test/bo_10000.gz')
+        text = fh.read()
+        fh.close()
+        self.write(text,chunk_rows=1000)
+        # oclcnums are the same as ints, zero padding is lost
+        def ints(lines):
+            return [(line if line.startswith('#') else [int(x) for x in line.split()]) for line in lines]
+        self.assertEqual(ints(columnar.reader(self.file)),ints(text.splitlines(True)))
+        self.assertTrue(os.path.getsize(self.file)<os.path.getsize('test/bo_10000.gz'))
+
+    def test_rows(self):
+        self.write(BIBID_OCLCNUMS)
+        r = columnar.reader(self.file)
+        self.assertEqual(r.kind,'bibid_oclcnums')
+        self.assertEqual(list(r.rows()),[(3,'47',21373148,0),(4,'004082148-X',12,0),(4,'004082148-X',7,1),
+                                         (4,'004082148-X',3,2),(5,'odd_bibid',8,0)])
+        self.assertEqual(r.lines,6)
+        self.write(WORKID_BIBIDS)
+        self.assertEqual(list(columnar.reader(self.file).rows())[2:4],[(3,1,'49',2),(4,22,'47',0)])
+
+    def test_bad(self):
+        self.write("#workid bibid\n1 2\nx 3\n4\n\n5 6\n")
+        self.assertEqual(''.join(columnar.reader(self.file)),"#workid bibid\n1 2\n5 6\n")
+        self.assertRaises(ValueError,self.write,"#no kind\n1 2\n")
+        self.write(WORKID_BIBIDS)
+        data = open(self.file,'rb').read()
+        open(self.file,'wb').write(data[:-20])
+        self.assertRaises(IOError,list,columnar.reader(self.file))
+
+    def test_shuffle(self):
+        data = ''.join([chr(i%256) for i in range(800)])
+        self.assertEqual(columnar.unshuffle(columnar.shuffle(data)),data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# Check that matching with a prebuilt concordance index gives the same
+# outputs as the plain scan of the concordance. Run from the top level
+# directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import json
+import random
+import logging
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import concordance_index
+import mx_get_oclc_workids
+
+
+class ConcordanceIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def path(self,name):
+        return os.path.join(self.tmpdir,name)
+
+    def write(self,name,text):
+        fh = gzip.open(self.path(name),'wb')
+        fh.write(text)
+        fh.close()
+        return self.path(name)
+
+    def fixture(self):
+        """Concordance and bibid data with col1 and col2 matches, some on the same line"""
+        random.seed(4)
+        lines = []
+        bibids = []
+        for r in range(2000):
+            oclcnum2 = 1000+r*10
+            workid = (str(500+r//3) if r%13 else 'NONE')
+            old = [oclcnum2+k for k in range(1,random.randint(2,4))]
+            for oclcnum1 in [oclcnum2]+old:
+                lines.append("%d\t%d\t%s\n" % (oclcnum1,oclcnum2,workid))
+            if (r%3==0):
+                bibids.append("b%d %d\n" % (r,oclcnum2))
+            if (r%5==0):
+                bibids.append("c%d %s\n" % (r," ".join([str(x) for x in old])))
+            if (r%7==0):
+                bibids.append("d%d %d %d\n" % (r,oclcnum2,old[0]))
+        random.shuffle(lines)
+        lines.insert(10,'bad line\n')
+        return (self.write('conc.gz',''.join(lines)),self.write('bo.gz',''.join(bibids)))
+
+    def outputs(self,bibid_file,concordance,name,compact_index=False):
+        """Run matching, return (counts, pairs, workid bibids, oclcnum workid pairs) outputs"""
+        files = [self.path(name+x) for x in ('_pairs.gz','_wb.gz','_op.gz')]
+        bo = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_workid_bibids=True,
+                                                write_oclcnum_workid_pairs=True,write_pairs=files[0],
+                                                compact_index=compact_index)
+        if (os.path.isdir(concordance)):
+            ci = concordance_index.concordance_index(concordance)
+            counts = ci.match(bo)
+            ci.close()
+        else:
+            counts = mx_get_oclc_workids.read_concordance(bo,concordance)
+        bo.write_workid_to_bibid_data(files[1])
+        bo.write_oclccn2oclcwn(files[2])
+        bo.close()
+        return [counts]+[gzip.open(f).read() for f in files]
+
+    def test_same_as_scan(self):
+        (conc,bibids) = self.fixture()
+        meta = concordance_index.build(conc,self.path('idx'),max_items=500,tmpdir=self.tmpdir)
+        self.assertEqual(meta['bad_lines'], 1)
+        scan = self.outputs(bibids,conc,'scan')
+        self.assertTrue(scan[0][1]>0 and scan[0][2]>0)
+        self.assertTrue(len(scan[1].split('\n'))>1000)
+        for compact_index in (False,True):
+            self.assertEqual(self.outputs(bibids,self.path('idx'),'idx',compact_index), scan)
+            self.assertEqual(self.outputs(bibids,conc,'compact',compact_index), scan)
+
+    def test_old_version_rejected(self):
+        (conc,bibids) = self.fixture()
+        concordance_index.build(conc,self.path('idx'),tmpdir=self.tmpdir)
+        meta_file = self.path(os.path.join('idx','meta.json'))
+        meta = json.load(open(meta_file))
+        meta['version'] = 1
+        json.dump(meta,open(meta_file,'w'))
+        self.assertRaises(ValueError, concordance_index.concordance_index, self.path('idx'))
+
+if __name__ == '__main__':
+    unittest.main()
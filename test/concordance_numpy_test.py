@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+#
+# Check that the NumPy concordance scan gives the same matches and
+# counts as the plain scan. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import logging
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mx_get_oclc_workids
+try:
+    import concordance_numpy
+except ImportError:
+    concordance_numpy = None
+
+LINES = ['100 200 7\n',
+         '5 300 8\n',
+         '200 400 NONE\n',
+         'bad line\n',
+         '300 999 9\n',
+         '1 2 NONE5\n',
+         '400 500 10']
+
+
+@unittest.skipIf(concordance_numpy is None, "requires numpy")
+class ConcordanceNumpyTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def compare(self,concordance_file,bibid_file,block_size):
+        bo1 = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_workid_bibids=True,write_oclcnum_workid_pairs=True)
+        counts1 = mx_get_oclc_workids.read_concordance(bo1,concordance_file)
+        bo2 = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_workid_bibids=True,write_oclcnum_workid_pairs=True)
+        counts2 = concordance_numpy.read_concordance(bo2,concordance_file,block_size=block_size)
+        self.assertEqual(counts1, counts2)
+        self.assertEqual(bo1.works, bo2.works)
+        self.assertEqual(bo1.oclccn2oclcwn, bo2.oclccn2oclcwn)
+        return counts2
+
+    def test_parse_block(self):
+        data = concordance_numpy.parse_block('1 2 3\n 4\t5 NONE \r\n')
+        self.assertEqual(data.tolist(), [[1,2,3],[4,5,concordance_numpy.NONE_WORKID]])
+        for text in ['1 2\n3 4 5 6\n', '1 2 3\n\n', '1 2 NONE5\n', '1 NONE 3\n', '1 2 -3\n', '1 2 3x\n']:
+            self.assertEqual(concordance_numpy.parse_block(text), None)
+
+    def test_same_as_plain_scan(self):
+        for block_size in (100,7777,concordance_numpy.BLOCK_SIZE):
+            self.assertEqual(self.compare('test/oclc_conc_100k.gz','test/bo_10000.gz',block_size),
+                             (100000,0,26,22))
+
+    def test_bad_lines(self):
+        tmpdir = tempfile.mkdtemp()
+        conc = os.path.join(tmpdir,'conc.gz')
+        bibids = os.path.join(tmpdir,'bibids.gz')
+        gzip.open(conc,'wb').write(''.join(LINES))
+        gzip.open(bibids,'wb').write('b1 100\nb2 300\nb3 400\n')
+        try:
+            for block_size in (1,20,1000):
+                self.assertEqual(self.compare(conc,bibids,block_size), (7,3,1,1))
+        finally:
+            os.remove(conc)
+            os.remove(bibids)
+            os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+#
+# Check that the sort-merge join gives the same matches and outputs as
+# the hash probe. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import random
+import logging
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import concordance_sort
+import mx_get_oclc_workids
+
+
+class ConcordanceSortTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self,name,text):
+        file = os.path.join(self.tmpdir,name)
+        fh = gzip.open(file,'wb')
+        fh.write(text)
+        fh.close()
+        return file
+
+    def fixture(self):
+        """Concordance and bibid data with col1 and col2 matches
+
+        Records have a current number and some old numbers, bibids have
+        old or current numbers, some both so that lines have col2 and
+        col1 matches at once.
+        """
+        random.seed(2)
+        lines = []
+        bibids = []
+        for r in range(2000):
+            oclcnum2 = 1000+r*10
+            workid = (str(500+r//3) if r%17 else 'NONE')
+            old = [oclcnum2+k for k in range(1,random.randint(2,4))]
+            for oclcnum1 in [oclcnum2]+old:
+                lines.append("%d\t%d\t%s\n" % (oclcnum1,oclcnum2,workid))
+            if (r%3==0):
+                bibids.append("b%d %d\n" % (r,oclcnum2))
+            if (r%5==0):
+                bibids.append("c%d %s\n" % (r," ".join([str(x) for x in old])))
+            if (r%7==0):
+                bibids.append("d%d %d %d\n" % (r,oclcnum2,old[0]))
+        random.shuffle(lines)
+        lines.insert(10,'bad line\n')
+        return (self.write('conc.gz',''.join(lines)),self.write('bo.gz',''.join(bibids)))
+
+    def bibid_oclcnums(self,file):
+        return mx_get_oclc_workids.bibid_oclcnums(file=file,write_workid_bibids=True,
+                                                  write_oclcnum_workid_pairs=True)
+
+    def test_same_as_hash_probe(self):
+        (conc,bibids) = self.fixture()
+        bo1 = self.bibid_oclcnums(bibids)
+        counts1 = mx_get_oclc_workids.read_concordance(bo1,conc)
+        self.assertTrue(counts1[1]>0 and counts1[2]>0)
+        cache_dir = os.path.join(self.tmpdir,'cache')
+        os.mkdir(cache_dir)
+        for run in ('build','cached'):
+            bo2 = self.bibid_oclcnums(None)
+            counts2 = concordance_sort.merge_join(bo2,bo2.iter_bibid_to_oclcnums(bibids),conc,
+                                                  cache_dir=cache_dir,max_items=100,tmpdir=self.tmpdir)
+            self.assertEqual(counts2[:4], counts1)
+            self.assertEqual(bo2.works, bo1.works)
+            self.assertEqual(sorted(zip(*bo2.oclccn2oclcwn)), sorted(zip(*bo1.oclccn2oclcwn)))
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+    def test_cache_not_next_to_concordance(self):
+        (conc,bibids) = self.fixture()
+        tmpdir = os.path.join(self.tmpdir,'tmp')
+        os.mkdir(tmpdir)
+        bo = self.bibid_oclcnums(None)
+        concordance_sort.merge_join(bo,bo.iter_bibid_to_oclcnums(bibids),conc,tmpdir=tmpdir)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['bo.gz','conc.gz','tmp'])
+        self.assertEqual(len(os.listdir(tmpdir)), 3)
+        # no default cache location
+        self.assertRaises(ValueError, concordance_sort.merge_join, bo, bo.iter_bibid_to_oclcnums(bibids), conc)
+
+    def test_cache_keyed_on_path(self):
+        (conc,bibids) = self.fixture()
+        other = os.path.join(self.tmpdir,'other')
+        os.mkdir(other)
+        shutil.copy(conc,other)
+        cache_dir = os.path.join(self.tmpdir,'cache')
+        os.mkdir(cache_dir)
+        for file in (conc,os.path.join(other,'conc.gz')):
+            bo = self.bibid_oclcnums(None)
+            concordance_sort.merge_join(bo,bo.iter_bibid_to_oclcnums(bibids),file,cache_dir=cache_dir,tmpdir=self.tmpdir)
+        # same basename, separate caches
+        self.assertEqual(len(os.listdir(cache_dir)), 6)
+        self.assertNotEqual(concordance_sort.cache_paths(conc,cache_dir),
+                            concordance_sort.cache_paths(os.path.join(other,'conc.gz'),cache_dir))
+
+if __name__ == '__main__':
+    unittest.main()
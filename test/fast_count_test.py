@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+#
+# Check that fast_count gives the same counts as parsing, for MARCXML
+# with prefixes, comments and CDATA, and as splitting MARC21. Run from
+# the top level directory.
+#
+import os.path
+import sys
+import unittest
+import logging
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gzio
+import marcxml_reader
+import marc21_records
+import fast_count
+
+AWKWARD = """<?xml version="1.0"?>
+<!DOCTYPE collection [ <!ENTITY x "<record>"> ]>
+<?pi <record> ?>
+<marc:collection xmlns:marc="http://www.loc.gov/MARC21/slim">
+<!-- <marc:record> commented out </marc:record> -->
+<marc:record><marc:controlfield tag="001">1</marc:controlfield></marc:record>
+<marc:records/>
+<marc:record
+  type="Bibliographic"><marc:datafield tag="500" ind1=" " ind2=" "><marc:subfield code="a"><![CDATA[<record>]]></marc:subfield></marc:datafield></marc:record>
+<record xmlns="http://www.loc.gov/MARC21/slim"><leader>00000nam a2200000 a 4500</leader></record>
+</marc:collection>
+"""
+
+
+class FastCountTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.chunk_size = fast_count.CHUNK_SIZE
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        fast_count.CHUNK_SIZE = self.chunk_size
+
+    def test_xml(self):
+        # small chunks so that tags and comments span chunks
+        fast_count.CHUNK_SIZE = 7
+        for file in ('test/batch.xml.gz','test/oclc_sample.xml'):
+            expected = len(list(marcxml_reader.parse_xml(gzio.open_input(file),tags=())))
+            c = fast_count.counter()
+            self.assertEqual(c.count_xml(gzio.open_input(file)),expected)
+            c = fast_count.counter(validate=2)
+            self.assertEqual(c.count_xml(gzio.open_input(file)),expected)
+            self.assertEqual((c.validated,c.failed),((expected+1)//2,0))
+
+    def test_awkward_xml(self):
+        for chunk_size in (5,17,1000):
+            fast_count.CHUNK_SIZE = chunk_size
+            c = fast_count.counter(validate=1)
+            self.assertEqual(c.count_xml(cStringIO.StringIO(AWKWARD)),3)
+            self.assertEqual((c.validated,c.failed),(3,0))
+        c = fast_count.counter(validate=1)
+        self.assertEqual(c.count_xml(cStringIO.StringIO(AWKWARD.replace('</marc:datafield>',''))),3)
+        self.assertEqual(c.failed,1)
+
+    def test_marc21(self):
+        data = open('test/test.dat','rb').read()
+        raws = list(marc21_records.raw_records(cStringIO.StringIO(data)))
+        # unreadable length and a truncated last record
+        raws[1] = 'xxxxx' + raws[1][5:]
+        data = ''.join(raws) + raws[2][:100]
+        fast_count.CHUNK_SIZE = 50
+        c = fast_count.counter()
+        self.assertEqual(c.count_marc21(cStringIO.StringIO(data)),len(raws)+1)
+        c = fast_count.counter(validate=1)
+        self.assertEqual(c.count_marc21(cStringIO.StringIO(data)),len(raws)+1)
+        self.assertEqual((c.validated,c.failed),(len(raws)+1,1))
+
+if __name__ == '__main__':
+    unittest.main()
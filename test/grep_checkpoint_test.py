@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+# Check checkpoint manifest bookkeeping used by mx_grep_oclc.py
+# --checkpoint. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import shutil
+import tempfile
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import grep_checkpoint
+
+OPTIONS = {'engine': 'lean', 'xml': None, 'marc21': None, 'verbose': None}
+STATS = {'records_seen': 1}
+
+
+class GrepCheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+        self.dir = os.path.join(self.tmpdir,'cp')
+        self.file = os.path.join(self.tmpdir,'in.xml')
+        open(self.file,'w').write('<record/>')
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def done(self,cp,data='out\n',error=None):
+        open(cp.shard(self.file),'w').write(data)
+        cp.record(self.file,STATS,error)
+
+    def test_resume(self):
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS)
+        self.assertFalse(cp.is_done(self.file))
+        self.done(cp)
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS)
+        self.assertTrue(cp.is_done(self.file))
+        out = cStringIO.StringIO()
+        self.assertEqual(cp.merge([self.file],out),[STATS])
+        self.assertEqual(out.getvalue(),'out\n')
+
+    def test_error_redone(self):
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS)
+        self.done(cp,error='bad gzip')
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS)
+        self.assertFalse(cp.is_done(self.file))
+
+    def test_changes(self):
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS)
+        self.done(cp)
+        cp = grep_checkpoint.checkpoint(self.dir,{'engine': 'fast'})
+        self.assertFalse(cp.is_done(self.file))
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS)
+        os.utime(self.file,(0,0))
+        self.assertFalse(cp.is_done(self.file))
+        # same content with new mtime is not redone if hashed
+        cp = grep_checkpoint.checkpoint(self.dir,OPTIONS,use_hash=True)
+        self.done(cp)
+        os.utime(self.file,(1000,1000))
+        self.assertTrue(cp.is_done(self.file))
+        open(self.file,'w').write('<record>')
+        self.assertFalse(cp.is_done(self.file))
+
+if __name__ == '__main__':
+    unittest.main()
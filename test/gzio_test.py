@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# Check that gzio reads and writes the same data as gzip, both with
+# external programs and with threads. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gzio
+
+
+class GzioTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = (os.environ.get('MX_GZIO_EXTERNAL'),gzio.CHUNK_SIZE,gzio.BLOCK_SIZE)
+        # small sizes so lines and blocks span chunks
+        gzio.CHUNK_SIZE = 1000
+        gzio.BLOCK_SIZE = 5000
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        (external,gzio.CHUNK_SIZE,gzio.BLOCK_SIZE) = self.saved
+        if (external is None):
+            os.environ.pop('MX_GZIO_EXTERNAL',None)
+        else:
+            os.environ['MX_GZIO_EXTERNAL'] = external
+        for file in os.listdir(self.tmpdir):
+            os.remove(os.path.join(self.tmpdir,file))
+        os.rmdir(self.tmpdir)
+
+    def check_modes(self,check):
+        for external in ('1','0'):
+            os.environ['MX_GZIO_EXTERNAL'] = external
+            check()
+
+    def test_read(self):
+        lines = list(gzip.open('test/bo_10000.gz','rb'))
+        def check():
+            fh = gzio.open_input('test/bo_10000.gz')
+            self.assertEqual(lines, list(fh))
+            fh.close()
+            fh = gzio.open_input('test/bo_10000.gz')
+            self.assertEqual(lines[0], fh.readline())
+            self.assertEqual(''.join(lines[1:]), fh.read(100) + fh.read())
+            fh.close()
+            # early close is fine
+            fh = gzio.open_input('test/bo_10000.gz')
+            fh.read(10)
+            fh.close()
+        self.check_modes(check)
+
+    def test_read_plain(self):
+        fh = gzio.open_input('test/oclc_sample.xml')
+        self.assertEqual(open('test/oclc_sample.xml','rb').read(), fh.read())
+        fh.close()
+
+    def test_write(self):
+        data = gzip.open('test/bo_10000.gz','rb').read()
+        file = os.path.join(self.tmpdir,'out.gz')
+        def check():
+            fh = gzio.open_output(file)
+            for line in data.splitlines(True):
+                fh.write(line)
+            fh.close()
+            self.assertEqual(data, gzip.open(file,'rb').read())
+            fh = gzio.open_output(file)
+            fh.close()
+            self.assertEqual('', gzip.open(file,'rb').read())
+        self.check_modes(check)
+
+    def test_truncated(self):
+        file = os.path.join(self.tmpdir,'trunc.gz')
+        open(file,'wb').write(open('test/bo_10000.gz','rb').read()[:5000])
+        def check():
+            fh = gzio.open_input(file)
+            self.assertRaises(IOError, fh.read)
+            fh.close()
+        self.check_modes(check)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Check that matching several institutions in one concordance pass
+# gives each the same matches as a run of its own. Run from the top
+# level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import logging
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mx_get_oclc_workids
+
+# 300 is an old number for 400 so line 2 is a col2 match for b but a
+# col1 match for a
+CONCORDANCE = ('100\t100\t7\n'
+               '300\t400\t8\n'
+               '400\t400\t8\n'
+               '500\t600\t9\n'
+               '600\t600\tNONE\n')
+BIBIDS = {'a': 'a1 100\na2 300\na3 600\n',
+          'b': 'b1 400\nb2 100\n'}
+
+
+class InstitutionsTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self,name,text):
+        file = os.path.join(self.tmpdir,name)
+        fh = gzip.open(file,'wb')
+        fh.write(text)
+        fh.close()
+        return file
+
+    def bibid_oclcnums(self,file,**kwargs):
+        return mx_get_oclc_workids.bibid_oclcnums(file=file,write_workid_bibids=True,
+                                                  write_oclcnum_workid_pairs=True,**kwargs)
+
+    def compare(self,files,concordance):
+        """Match files together and separately, return the institutions"""
+        names = sorted(files)
+        bos = [self.bibid_oclcnums(files[name]) for name in names]
+        inst = mx_get_oclc_workids.institutions(names,bos,write_overlap=True)
+        counts = mx_get_oclc_workids.read_concordance(inst,concordance)
+        for (name,bo) in zip(names,bos):
+            own = self.bibid_oclcnums(files[name])
+            mx_get_oclc_workids.read_concordance(own,concordance)
+            self.assertEqual(bo.works, own.works)
+            self.assertEqual(bo.oclccn2oclcwn, own.oclccn2oclcwn)
+        return (inst,counts)
+
+    def test_small(self):
+        files = dict([(name,self.write(name+'.gz',BIBIDS[name])) for name in BIBIDS])
+        (inst,counts) = self.compare(files,self.write('conc.gz',CONCORDANCE))
+        self.assertEqual(counts, (5,0,4,1))
+        self.assertEqual(sorted(inst.bibids.keys()), [100,300,400,600])
+        self.assertEqual(inst.bibids[100], [(0,'a1'),(1,'b2')])
+        self.assertEqual(inst.bos[0].works, {7: ['a1'], 8: ['a2'], 9: ['a3']})
+        self.assertEqual(inst.bos[1].works, {7: ['b2'], 8: ['b1','b1']})
+        overlap = os.path.join(self.tmpdir,'overlap.gz')
+        inst.write_overlap_table(overlap)
+        lines = gzip.open(overlap).read().split('\n')
+        self.assertEqual(lines[0], '#workid institutions')
+        self.assertEqual(lines[1:3], ['#2 workids in a and b','#1 workids in a'])
+        self.assertEqual([l for l in lines if l and not l.startswith('#')], ['7 a b','8 a b'])
+
+    def test_split_file(self):
+        lines = gzip.open('test/bo_10000.gz').readlines()
+        files = {'odd': self.write('odd.gz',''.join(lines[1::2])),
+                 'even': self.write('even.gz',''.join(lines[0::2]+lines[:1000]))}
+        (inst,counts) = self.compare(files,'test/oclc_conc_100k.gz')
+        self.assertEqual(len(inst.bibids), len(set(inst.bos[0].bibids.keys())|set(inst.bos[1].bibids.keys())))
+
+if __name__ == '__main__':
+    unittest.main()
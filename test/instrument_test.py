@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+#
+# Check instrument counters, phases, input progress and the JSON lines
+# and Prometheus outputs. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import json
+import logging
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import gzio
+import instrument
+
+
+class InstrumentTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def test_snapshot(self):
+        m = instrument.metrics()
+        m.set_inputs(['test/bo_10000.gz','test/oclc_sample.xml'])
+        m.count('lines',5)
+        m.count('lines')
+        m.add_source(lambda: {'records': 7})
+        m.phase('read')
+        fh = gzio.open_input('test/bo_10000.gz')
+        m.reading('test/bo_10000.gz',fh)
+        fh.read()
+        fh.close()
+        m.phase('write')
+        with m.timer('flush'):
+            pass
+        s = m.snapshot()
+        self.assertEqual(s['phase'],'write')
+        self.assertEqual((s['counters']['lines'],s['counters']['records']),(6,7))
+        self.assertTrue('phase_read' in s['timers'] and 'phase_write' in s['timers'] and 'flush' in s['timers'])
+        self.assertEqual(s['input']['bytes_done'],os.path.getsize('test/bo_10000.gz'))
+        self.assertEqual(s['input']['bytes_total'],os.path.getsize('test/bo_10000.gz')+os.path.getsize('test/oclc_sample.xml'))
+        self.assertTrue(s['input']['eta_s']>=0 and s['max_rss_kb']>0)
+        m.input_done('test/oclc_sample.xml')
+        self.assertEqual(m.snapshot()['input']['fraction'],1.0)
+        text = instrument.prometheus_text(s)
+        self.assertTrue('mx_lines_total{script="%s"} 6.0\n' % (m.script) in text)
+        self.assertTrue('mx_phase{script="%s",phase="write"} 1.0\n' % (m.script) in text)
+
+    def test_json_lines(self):
+        file = os.path.join(self.tmpdir,'metrics.jsonl')
+        m = instrument.metrics()
+        m.start_reporting(file=file,interval=0.01)
+        m.count('lines')
+        m.finish()
+        lines = [json.loads(line) for line in open(file)]
+        self.assertTrue(len(lines)>=1)
+        self.assertTrue(lines[-1]['final'])
+        self.assertEqual(lines[-1]['counters']['lines'],1)
+
+if __name__ == '__main__':
+    unittest.main()
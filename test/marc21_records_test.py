@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+#
+# Check that splitting MARC21 into raw records gives the same records
+# as pymarc, and that a bad record doesn't stop the rest being read.
+# Run from the top level directory.
+#
+import os.path
+import sys
+import unittest
+import logging
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pymarc
+import marc21_records
+import mx_grep_oclc
+
+
+class Marc21RecordsTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.data = open('test/test.dat','rb').read()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_same_as_pymarc(self):
+        expected = [r.as_marc() for r in pymarc.MARCReader(cStringIO.StringIO(self.data))]
+        # small chunks so that records span chunks
+        raws = list(marc21_records.raw_records(cStringIO.StringIO(self.data),chunk_size=100))
+        self.assertEqual(len(raws),len(expected))
+        self.assertEqual([pymarc.Record(r).as_marc() for r in raws],expected)
+        self.assertEqual(sum([len(b) for b in marc21_records.batches(raws,batch_bytes=2000)]),len(raws))
+
+    def test_bad_record(self):
+        raws = list(marc21_records.raw_records(cStringIO.StringIO(self.data)))
+        bibid = marc21_records.raw_bibid(raws[1])
+        self.assertEqual(bibid,pymarc.Record(raws[1])['001'].value())
+        # unreadable length and base address in second record
+        raws[1] = 'xxxxx' + raws[1][5:12] + '99999' + raws[1][17:]
+        split = list(marc21_records.raw_records(cStringIO.StringIO(''.join(raws)),chunk_size=100))
+        self.assertEqual(split,raws)
+        self.assertEqual(marc21_records.raw_bibid(raws[1]),bibid)
+        # pymarc needs the base address, decode_record() doesn't
+        mg = mx_grep_oclc.mx_grepper(out=cStringIO.StringIO())
+        for raw in split:
+            mg.grep_raw(raw,'pymarc')
+        mg.grep_raw(raws[2][:100],'pymarc')
+        self.assertEqual(mg.records_seen,len(raws)+1)
+        self.assertEqual(mg.records_bad,2)
+        mg = mx_grep_oclc.mx_grepper(out=cStringIO.StringIO())
+        for raw in split:
+            mg.grep_raw(raw)
+        mg.grep_raw(raws[2][:100])
+        mg.grep_raw(raws[2][:30]+marc21_records.END_OF_RECORD)
+        self.assertEqual(mg.records_seen,len(raws)+2)
+        self.assertEqual(mg.records_bad,2)
+
+    def test_decode_same_as_pymarc(self):
+        for raw in marc21_records.raw_records(cStringIO.StringIO(self.data)):
+            record = pymarc.Record(raw)
+            lean = marc21_records.decode_record(raw)
+            for field in record.get_fields():
+                lean_field = lean.get_fields(field.tag).pop(0)
+                if (field.is_control_field()):
+                    self.assertEqual(lean_field.value(),field.value())
+                else:
+                    self.assertEqual(lean_field.indicators,field.indicators)
+                    self.assertEqual([x for s in lean_field.subfields for x in s],field.subfields)
+            lean = marc21_records.decode_record(raw,mx_grep_oclc.TAGS)
+            self.assertEqual(sorted(lean.fields.keys()),
+                             sorted(set([f.tag for f in record.get_fields(*mx_grep_oclc.TAGS)])))
+
+    def test_decode_bad_utf8(self):
+        raw = list(marc21_records.raw_records(cStringIO.StringIO(self.data)))[0]
+        raw = raw[:9] + 'a' + raw[10:]
+        record = marc21_records.decode_record(raw)
+        field = record.get_fields('245')[0]
+        i = raw.find(field.subfields[0][1].encode('utf-8'))
+        bad = raw[:i] + '\xff' + raw[i+1:]
+        self.assertRaises(UnicodeDecodeError, pymarc.Record, bad)
+        self.assertEqual(marc21_records.decode_record(bad).get_fields('245')[0].subfields[0][1],
+                         u'\ufffd' + field.subfields[0][1][1:])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+#
+# Check that lean marcxml_reader gives the same data as pymarc for
+# the fields it materializes. Run from the top level directory.
+#
+import os.path
+import sys
+import unittest
+import gzip
+import pymarc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import marcxml_reader
+
+
+class MarcxmlReaderTest(unittest.TestCase):
+
+    def test_map_xml(self):
+        self.seen = 0
+        def count(record):
+            self.seen += 1
+        fh = gzip.open('test/batch.xml.gz','rb')
+        marcxml_reader.map_xml(count, fh, tags=())
+        self.assertEqual(2, self.seen)
+
+    def test_same_as_pymarc(self):
+        records1 = pymarc.parse_xml_to_array(gzip.open('test/batch.xml.gz','rb'))
+        records2 = list(marcxml_reader.parse_xml(gzip.open('test/batch.xml.gz','rb')))
+        self.assertEqual(len(records1), len(records2))
+        for (record1,record2) in zip(records1,records2):
+            self.assertEqual(record1.leader, record2.leader)
+            self.assertEqual(record1['001'].value(), record2['001'].value())
+            for tag in ['035','245','650']:
+                fields1 = record1.get_fields(tag)
+                fields2 = record2.get_fields(tag)
+                self.assertEqual(len(fields1), len(fields2))
+                for (field1,field2) in zip(fields1,fields2):
+                    self.assertEqual(field1['a'], field2['a'])
+                    self.assertEqual(field1.indicators, field2.indicators)
+                    self.assertEqual(field1.get_subfields('a','x'), field2.get_subfields('a','x'))
+
+    def test_tags(self):
+        records = list(marcxml_reader.parse_xml(gzip.open('test/batch.xml.gz','rb'), tags=['001','035']))
+        self.assertEqual(records[0]['001'].value(), '5637241')
+        self.assertEqual(records[0]['245'], None)
+        self.assertEqual(records[0].get_fields('035'), [])
+        self.assertEqual(records[1]['035']['a'], '(OCoLC)ocm44279786')
+        self.assertEqual(records[1].get_fields('650'), [])
+
+    def test_bad_tag(self):
+        records = list(marcxml_reader.parse_xml(open('test/bad_tag.xml')))
+        self.assertEqual(len(records), 1)
+
+if __name__ == '__main__':
+    unittest.main()
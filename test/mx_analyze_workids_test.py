@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# Check that mx_analyze_workids.py --external-sort gives the same
+# output and log as the in-memory analysis. Run from the top level
+# directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import random
+import logging
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mx_analyze_workids
+
+
+class ListHandler(logging.Handler):
+    """Keep messages logged"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self,record):
+        self.messages.append(record.getMessage())
+
+
+class ExternalSortTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.handler = ListHandler()
+        self.logger = logging.getLogger()
+        self.logger.addHandler(self.handler)
+        self.level = self.logger.level
+        self.logger.setLevel(logging.WARNING)
+
+    def tearDown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self.level)
+        shutil.rmtree(self.tmpdir)
+
+    def pairs_file(self):
+        """Workid bibid pairs with repeated pairs and bibids on several workids"""
+        random.seed(3)
+        lines = ['#workid bibid\n']
+        for n in range(3000):
+            workid = random.randint(1,400)*1000+7
+            bibid = str(random.randint(1,2500))
+            lines.append("%d %s\n" % (workid,bibid))
+            if (n%50==0):
+                lines.append(lines[-1])
+        lines.insert(100,'not_a_workid 12\n')
+        file = os.path.join(self.tmpdir,'pairs.gz')
+        fh = gzip.open(file,'wb')
+        fh.write(''.join(lines))
+        fh.close()
+        return file
+
+    def analysis_log(self):
+        """Dupe and histogram count messages, and bad line messages, logged since last call
+
+        Bad lines are logged as the pairs are read so come before the
+        dupes with --external-sort. The histogram examples are not
+        included as they differ with --external-sort.
+        """
+        messages = [m for m in self.handler.messages if m.startswith('Dupe:') or m.startswith('histogram:')]
+        bad = [m for m in self.handler.messages if 'bad line' in m]
+        self.handler.messages = []
+        return (messages,bad)
+
+    def test_same_as_in_memory(self):
+        pairs = self.pairs_file()
+        out1 = os.path.join(self.tmpdir,'works1.gz')
+        w = mx_analyze_workids.workids(pairs)
+        w.write_works_data(out1)
+        w.stats()
+        log1 = self.analysis_log()
+        self.assertTrue(len([m for m in log1[0] if m.startswith('Dupe:')])>100)
+        self.assertEqual(len(log1[1]), 1)
+        for max_items in (100,1000000):
+            out2 = os.path.join(self.tmpdir,'works2.gz')
+            w = mx_analyze_workids.workids()
+            w.analyze_sorted(pairs,out2,max_items=max_items,tmpdir=self.tmpdir)
+            self.assertEqual(self.analysis_log(), log1)
+            self.assertEqual(gzip.open(out2).read(), gzip.open(out1).read())
+        # only the output files are left, spill files removed
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['pairs.gz','works1.gz','works2.gz'])
+
+if __name__ == '__main__':
+    unittest.main()
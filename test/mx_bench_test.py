@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+#
+# Check that mx_bench.py generates the same corpus each time, that the
+# MARCXML and MARC21 files have the same OCLC numbers, and regression
+# flagging. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import optparse
+import shutil
+import tempfile
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mx_bench
+import mx_grep_oclc
+
+OPTS = {'xml': None, 'marc21': None, 'verbose': None,
+        'pymarc': None, 'fast_scan': None, 'split_records': None}
+
+
+class MxBenchTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def grep(self,file):
+        out = cStringIO.StringIO()
+        mg = mx_grep_oclc.mx_grepper(out=out)
+        mx_grep_oclc.grep_file(mg,file,optparse.Values(OPTS))
+        return (out.getvalue(),mg.stats())
+
+    def test_generate(self):
+        for name in ('a','b'):
+            mx_bench.generate(os.path.join(self.tmpdir,name),records=500,lines=1000,files=2)
+        files = sorted(os.listdir(os.path.join(self.tmpdir,'a')))
+        self.assertEqual(files,['bib.001.mrc.gz','bib.001.xml.gz','bib.002.mrc.gz','bib.002.xml.gz',
+                                'concordance.gz','manifest.json'])
+        gen = mx_bench.corpus_generator(records=500,lines=1000)
+        self.assertEqual(list(gen.concordance_iter()),list(gen.concordance_iter()))
+        (xml,stats) = self.grep(os.path.join(self.tmpdir,'a','bib.001.xml.gz'))
+        self.assertEqual(stats['records_seen'],250)
+        self.assertTrue(stats['fields_duped']>0 and stats['fields_bad']>0 and stats['fields_esuffix']>0)
+        self.assertEqual(self.grep(os.path.join(self.tmpdir,'b','bib.001.mrc.gz')),(xml,stats))
+
+    def test_compare(self):
+        baseline = {'stages': {'grep_xml': {'wall': 10.0, 'max_rss_kb': 1000},
+                               'analyze': {'wall': 1.0, 'max_rss_kb': 1000}}}
+        results = {'stages': {'grep_xml': {'wall': 10.5, 'max_rss_kb': 1300},
+                              'analyze': {'wall': 1.2, 'max_rss_kb': 1000},
+                              'count_xml': {'wall': 1.0, 'max_rss_kb': 1000}}}
+        self.assertEqual(mx_bench.compare(baseline,results),
+                         [('analyze','wall',1.0,1.2),('grep_xml','max_rss_kb',1000,1300)])
+        self.assertEqual(mx_bench.compare(baseline,results,threshold=0.3,rss_threshold=0.5),[])
+
+if __name__ == '__main__':
+    unittest.main()
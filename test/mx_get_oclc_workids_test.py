@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# Check mx_get_oclc_workids.py outputs. Run from the top level
+# directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import logging
+import tempfile
+import shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mx_get_oclc_workids
+
+# oclcnums and workids of different lengths so that string order
+# differs from numeric order, and repeated matches
+BIBIDS = 'b1 12\nb2 123\nb3 2\nb4 1234\nb5 12 99\nb6 2\n'
+CONCORDANCE = ('12\t12\t100\n'
+               '123\t123\t9\n'
+               '2\t2\t10\n'
+               '1234\t1234\t1000\n'
+               '99\t12\t9\n'
+               '5\t123\t10\n'
+               '12\t12\t100\n')
+
+
+class WriteTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def write(self,name,text):
+        file = os.path.join(self.tmpdir,name)
+        fh = gzip.open(file,'wb')
+        fh.write(text)
+        fh.close()
+        return file
+
+    def string_set_output(self,bibid_file,concordance_file):
+        """Output of --write-oclcnum-workid-pairs as a set of strings"""
+        bo = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file)
+        pairs = set()
+        bo.add_work = lambda oclcnum,bibid,workid: pairs.add("%d,%d" % (oclcnum,workid))
+        mx_get_oclc_workids.read_concordance(bo,concordance_file)
+        return ''.join([pair + "\n" for pair in sorted(pairs)])
+
+    def check_oclcnum_workid_pairs(self,bibid_file,concordance_file):
+        expected = self.string_set_output(bibid_file,concordance_file)
+        bo = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_oclcnum_workid_pairs=True)
+        mx_get_oclc_workids.read_concordance(bo,concordance_file)
+        out = os.path.join(self.tmpdir,'pairs.gz')
+        for max_items in (2,1000000):
+            bo.write_oclccn2oclcwn(out,max_items=max_items,tmpdir=self.tmpdir)
+            self.assertEqual(gzip.open(out).read(), expected)
+        return expected
+
+    def test_oclcnum_workid_pairs(self):
+        expected = self.check_oclcnum_workid_pairs(self.write('bo.gz',BIBIDS),self.write('conc.gz',CONCORDANCE))
+        self.assertEqual(expected, '12,100\n12,9\n123,10\n123,9\n1234,1000\n2,10\n')
+
+    def test_oclcnum_workid_pairs_100k(self):
+        self.check_oclcnum_workid_pairs('test/bo_10000.gz','test/oclc_conc_100k.gz')
+
+    def test_large_numbers(self):
+        bo = mx_get_oclc_workids.bibid_oclcnums(write_oclcnum_workid_pairs=True,write_workid_bibids=True)
+        bo.add_work(2**40,'b1',2**33)
+        bo.add_work(2**31,'b2',2045314971)
+        self.assertRaises(OverflowError, bo.add_work, 5, 'b3', 2**64)
+        # nothing kept from the failed match
+        self.assertEqual(sorted(bo.works), [2045314971,2**33])
+        out = os.path.join(self.tmpdir,'pairs.gz')
+        bo.write_oclccn2oclcwn(out)
+        self.assertEqual(gzip.open(out).read(), '1099511627776,8589934592\n2147483648,2045314971\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+#
+# Check that mx_grep_oclc.py --jobs gives the same output, in file
+# order, and the same totals as a serial run. Run from the top level
+# directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import optparse
+import shutil
+import tempfile
+import subprocess
+import cStringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mx_bench
+import mx_grep_oclc
+
+OPTS = {'xml': None, 'marc21': None, 'verbose': None,
+        'pymarc': None, 'fast_scan': None, 'split_records': None}
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mx_grep_oclc.py')
+
+
+class MxGrepOclcTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def run_grep(self,args):
+        log = os.path.join(self.tmpdir,'grep.log')
+        return subprocess.check_output([sys.executable,SCRIPT,'--logfile',log]+args)
+
+    def test_jobs_same_as_serial(self):
+        corpus = os.path.join(self.tmpdir,'corpus')
+        mx_bench.generate(corpus,records=400,lines=100,files=2)
+        files = [os.path.join(corpus,f) for f in ('bib.002.xml.gz','bib.001.mrc.gz','bib.001.xml.gz')]
+        files.append('test/oclc_sample.xml')
+        serial = self.run_grep(files)
+        self.assertEqual(self.run_grep(['-j','2']+files), serial)
+        # output is each file's output in order, then totals summed
+        out = cStringIO.StringIO()
+        total = {}
+        for file in files:
+            mg = mx_grep_oclc.mx_grepper(out=out)
+            mx_grep_oclc.grep_file(mg,file,optparse.Values(OPTS))
+            for (k,v) in mg.stats().items():
+                total[k] = total.get(k,0)+v
+        lines = serial.split('\n')
+        self.assertEqual(lines[0], '#bibid oclcnum[s]')
+        self.assertEqual('\n'.join(lines[1:-4])+'\n', out.getvalue())
+        self.assertEqual(lines[-4], '# 4 files')
+        self.assertEqual(lines[-3], '# %d records seen, %d matched, %d multi-valued' %
+                         (total['records_seen'],total['records_matched'],total['records_multi']))
+        self.assertEqual(lines[-2], '# %d field matches, %d duplicate entries, %d bad entries, %d e-suffixed (ignored)' %
+                         (total['fields_matched'],total['fields_duped'],total['fields_bad'],total['fields_esuffix']))
+        self.assertTrue(total['records_seen']>3*200 and total['records_matched']>0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Check that an incremental update gives the same workid to bibids
+# data as a full scan of the concordance with the updated bibid to
+# oclcnums data. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import gzip
+import logging
+import optparse
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import concordance_index
+import mx_get_oclc_workids
+import mx_incremental_workids
+
+OPTS = {'xml': True, 'marc21': None, 'verbose': None,
+        'pymarc': None, 'fast_scan': None}
+RECORD = '<record><controlfield tag="001">%s</controlfield>%s</record>\n'
+FIELD = '<datafield tag="035" ind1=" " ind2=" "><subfield code="a">(OCoLC)%d</subfield></datafield>'
+
+
+class MxIncrementalWorkidsTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def path(self,name):
+        return os.path.join(self.tmpdir,name)
+
+    def works(self,bibid_file):
+        """workid to bibids from full scan of test concordance"""
+        bo = mx_get_oclc_workids.bibid_oclcnums(file=bibid_file,write_workid_bibids=True)
+        mx_get_oclc_workids.read_concordance(bo,'test/oclc_conc_100k.gz')
+        return bo
+
+    def test_same_as_full_scan(self):
+        concordance_index.build('test/oclc_conc_100k.gz',self.path('idx'))
+        self.works('test/bo_10000.gz').write_workid_to_bibid_data(self.path('old_wb.gz'))
+        # oclcnums from the concordance: col1 and col2 of lines 3 and 4
+        lines = [l.split() for l in gzip.open('test/oclc_conc_100k.gz').readlines()[2:4]]
+        bibids = [l.split()[0] for l in gzip.open('test/bo_10000.gz') if l[0]!='#']
+        delta = (RECORD % (bibids[0],FIELD % int(lines[0][0])) +
+                 RECORD % (bibids[1],'') +
+                 RECORD % ('new1',FIELD % int(lines[1][1])))
+        open(self.path('delta.xml'),'w').write('<collection xmlns="http://www.loc.gov/MARC21/slim">\n%s</collection>\n' % delta)
+        (seen,new_lines) = mx_incremental_workids.read_delta([self.path('delta.xml')],optparse.Values(OPTS))
+        self.assertEqual(seen,[bibids[0],bibids[1],'new1'])
+        changed = mx_incremental_workids.patch_bibid_oclcnums('test/bo_10000.gz',self.path('new_bo.gz'),
+                                                              set(seen),new_lines,set([bibids[2]]))
+        ci = concordance_index.concordance_index(self.path('idx'))
+        bo = mx_get_oclc_workids.bibid_oclcnums(file=self.path('new_bo.gz'))
+        updates = dict([(w,mx_incremental_workids.workid_bibids(ci,bo.bibids,w)) for w in mx_incremental_workids.affected_workids(ci,changed)])
+        ci.close()
+        self.assertTrue(len(updates)>0)
+        mx_incremental_workids.patch_workid_bibids(self.path('old_wb.gz'),self.path('new_wb.gz'),updates)
+        self.works(self.path('new_bo.gz')).write_workid_to_bibid_data(self.path('full_wb.gz'))
+        self.assertEqual(gzip.open(self.path('new_wb.gz')).read(),gzip.open(self.path('full_wb.gz')).read())
+
+if __name__ == '__main__':
+    unittest.main()
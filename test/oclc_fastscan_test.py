@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+#
+# Cross-check the byte-level fast scan against the pymarc path as
+# mx_grep_oclc.py --cross-check does. Run from the top level directory.
+#
+import os.path
+import sys
+import unittest
+import gzip
+import logging
+import optparse
+import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import oclc_fastscan
+import mx_grep_oclc
+
+OPTS = {'xml': None, 'marc21': None, 'verbose': None,
+        'pymarc': None, 'fast_scan': None}
+
+
+class OclcFastscanTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_raw_records(self):
+        fs = oclc_fastscan.fast_scanner()
+        records = list(fs.raw_records(gzip.open('test/batch.xml.gz','rb')))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0][0], 'marc')
+        self.assertTrue(records[1][1].startswith('<marc:record>'))
+        self.assertTrue(records[1][1].endswith('</marc:record>'))
+
+    def test_small_chunks(self):
+        oclc_fastscan.CHUNK_SIZE = 7
+        try:
+            fs = oclc_fastscan.fast_scanner()
+            records = list(fs.records(open('test/oclc_sample.xml','rb')))
+        finally:
+            oclc_fastscan.CHUNK_SIZE = 4*1024*1024
+        self.assertEqual([r['001'].value() for r in records],
+                         ['1001','1002','1003-X','1004','1005','1006'])
+
+    def test_fallback(self):
+        fs = oclc_fastscan.fast_scanner()
+        records = list(fs.records(open('test/oclc_sample.xml','rb')))
+        self.assertEqual(fs.records_seen, 6)
+        # entity, comment and xmlns cases
+        self.assertEqual(fs.records_fallback, 3)
+        self.assertEqual(records[2]['035']['a'], '(OCoLC)555')
+        self.assertEqual([f['a'] for f in records[3].get_fields('035')], ['(OCoLC)777'])
+
+    def test_bad_utf8(self):
+        # two records with bad UTF-8 in 035$a and 001, then a good one
+        bad = ('<record><controlfield tag="001">2001</controlfield>'
+               '<datafield tag="035" ind1=" " ind2=" "><subfield code="a">(OCoLC)1\xff</subfield></datafield></record>\n'
+               '<record><controlfield tag="001">2002\xfe</controlfield></record>\n'
+               '<record><controlfield tag="001">2003</controlfield>'
+               '<datafield tag="035" ind1=" " ind2=" "><subfield code="a">(OCoLC)3\xc3\xa9</subfield></datafield>'
+               '<datafield tag="035" ind1=" " ind2=" "><subfield code="a">(OCoLC)4</subfield></datafield></record>\n')
+        data = open('test/oclc_sample.xml','rb').read().replace('</collection>',bad+'</collection>')
+        fs = oclc_fastscan.fast_scanner()
+        records = list(fs.records(StringIO.StringIO(data)))
+        self.assertEqual([r['001'].value() for r in records],
+                         ['1001','1002','1003-X','1004','1005','1006','2003'])
+        self.assertEqual([f['a'] for f in records[-1].get_fields('035')], [u'(OCoLC)3\xe9','(OCoLC)4'])
+        self.assertEqual(fs.records_failed, 2)
+
+    def test_cross_check(self):
+        opt = optparse.Values(OPTS)
+        self.assertEqual(mx_grep_oclc.cross_check_file('test/batch.xml.gz', opt), 0)
+        self.assertEqual(mx_grep_oclc.cross_check_file('test/oclc_sample.xml', opt), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+#
+# Check oclcnum.py normalization against the legacy code, with and
+# without the cache. Run from the top level directory.
+#
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import oclcnum
+
+# Prefix mix seen in 035$a/079$a, with e-suffixed, bad and non-OCLC entries
+REFS = ['(OCoLC)12345', '(OCoLC)ocm00012345', '(OCoLC)ocn123456789', '(ocolc)on1234567890',
+        'ocm00012345', 'ocn123456789', 'on1234567890', 'OCM00012345', '(OCoLC-M)4567',
+        ' (OCoLC)12345 ', '\t(OCoLC)ocm12345\n', '(OCoLC)12345e', '(OCoLC)ocm12345E',
+        'ocm12345e', '(OCoLC)12345 1234', '(OCoLC)ocmX123', '(OCoLC)', '(OCoLC) ', '(OCoLC)e',
+        '(OCoLC)-123', '(OCoLC)12a45', '(OCoLC)ocm', 'ocm', 'on', '(DLC)12345', '12345',
+        '', ' ', 'OCoLC12345', '(OCoLC)ocn00000000', '(OCoLC)ocmocm123']
+
+
+class OclcnumTest(unittest.TestCase):
+
+    def test_same_as_legacy(self):
+        for ref in REFS:
+            self.assertEqual(oclcnum.normalize(ref), oclcnum.legacy_normalize(ref), repr(ref))
+        refs = oclcnum.sample_refs(2000, 300)
+        for ref in refs:
+            self.assertEqual(oclcnum.normalize(ref), oclcnum.legacy_normalize(ref), repr(ref))
+
+    def test_classify(self):
+        self.assertEqual(oclcnum.normalize('(OCoLC)ocm00012345'), (oclcnum.VALID, 12345))
+        self.assertEqual(oclcnum.normalize('(OCoLC)12345e'), (oclcnum.ESUFFIX, '12345e'))
+        self.assertEqual(oclcnum.normalize('(OCoLC)12a45'), (oclcnum.BAD, '12a45'))
+        self.assertEqual(oclcnum.normalize('(DLC)12345'), oclcnum.NOT_OCLC)
+
+    def test_cache(self):
+        # small cache so that generations turn over
+        for cache_size in (4, 0, oclcnum.CACHE_SIZE):
+            on = oclcnum.oclcnum_normalizer(cache_size)
+            for n in range(3):
+                for ref in REFS:
+                    self.assertEqual(on.classify(ref), oclcnum.legacy_normalize(ref), repr(ref))
+            if (cache_size==0):
+                self.assertEqual(on.hits+on.misses, 0)
+            else:
+                self.assertEqual(on.hits+on.misses, 3*len(REFS))
+        self.assertEqual(on.misses, len(set(REFS)))
+        self.assertTrue(len(on.cache)+len(on.old_cache)>0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+#
+# Check that pipeline keeps results in order, bounds the items in
+# flight and passes errors back. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import random
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pipeline
+
+
+def slow_square(x):
+    time.sleep(random.random()*0.002)
+    return x*x
+
+def fail_on_7(x):
+    if (x==7):
+        raise ValueError("seven")
+    return x
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+
+    def test_order(self):
+        pl = pipeline.pipeline('test',slow_square,workers=4,queue_size=2)
+        self.read = 0
+        def items():
+            for x in range(200):
+                self.read += 1
+                yield x
+        out = []
+        def write(result):
+            # reader can't get more than the in flight limit ahead
+            self.assertTrue(self.read-len(out)<=2*2+4+1)
+            out.append(result)
+        self.assertEqual(pl.run(items(),write),200)
+        self.assertEqual(out,[x*x for x in range(200)])
+        self.assertTrue(pl.bottleneck() in ('read','work','write'))
+
+    def test_errors(self):
+        pl = pipeline.pipeline('test',fail_on_7,workers=2)
+        self.assertRaises(ValueError,pl.run,iter(range(20)),lambda x: None)
+        def bad_items():
+            yield 1
+            raise IOError("truncated")
+        pl = pipeline.pipeline('test',fail_on_7)
+        self.assertRaises(IOError,pl.run,bad_items(),lambda x: None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# Check that profiling samples units and writes pstats and collapsed
+# stacks attributed to phases. Run from the top level directory.
+#
+import os
+import os.path
+import sys
+import unittest
+import logging
+import pstats
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import instrument
+import profiling
+
+
+def get_oclcnums(n):
+    """Named like the hot path so samples are attributed to it"""
+    x = 0
+    for i in xrange(n):
+        x += i*i
+    return x
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(self.tmpdir)
+
+    def test_units(self):
+        p = profiling.profiler()
+        p.start(self.tmpdir,sample=0.25,interval=0.001,units=True)
+        instrument.phase('test')
+        work = p.sampled(get_oclcnums)
+        for n in range(8):
+            work(200000)
+        instrument.phase(None)
+        p.finish()
+        self.assertEqual((p.units_seen,p.units_profiled),(8,2))
+        stats = pstats.Stats(os.path.join(self.tmpdir,instrument._metrics.script+'.pstats'))
+        calls = [v[1] for (k,v) in stats.stats.items() if k[2]=='get_oclcnums']
+        self.assertEqual(calls,[2])
+        stacks = [l.rsplit(' ',1) for l in open(os.path.join(self.tmpdir,instrument._metrics.script+'.collapsed'))]
+        self.assertTrue(len(stacks)>0)
+        self.assertTrue(all([s.startswith('test;') for (s,n) in stacks]))
+        self.assertTrue(p.named_counts().get('get_oclcnums',0)>0)
+
+if __name__ == '__main__':
+    unittest.main()